@@ -0,0 +1,246 @@
+## Array-at-a-time versions of the containment and muon-tagging selections
+## These work on the flat columns written by event_cache.py (or any dicts with the same
+## layout) for a whole batch of events at once, and give results identical to
+## is_hadronic_contained/is_muon_tagged in example_analysis.py and kaons/lar_functions.py.
+##
+## Conventions:
+##  - Every table is a dict of columns plus an "offsets" array of length n_events+1,
+##    starting at 0, so the rows of event i are column[offsets[i]:offsets[i+1]]
+##    (EventCache.batch() returns tables in exactly this form)
+##  - Per-trajectory masks are flat boolean arrays aligned with the trajectory table
+##  - As in event_inspector.py, a track id is the index of the trajectory in
+##    Event.Trajectories, so track id t of event i is row offsets[i] + t
+##
+## When Numba is installed, the per-event loops (neutron descendants, and containment and
+## tagging with the default geometry) run as the compiled kernels in
+## jit_kernels.py instead, with the same results; set TRUTH_NO_JIT=1 to use NumPy only.
+import numpy as np
+
+import jit_kernels as jit
+
+## Same numbers as example_analysis.py
+LOW_ENERGY_CUT = 10
+MUON_PDGS = (13, -13)
+NEUTRON_PDG = 2112
+MINERVA_Z_MAX = 3500
+MINERVA_APPROX_RAD = 1870
+DETECTOR_Y_OFFSET = 430
+ACTIVE_HALF_WIDTH = 670
+
+
+def event_index(offsets):
+    """Return the event number of every row of a table with the given offsets."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _track_rows(traj_offsets, evt, track_ids):
+    """Map (event, track id) pairs to trajectory rows.
+
+    Returns the rows and a mask of which ids actually exist in their event
+    (rows for invalid ids are set to 0 and must be ignored).
+    """
+    starts = traj_offsets[:-1][evt]
+    counts = np.diff(traj_offsets)[evt]
+    valid = (track_ids >= 0) & (track_ids < counts)
+    rows = np.where(valid, starts + track_ids, 0)
+    return rows, valid
+
+
+def _lookup(mask, traj_offsets, evt, track_ids):
+    """mask[track] for each (event, track id) pair, False for ids that don't exist."""
+    rows, valid = _track_rows(traj_offsets, evt, track_ids)
+    if len(mask) == 0:
+        return np.zeros(len(track_ids), dtype=bool)
+    return valid & mask[rows]
+
+
+def _jagged_reduce(ufunc, values, offsets, empty):
+    values = np.asarray(values)
+    offsets = np.asarray(offsets)
+    out = np.full(len(offsets) - 1, empty, dtype=np.result_type(values, empty))
+    has_rows = np.diff(offsets) > 0
+    if has_rows.any():
+        out[has_rows] = ufunc.reduceat(values[:offsets[-1]], offsets[:-1][has_rows])
+    return out
+
+
+def jagged_max(values, offsets, empty=np.nan):
+    """Maximum of values over the rows of each event (empty for events without rows)."""
+    return _jagged_reduce(np.maximum, values, offsets, empty)
+
+
+def jagged_min(values, offsets, empty=np.nan):
+    """Minimum of values over the rows of each event (empty for events without rows)."""
+    return _jagged_reduce(np.minimum, values, offsets, empty)
+
+
+def is_2x2_contained(pos):
+    """Vectorized is_2x2_contained: pos is an (N, >=3) array of x, y, z (mm)."""
+    pos = np.asarray(pos)
+    return ((np.abs(pos[:, 0]) <= ACTIVE_HALF_WIDTH) &
+            (np.abs(pos[:, 1] - DETECTOR_Y_OFFSET) <= ACTIVE_HALF_WIDTH) &
+            (np.abs(pos[:, 2]) <= ACTIVE_HALF_WIDTH))
+
+
+def neutron_and_daughter_mask(trajectories):
+    """Vectorized get_neutron_and_daughter_ids: True for neutrons and their descendants.
+
+    The reference function makes a single pass over Event.Trajectories, so a
+    daughter is only picked up if its parent comes earlier in the list. Here
+    the mask is propagated down one generation per iteration, with the same
+    ordering requirement, until nothing changes.
+    """
+    offsets = trajectories["offsets"]
+    parent_id = np.asarray(trajectories["parent_id"])
+    is_neutron = np.asarray(trajectories["pdg"]) == NEUTRON_PDG
+    if jit.ENABLED:
+        return jit.neutron_and_daughter_mask(np.asarray(offsets), parent_id, is_neutron,
+                                             np.zeros(len(parent_id), dtype=bool))
+
+    evt = event_index(offsets)
+    position = np.arange(len(parent_id)) - offsets[:-1][evt]
+    rows, valid = _track_rows(offsets, evt, parent_id)
+    valid &= parent_id < position
+
+    mask = is_neutron.copy()
+    while True:
+        new_mask = is_neutron | (valid & mask[rows])
+        if np.array_equal(new_mask, mask):
+            return mask
+        mask = new_mask
+
+
+def low_energy_mask(trajectories):
+    """Vectorized get_low_energy_ids: True for trajectories with initial E < 10 MeV."""
+    return np.asarray(trajectories["p4"])[:, 3] < LOW_ENERGY_CUT
+
+
+def primary_pdg_mask(trajectories, primaries, pdgs, vertex=0):
+    """Vectorized get_traj_ids_for_pdg(event.Primaries[vertex].Particles, pdgs).
+
+    Returns a per-trajectory mask of the selected primary tracks, and a
+    per-event count of how many were found.
+    """
+    traj_offsets = trajectories["offsets"]
+    prim_evt = event_index(primaries["offsets"])
+    sel = np.isin(primaries["pdg"], pdgs) & (np.asarray(primaries["vertex"]) == vertex)
+
+    rows, valid = _track_rows(traj_offsets, prim_evt[sel], np.asarray(primaries["track_id"])[sel])
+    mask = np.zeros(traj_offsets[-1], dtype=bool)
+    mask[rows[valid]] = True
+    counts = np.bincount(prim_evt[sel], minlength=len(traj_offsets) - 1)
+    return mask, counts
+
+
+def event_masks(trajectories, primaries):
+    """Compute all of the per-trajectory masks used by the selections in one go."""
+    muon_mask, n_muons = primary_pdg_mask(trajectories, primaries, MUON_PDGS)
+    return {"neutron": neutron_and_daughter_mask(trajectories),
+            "low_energy": low_energy_mask(trajectories),
+            "muon": muon_mask,
+            "n_muons": n_muons}
+
+
+def _as_points(pos):
+    ## (N, >=3) float array the compiled kernels can index as pos[i, 0..2]
+    return np.ascontiguousarray(pos, dtype=np.float64)
+
+
+def _as_mask(mask):
+    return np.asarray(mask, dtype=bool)
+
+
+def hadronic_contained_kernel(seg_offsets, stop, primary_id, contributor,
+                              traj_offsets, neutron_mask, low_energy_mask, muon_mask,
+                              contained=is_2x2_contained):
+    """Per-event hadronic containment from segment columns and per-trajectory masks.
+
+    A segment makes its event uncontained if its stop point is outside the 2x2
+    active volume, unless its primary is a muon, or its first contributor is a
+    neutron (descendant) or a low-energy trajectory. contained maps an (N, 3) array
+    of points to a mask; the default is the box approximation, pass e.g.
+    geometry.load_geometry().contained to use the real volLArActive volumes.
+    """
+    if jit.ENABLED and contained is is_2x2_contained:
+        return jit.hadronic_contained(np.asarray(seg_offsets), _as_points(stop), np.asarray(primary_id),
+                                      np.asarray(contributor), np.asarray(traj_offsets),
+                                      _as_mask(neutron_mask), _as_mask(low_energy_mask), _as_mask(muon_mask),
+                                      ACTIVE_HALF_WIDTH, DETECTOR_Y_OFFSET,
+                                      np.empty(len(seg_offsets) - 1, dtype=bool))
+
+    seg_evt = event_index(seg_offsets)
+    primary_id = np.asarray(primary_id)
+    contributor = np.asarray(contributor)
+
+    skip = (_lookup(muon_mask, traj_offsets, seg_evt, primary_id) |
+            _lookup(neutron_mask, traj_offsets, seg_evt, contributor) |
+            _lookup(low_energy_mask, traj_offsets, seg_evt, contributor))
+    bad = ~skip
+    bad[bad] = ~contained(np.asarray(stop)[bad])
+    return np.bincount(seg_evt[bad], minlength=len(seg_offsets) - 1) == 0
+
+
+def muon_tagged_kernel(seg_offsets, stop, primary_id, traj_offsets, muon_mask, n_muons,
+                       acceptance=None):
+    """Per-event muon tagging from segment columns and a per-trajectory muon mask.
+
+    Events without a primary muon are tagged by definition. Otherwise, the
+    muon must leave at least one segment past the back of MINERvA (z > z_max),
+    and none of its segments at or before z_max may stop outside MINERvA,
+    whatever their order. By default MINERvA is the cylindrical approximation;
+    acceptance can be any model from minerva_acceptance.py.
+    """
+    if jit.ENABLED and acceptance is None:
+        return jit.muon_tagged(np.asarray(seg_offsets), _as_points(stop), np.asarray(primary_id),
+                               np.asarray(traj_offsets), _as_mask(muon_mask), np.asarray(n_muons),
+                               MINERVA_Z_MAX, MINERVA_APPROX_RAD, DETECTOR_Y_OFFSET,
+                               np.empty(len(seg_offsets) - 1, dtype=bool))
+
+    seg_evt = event_index(seg_offsets)
+    is_muon = _lookup(muon_mask, traj_offsets, seg_evt, np.asarray(primary_id))
+
+    ## Only the muon segments matter
+    rows = np.flatnonzero(is_muon)
+    muon_evt = seg_evt[rows]
+    stop = np.asarray(stop)[rows]
+
+    if acceptance is None:
+        high_z = stop[:, 2] > MINERVA_Z_MAX
+        rad = np.sqrt(stop[:, 0]*stop[:, 0] + (stop[:, 1] - DETECTOR_Y_OFFSET)*(stop[:, 1] - DETECTOR_Y_OFFSET))
+        exits_side = ~high_z & (rad > MINERVA_APPROX_RAD)
+    else:
+        high_z = stop[:, 2] > acceptance.z_max
+        exits_side = ~high_z & ~acceptance.inside_xy(stop)
+
+    nevt = len(seg_offsets) - 1
+    n_high = np.bincount(muon_evt[high_z], minlength=nevt)
+    n_side = np.bincount(muon_evt[exits_side], minlength=nevt)
+    return (np.asarray(n_muons) == 0) | ((n_high > 0) & (n_side == 0))
+
+
+def is_hadronic_contained_batch(segments, trajectories, primaries, masks=None,
+                                contained=is_2x2_contained):
+    """Vectorized is_hadronic_contained for a batch of events (see module comments)."""
+    if masks is None:
+        masks = event_masks(trajectories, primaries)
+    return hadronic_contained_kernel(segments["offsets"], segments["stop"],
+                                     segments["primary_id"], segments["contributor"],
+                                     trajectories["offsets"], masks["neutron"],
+                                     masks["low_energy"], masks["muon"], contained)
+
+
+def is_muon_tagged_batch(segments, trajectories, primaries, masks=None, acceptance=None):
+    """Vectorized is_muon_tagged for a batch of events (see module comments)."""
+    if masks is None:
+        masks = event_masks(trajectories, primaries)
+    return muon_tagged_kernel(segments["offsets"], segments["stop"], segments["primary_id"],
+                              trajectories["offsets"], masks["muon"], masks["n_muons"], acceptance)
+
+
+def is_event_contained_batch(segments, trajectories, primaries, masks=None,
+                             contained=is_2x2_contained, acceptance=None):
+    """Vectorized is_event_contained: muon tagged and hadronic system contained."""
+    if masks is None:
+        masks = event_masks(trajectories, primaries)
+    return (is_muon_tagged_batch(segments, trajectories, primaries, masks, acceptance) &
+            is_hadronic_contained_batch(segments, trajectories, primaries, masks, contained))
@@ -0,0 +1,80 @@
+## Check geometry.py's point-in-volume lookup against Geant4's own navigator
+##
+## Reads the GDML file with Geant4 (through the geant4_pybind package, which isn't needed
+## anywhere else), locates random points with G4Navigator::LocateGlobalPointAndSetup,
+## and compares the logical volume found with GeometryTable.volume_of, overall and for
+## the points Geant4 puts in the MINERvA ("Detector...") volumes, whose solids are
+## boolean solids with rotated second solids. Only the geometry is used, so Geant4's
+## physics datasets aren't needed:
+##   pip install geant4_pybind
+##   python benchmarks/geometry_vs_g4.py [-n 20000] [--gdml <file.gdml>]
+## Exits with status 1 if the fraction of points that agree is below --min-agreement.
+import os
+import sys
+import tempfile
+from collections import Counter
+from optparse import OptionParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+
+import geometry
+
+## Region sampled (mm): the 2x2 modules and MINERvA, with some of the hall around them
+SAMPLE_LO = np.array([-2500., -2000., -2200.])
+SAMPLE_HI = np.array([2500., 2800., 3600.])
+
+
+def g4_volume_names(gdml_file, points):
+    """Logical volume name Geant4 finds for each point ("" outside the world)."""
+    ## geant4_pybind asks to download the physics datasets on import unless this is set
+    os.environ.setdefault("GEANT4_DATA_DIR", tempfile.mkdtemp())
+    import geant4_pybind as g4
+
+    parser = g4.G4GDMLParser()
+    parser.SetOverlapCheck(False)
+    parser.Read(gdml_file, False)
+    nav = g4.G4Navigator()
+    nav.SetWorldVolume(parser.GetWorldVolume())
+
+    names = []
+    for x, y, z in points:
+        pv = nav.LocateGlobalPointAndSetup(g4.G4ThreeVector(float(x), float(y), float(z)), None, False, True)
+        names.append(pv.GetLogicalVolume().GetName() if pv else "")
+    return np.array(names)
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--points", dest="points", type="int", default=20000,
+                      help="Random points to locate (default: %default)")
+    parser.add_option("--gdml", dest="gdml", default=geometry.DEFAULT_GDML,
+                      help="GDML file (default: %default)")
+    parser.add_option("--seed", dest="seed", type="int", default=1,
+                      help="Seed for the points (default: %default)")
+    parser.add_option("--min-agreement", dest="min_agreement", type="float", default=0.999,
+                      help="Fraction of points that must agree (default: %default)")
+    (opts, args) = parser.parse_args()
+
+    rng = np.random.default_rng(opts.seed)
+    points = rng.uniform(SAMPLE_LO, SAMPLE_HI, (opts.points, 3))
+
+    reference = g4_volume_names(opts.gdml, points)
+    geom = geometry.GeometryTable(opts.gdml)
+    names = geom.volume_names(geom.volume_of(points))
+
+    agree = names == reference
+    minerva = np.char.startswith(reference.astype(str), "Detector")
+    print("Points in the same volume as G4Navigator: {:.4f} ({} points)".format(agree.mean(), len(agree)))
+    print("  of which in MINERvA volumes:            {:.4f} ({} points)".format(
+        agree[minerva].mean() if minerva.any() else float("nan"), minerva.sum()))
+    for (g4_name, name), count in Counter(zip(reference[~agree], names[~agree])).most_common(10):
+        print("  {:6d}  Geant4 {:32s} geometry.py {}".format(count, g4_name or "-", name or "-"))
+
+    return 0 if agree.mean() >= opts.min_agreement else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+## Check the kernels in jit_kernels.py against the NumPy and per-event versions
+##
+## On synthetic events (synthetic_events.py) at each of the SIZES presets, compares
+##  - neutron_and_daughter_mask with batch_selections' NumPy version and with
+##    get_neutron_and_daughter_ids from example_analysis.py, event by event,
+##  - hadronic_contained / muon_tagged with the NumPy versions and is_hadronic_contained /
+##    is_muon_tagged from example_analysis.py,
+## and batch_selections.jagged_max / jagged_min (NumPy only) with np.max / np.min over
+## each event's rows. It prints the time per event of the NumPy versions and of the
+## kernels: with Numba they are the compiled ones (after one warm-up call to compile
+## them), without it they run as plain Python, so only the comparison is meaningful:
+##   python benchmarks/jit_vs_numpy.py [-s small,medium] [-n 200]
+## Exits with status 1 if anything differs.
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+
+import synthetic_events as synth
+synth.use_root_stand_in()
+
+import example_analysis as ana
+import batch_selections as bs
+import jit_kernels as jit
+
+
+def best_time(func, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = func()
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+def numpy_only(func):
+    ## Call a batch_selections function with the kernels switched off
+    def call():
+        enabled, jit.ENABLED = jit.ENABLED, False
+        try:
+            return func()
+        finally:
+            jit.ENABLED = enabled
+    return call
+
+
+def reference_neutron_mask(events, trajectories):
+    mask = np.zeros(trajectories["offsets"][-1], dtype=bool)
+    for evt, event in enumerate(events):
+        for track_id in ana.get_neutron_and_daughter_ids(event):
+            mask[trajectories["offsets"][evt] + track_id] = True
+    return mask
+
+
+def kernel_calls(batch, masks):
+    ## The kernels called directly, with the arguments batch_selections passes them
+    seg, traj = batch["segments"], batch["trajectories"]
+    seg_offsets = np.asarray(seg["offsets"])
+    traj_offsets = np.asarray(traj["offsets"])
+    stop = bs._as_points(seg["stop"])
+    primary_id = np.asarray(seg["primary_id"])
+    nevt = len(seg_offsets) - 1
+    return {
+        "neutron_and_daughter_mask": lambda: jit.neutron_and_daughter_mask(
+            traj_offsets, np.asarray(traj["parent_id"]), np.asarray(traj["pdg"]) == bs.NEUTRON_PDG,
+            np.zeros(traj_offsets[-1], dtype=bool)),
+        "hadronic_contained": lambda: jit.hadronic_contained(
+            seg_offsets, stop, primary_id, np.asarray(seg["contributor"]), traj_offsets,
+            masks["neutron"], masks["low_energy"], masks["muon"],
+            bs.ACTIVE_HALF_WIDTH, bs.DETECTOR_Y_OFFSET, np.empty(nevt, dtype=bool)),
+        "muon_tagged": lambda: jit.muon_tagged(
+            seg_offsets, stop, primary_id, traj_offsets, masks["muon"], masks["n_muons"],
+            bs.MINERVA_Z_MAX, bs.MINERVA_APPROX_RAD, bs.DETECTOR_Y_OFFSET, np.empty(nevt, dtype=bool)),
+    }
+
+
+def check_size(size, n_events, seed, repeats):
+    events = synth.make_events(n_events, synth.SIZES[size], seed=seed)
+    batch = synth.to_batch(events)
+    seg, traj, prim = batch["segments"], batch["trajectories"], batch["primaries"]
+    masks = numpy_only(lambda: bs.event_masks(traj, prim))()
+
+    ## A NaN in one event, to check that it propagates as it does with np.maximum
+    edep = np.asarray(seg["edep"], dtype=float)
+    if len(edep):
+        edep[len(edep) // 2] = np.nan
+    seg["edep"] = edep
+    blocks = [edep[lo:hi] for lo, hi in zip(seg["offsets"][:-1], seg["offsets"][1:])]
+
+    references = {
+        "neutron_and_daughter_mask": reference_neutron_mask(events, traj),
+        "hadronic_contained": np.array([ana.is_hadronic_contained(e) for e in events]),
+        "muon_tagged": np.array([bool(ana.is_muon_tagged(e)) for e in events]),
+        "jagged_max": np.array([np.max(b) if len(b) else np.nan for b in blocks]),
+        "jagged_min": np.array([np.min(b) if len(b) else np.nan for b in blocks]),
+    }
+    numpy_calls = {
+        "neutron_and_daughter_mask": lambda: bs.neutron_and_daughter_mask(traj),
+        "hadronic_contained": lambda: bs.hadronic_contained_kernel(
+            seg["offsets"], seg["stop"], seg["primary_id"], seg["contributor"], traj["offsets"],
+            masks["neutron"], masks["low_energy"], masks["muon"]),
+        "muon_tagged": lambda: bs.muon_tagged_kernel(
+            seg["offsets"], seg["stop"], seg["primary_id"], traj["offsets"], masks["muon"], masks["n_muons"]),
+        "jagged_max": lambda: bs.jagged_max(edep, seg["offsets"]),
+        "jagged_min": lambda: bs.jagged_min(edep, seg["offsets"]),
+    }
+    kernels = kernel_calls(batch, masks)
+
+    failures = []
+    for name, reference in references.items():
+        numpy_out, numpy_time = best_time(numpy_only(numpy_calls[name]), repeats)
+        ok = np.array_equal(numpy_out, reference, equal_nan=True)
+        kernel_us = "-"
+        if name in kernels:
+            if jit.HAVE_NUMBA:
+                kernels[name]()
+            kernel_out, kernel_time = best_time(kernels[name], repeats if jit.HAVE_NUMBA else 1)
+            ok = ok and np.array_equal(kernel_out, reference, equal_nan=True)
+            kernel_us = "{:.2f}".format(1e6 * kernel_time / n_events)
+        if not ok:
+            failures.append("{}/{}".format(name, size))
+        print("{:26s} {:>7s} {:12.2f} {:>12s} {:>6s}".format(
+            name, size, 1e6 * numpy_time / n_events, kernel_us, "ok" if ok else "DIFFER"))
+    return failures
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--sizes", dest="sizes", default=",".join(synth.SIZES),
+                      help="Comma separated event sizes to run (default: %default)")
+    parser.add_option("-n", "--events", dest="events", type="int", default=200,
+                      help="Events per size (default: %default)")
+    parser.add_option("-r", "--repeats", dest="repeats", type="int", default=5,
+                      help="Repetitions per timing; the best is kept (default: %default)")
+    parser.add_option("--seed", dest="seed", type="int", default=2022,
+                      help="Seed for the synthetic events (default: %default)")
+    (opts, args) = parser.parse_args()
+
+    print("Kernels {}".format("compiled with Numba " + numba_version() if jit.HAVE_NUMBA
+                              else "running as plain Python (Numba isn't installed)"))
+    print("{:26s} {:>7s} {:>12s} {:>12s} {:>6s}".format("kernel", "size", "numpy us/evt", "kernel us/evt", "match"))
+    failures = []
+    for size in opts.sizes.split(","):
+        failures += check_size(size, opts.events, opts.seed, opts.repeats)
+
+    if failures:
+        print("Kernels differ from the reference for:", ", ".join(failures))
+        return 1
+    print("All kernels match the reference functions")
+    return 0
+
+
+def numba_version():
+    return jit.numba.__version__
+
+
+if __name__ == "__main__":
+    sys.exit(main())
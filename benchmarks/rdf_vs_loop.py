@@ -0,0 +1,97 @@
+## Compare the RDataFrame back-end of the containment analysis with the Python event loop
+##
+## Runs example_analysis.process_files and rdf_backend.process_files over the same real
+## edep-sim files (RDataFrame needs PyROOT and the TG4Event dictionary, so the synthetic
+## events of run_benchmarks.py can't be used here), checks that they give the same
+## histogram fills, and prints the events/s of each, for each number of threads. With
+## one thread the fills must also come in the same order; with more, ROOT doesn't keep
+## the entry order (see rdf_backend.py), so only the same values are required:
+##   python benchmarks/rdf_vs_loop.py -t 1,4,8 <input_edepsim_file.root> [...]
+## Exits with status 1 if the fills differ.
+import os
+import sys
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+
+import example_analysis as ana
+import rdf_backend
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+def sorted_rows(values):
+    ## Rows of an (n, dims) array in lexicographic order
+    return values[np.lexsort(values.T[::-1])] if len(values) else values
+
+
+def compare_fills(reference, other, ordered=True):
+    """Names of the histograms whose fills differ (by count, or by value); unless ordered,
+    the fills of each histogram are compared whatever their order."""
+    ref = ana.fills_to_arrays(reference)
+    new = ana.fills_to_arrays(other)
+    differ = []
+    for name in ana.FILL_DIMS:
+        a, b = ref[name], new[name]
+        if not ordered:
+            a, b = sorted_rows(a), sorted_rows(b)
+        if a.shape != b.shape or not np.array_equal(a, b, equal_nan=True):
+            differ.append(name)
+    return differ
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options] <input_edepsim_file.root> [...]")
+    parser.add_option("-t", "--threads", dest="threads", default="1,0",
+                      help="Comma separated thread counts for RDataFrame, 0 = all cores (default: %default)")
+    parser.add_option("--skip-python", dest="skip_python", action="store_true", default=False,
+                      help="Only time the RDataFrame back-end (no comparison)")
+    (opts, args) = parser.parse_args()
+
+    file_list = ana.expand_file_list(args)
+    if not file_list:
+        parser.error("At least one edep-sim processed file is required as an argument!")
+    nevts = ana.ROOT.TChain("EDepSimEvents")
+    for f in file_list:
+        nevts.Add(f)
+    nevts = nevts.GetEntries()
+
+    results = []
+    reference = None
+    if not opts.skip_python:
+        reference, seconds = timed(ana.process_files, file_list)
+        results.append(("python", seconds))
+
+    mismatches = []
+    for nthreads in (int(t) for t in opts.threads.split(",")):
+        fills, seconds = timed(rdf_backend.process_files, file_list, nthreads=nthreads)
+        label = "rdf, {} threads".format(nthreads if nthreads else "all")
+        results.append((label, seconds))
+        if reference is not None:
+            mismatches += ["{} ({})".format(name, label)
+                           for name in compare_fills(reference, fills, ordered=nthreads == 1)]
+
+    print("{:24s} {:>10s} {:>12s} {:>9s}".format("back-end", "seconds", "events/s", "speed-up"))
+    base = results[0][1]
+    for label, seconds in results:
+        print("{:24s} {:10.2f} {:12.1f} {:9.2f}".format(label, seconds, nevts / seconds if seconds else 0.,
+                                                         base / seconds if seconds else 0.))
+
+    if mismatches:
+        print("Fills differ from the Python loop:", ", ".join(mismatches))
+        return 1
+    if reference is not None:
+        print("All back-ends give the same fills")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+## Timing benchmarks for the per-event selection functions, on synthetic events
+##
+## Runs the functions the analyses call once per event (or per track) over events from
+## synthetic_events.py at each of the SIZES presets, and compares the time per call with
+## the stored baselines in baselines.json, so a change that slows one of them down shows
+## up without needing any real files (or PyROOT: the ROOT stand-in is used if it's missing).
+##
+## The times compared are relative to a fixed calibration loop timed next to each sample,
+## so that a slower or busier machine slows both down alike: each sample runs the
+## benchmark (and the calibration) for at least MIN_SAMPLE_SECONDS, and the median ratio
+## over the repeats is kept. us/event is printed too, but only the ratio is stored.
+##   python benchmarks/run_benchmarks.py                  ## compare with the baselines
+##   python benchmarks/run_benchmarks.py -s small -b is_muon_tagged
+##   python benchmarks/run_benchmarks.py --update         ## store new baselines
+## Exits with status 1 if any benchmark is slower than tolerance x its baseline.
+## Baselines are only meaningful with the ROOT backend (and Numba or not) they were made
+## with, and best regenerated with --update on the machine they're used on.
+import os
+import io
+import sys
+import json
+import math
+import time
+import platform
+import statistics
+import contextlib
+from optparse import OptionParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+sys.path.append(os.path.join(HERE, "..", "kaons"))
+
+import synthetic_events as synth
+STAND_IN = synth.use_root_stand_in()
+
+import example_analysis as ana
+import lar_functions as lar
+import batch_selections as bs
+import jit_kernels as jit
+from event_inspector import Inspector
+
+BASELINE_FILE = os.path.join(HERE, "baselines.json")
+DEFAULT_TOLERANCE = 1.3
+
+## Events generated for each size, and how many times each benchmark is repeated
+N_EVENTS = {"small": 200, "medium": 50, "large": 10}
+DEFAULT_REPEATS = 11
+
+## Shortest time of one sample: short benchmarks are run several times over per sample
+MIN_SAMPLE_SECONDS = 0.02
+
+## The calibration loop: plain Python arithmetic and attribute access, and small NumPy
+## calls, like the benchmarks themselves
+_CAL_POINTS = [synth.types.SimpleNamespace(x=float(i), y=0.5*i) for i in range(500)]
+_CAL_ARRAY = np.linspace(0., 1., 500)
+
+
+def calibration():
+    total = 0.
+    for p in _CAL_POINTS:
+        total += math.sqrt(p.x*p.x + p.y*p.y)
+    for _ in range(20):
+        total += float(np.sum(_CAL_ARRAY * total))
+    return total
+
+
+def _inspector(event):
+    ## An Inspector holding one event, without going through load_files/load_event
+    insp = Inspector.__new__(Inspector)
+    insp.geometry = None
+    insp.edep_tree = synth.types.SimpleNamespace(Event=event)
+    insp.Vtx = event.Primaries[0]
+    insp.Traj = event.Trajectories
+    insp.build_traj_index()
+    insp.build_segment_index()
+    return insp
+
+
+def _inspector_queries(event):
+    insp = _inspector(event)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for trk in insp.Vtx.Particles:
+            trk_id = trk.GetTrackId()
+            insp.list_children(trk_id)
+            insp.energy_deposit_trk(trk_id)
+            insp.get_edep_segments(trk_id, use_primary=True)
+        insp.find_particle(2112)
+
+
+def _edep_plus_children(event):
+    edep_by_primary = lar.energy_deposit_by_primary(event.SegmentDetectors)
+    children = lar.get_children_map(event)
+    for trk in event.Primaries[0].Particles:
+        lar.edep_plus_children(event, trk.GetTrackId(), True, edep_by_primary, children)
+
+
+def _energy_by_range(event):
+    for trk in event.Primaries[0].Particles:
+        lar.energy_by_range(lar.calc_distance(event.Trajectories[trk.GetTrackId()]) / 10.)
+
+
+def _range_energy_points(event):
+    points = lar.get_track_points(event)
+    points.range_energy([trk.GetTrackId() for trk in event.Primaries[0].Particles])
+
+
+def _reco_energy(event):
+    for trk in event.Primaries[0].Particles:
+        ana.get_reco_energy(event, trk.GetTrackId())
+
+
+def _batch_contained(batch):
+    masks = bs.event_masks(batch["trajectories"], batch["primaries"])
+    bs.is_event_contained_batch(batch["segments"], batch["trajectories"], batch["primaries"], masks)
+
+
+## name -> (function, "event" to call it once per event, "batch" for once per batch)
+BENCHMARKS = {
+    "is_hadronic_contained":  (ana.is_hadronic_contained, "event"),
+    "is_muon_tagged":         (ana.is_muon_tagged, "event"),
+    "get_reco_energy":        (_reco_energy, "event"),
+    "edep_plus_children":     (_edep_plus_children, "event"),
+    "energy_by_range":        (_energy_by_range, "event"),
+    "range_energy_points":    (_range_energy_points, "event"),
+    "inspector_index":        (_inspector, "event"),
+    "inspector_queries":      (_inspector_queries, "event"),
+    "is_event_contained_batch": (_batch_contained, "batch"),
+}
+
+
+def _passes(run):
+    ## Passes of run needed to take at least MIN_SAMPLE_SECONDS
+    n = 1
+    while True:
+        seconds = _time_passes(run, n) * n
+        if seconds >= MIN_SAMPLE_SECONDS:
+            return n
+        n = max(2 * n, int(1.2 * n * MIN_SAMPLE_SECONDS / seconds) if seconds > 0 else 2 * n)
+
+
+def _time_passes(run, n):
+    ## Seconds per pass of run, over n passes
+    start = time.perf_counter()
+    for _ in range(n):
+        run()
+    return (time.perf_counter() - start) / n
+
+
+def time_benchmark(name, events, batch, repeats):
+    """Median over repeats of the time of one pass over the events: in microseconds per
+    event, and per event relative to the calibration loop timed just before it."""
+    func, mode = BENCHMARKS[name]
+    if mode == "batch":
+        run = lambda: func(batch)
+    else:
+        def run():
+            for event in events:
+                func(event)
+
+    run()
+    n_run, n_cal = _passes(run), _passes(calibration)
+    seconds, relative = [], []
+    for _ in range(repeats):
+        cal = _time_passes(calibration, n_cal)
+        t = _time_passes(run, n_run)
+        seconds.append(t)
+        relative.append(t / cal)
+    return 1e6 * statistics.median(seconds) / len(events), statistics.median(relative) / len(events)
+
+
+def backend():
+    return "stand-in" if STAND_IN else "pyroot"
+
+
+def numba_state():
+    return "numba " + jit.numba.__version__ if jit.ENABLED else "no numba"
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--sizes", dest="sizes", default=",".join(synth.SIZES),
+                      help="Comma separated event sizes to run (default: %default)")
+    parser.add_option("-b", "--benchmarks", dest="benchmarks", default=None,
+                      help="Comma separated benchmarks to run (default: all)")
+    parser.add_option("-r", "--repeats", dest="repeats", type="int", default=DEFAULT_REPEATS,
+                      help="Repetitions per benchmark; the median is kept (default: %default)")
+    parser.add_option("-t", "--tolerance", dest="tolerance", type="float", default=DEFAULT_TOLERANCE,
+                      help="Allowed slow-down relative to the baseline (default: %default)")
+    parser.add_option("--seed", dest="seed", type="int", default=2022,
+                      help="Seed for the synthetic events (default: %default)")
+    parser.add_option("--update", dest="update", action="store_true", default=False,
+                      help="Store the results as the new baselines")
+    parser.add_option("--baselines", dest="baselines", default=BASELINE_FILE,
+                      help="Baseline file (default: %default)")
+    (opts, args) = parser.parse_args()
+
+    sizes = opts.sizes.split(",")
+    names = opts.benchmarks.split(",") if opts.benchmarks else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS] + [s for s in sizes if s not in synth.SIZES]
+    if unknown:
+        parser.error("Unknown benchmarks/sizes: {}".format(", ".join(unknown)))
+
+    baselines = {}
+    if os.path.exists(opts.baselines):
+        with open(opts.baselines) as f:
+            baselines = json.load(f)
+    stored = baselines.get("results", {})
+    if stored and baselines.get("units") != "calibration":
+        print("Baselines in {} predate the calibrated timings: ignoring them (regenerate with --update)".format(
+            opts.baselines))
+        stored = {}
+    if stored and baselines.get("backend") != backend():
+        print("Baselines were made with the {} backend, this is {}".format(baselines.get("backend"), backend()))
+    if stored and baselines.get("numba") != numba_state():
+        print("Baselines were made with {}, this is {}".format(baselines.get("numba"), numba_state()))
+
+    results = {}
+    regressions = []
+    print("{:26s} {:>7s} {:>10s} {:>12s} {:>12s} {:>7s}".format(
+        "benchmark", "size", "us/event", "cal/event", "baseline", "ratio"))
+    for size in sizes:
+        events = synth.make_events(N_EVENTS[size], synth.SIZES[size], seed=opts.seed)
+        batch = synth.to_batch(events)
+        for name in names:
+            key = "{}/{}".format(name, size)
+            micros, results[key] = time_benchmark(name, events, batch, opts.repeats)
+            base = stored.get(key)
+            ratio = results[key] / base if base else float("nan")
+            flag = ""
+            if base and ratio > opts.tolerance:
+                regressions.append(key)
+                flag = "  SLOWER"
+            print("{:26s} {:>7s} {:10.1f} {:12.4g} {:>12s} {:7.2f}{}".format(
+                name, size, micros, results[key], "{:.4g}".format(base) if base else "-", ratio, flag))
+
+    if opts.update:
+        ## Stored together so that the file describes a single run
+        if stored and set(results) != set(stored):
+            print("Storing only this run's {} baselines: the others are dropped".format(len(results)))
+        with open(opts.baselines, "w") as f:
+            json.dump({"backend": backend(), "numba": numba_state(), "python": platform.python_version(),
+                       "machine": platform.machine(), "seed": opts.seed, "units": "calibration",
+                       "results": {key: float("{:.4g}".format(t)) for key, t in results.items()}},
+                      f, indent=2, sort_keys=True)
+        print("Stored {} baselines in {}".format(len(results), opts.baselines))
+        return 0
+
+    if regressions:
+        print("{} benchmark(s) more than {}x slower than the baseline: {}".format(
+            len(regressions), opts.tolerance, ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
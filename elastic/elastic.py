@@ -1,23 +1,37 @@
 import ROOT as RT
 import numpy as np
+import os
 import sys
 import time
 
 import lar_functions as lar
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import prefetch
+import loop_timer
+from hist_buffer import BufferedHist
+
+## Set TRUTH_TIMING=1 (or =<file>.json) for the time spent in each stage of the loop
+timing, timing_json = loop_timer.timing_from_env()
+timer = loop_timer.make_timer(timing, "elastic", from_zero=True)
+
 #ROOT.gSystem.Load("/opt/generators/edep-sim/install/lib/libedepsim_io.so")
 
+## Prints every NC1p proton; proton_profile.py does the same study over the whole
+## sample in batches, writing the results to a table instead
+
 edep_tree = RT.TChain("EDepSimEvents")
 grtk_tree = RT.TChain("DetSimPassThru/gRooTracker")
 
-h_proton_ke = RT.TH1D("pr_ke", "pr_ke;True KE (MeV); N", 100, 0, 2500)
-h_proton_tcos = RT.TH2D("pr_tcos", "pr_tcos;#theta; True KE (MeV)", 45, 0, 90, 100, 0, 2500)
-h_pr_smearing = RT.TH2D("ke_smearing", "ke_smearing; Reco KE (MeV), True KE (MeV)", 100, 0, 2500, 100, 0, 2500)
+h_proton_ke = BufferedHist(RT.TH1D("pr_ke", "pr_ke;True KE (MeV); N", 100, 0, 2500))
+h_proton_tcos = BufferedHist(RT.TH2D("pr_tcos", "pr_tcos;#theta; True KE (MeV)", 45, 0, 90, 100, 0, 2500))
+h_pr_smearing = BufferedHist(RT.TH2D("ke_smearing", "ke_smearing; Reco KE (MeV), True KE (MeV)", 100, 0, 2500, 100, 0, 2500))
 
 filelist = [sys.argv[x] for x in range(1, len(sys.argv))]
-for file in filelist:
-    edep_tree.Add(file)
-    grtk_tree.Add(file)
+with timer.stage("chain_open"):
+    for file in filelist:
+        edep_tree.Add(file)
+        grtk_tree.Add(file)
 
 beam_angle = RT.TVector3(0, 0.05836, 1.0) # 3.343 degrees in the y-plane
 nevt = edep_tree.GetEntries()
@@ -25,17 +39,22 @@ num_nc1p = 0
 num_cont = 0
 
 st = time.time()
+## Set TRUTH_PREFETCH=<n> to read up to n events ahead in a background thread
+events = prefetch.event_reader(edep_tree, filelist, prefetch.read_ahead_from_env())
+
 print("Reading {} events...".format(nevt))
+timer.start_loop(nevt)
 for evt in range(nevt):
 
-    if evt % (int(nevt/10)) == 0:
-        print("Processed event: ", evt)
+    timer.event(evt)
 
-    edep_tree.GetEntry(evt)
-    grtk_tree.GetEntry(evt)
+    with timer.stage("get_entry_edep"):
+        event = events.get(evt)
+    with timer.stage("get_entry_genie"):
+        grtk_tree.GetEntry(evt)
 
-    vtx = edep_tree.Event.Primaries[0]
-    num_vtx = len(edep_tree.Event.Primaries)
+    vtx = event.Primaries[0]
+    num_vtx = len(event.Primaries)
     # print("Num. verticies {}".format(num_vtx))
 
     primary_pdg = [x.GetPDGCode() for x in vtx.Particles]
@@ -56,24 +75,27 @@ for evt in range(nevt):
         print("Something went wrong with the track ID...")
         continue
 
-    traj = edep_tree.Event.Trajectories
+    traj = event.Trajectories
     proton_track = traj[proton_tid]
 
-    if not lar.is_track_contained(proton_track):
+    with timer.stage("is_track_contained"):
+        contained = lar.is_track_contained(proton_track)
+    if not contained:
         print("Proton track not contained...")
         continue
 
     num_cont += 1
     edep_energy = 0.0
-    for k,v in edep_tree.Event.SegmentDetectors:
-        for edep in v:
-            prim_id = edep.GetPrimaryId()
-            contrib = edep.GetContributors()
+    with timer.stage("edep_sum"):
+        for k,v in event.SegmentDetectors:
+            for edep in v:
+                prim_id = edep.GetPrimaryId()
+                contrib = edep.GetContributors()
 
-            # if prim_id == proton_tid:
-                # edep_energy += edep.GetEnergyDeposit()
-            if contrib[0] == proton_tid:
-                edep_energy += edep.GetEnergyDeposit()
+                # if prim_id == proton_tid:
+                    # edep_energy += edep.GetEnergyDeposit()
+                if contrib[0] == proton_tid:
+                    edep_energy += edep.GetEnergyDeposit()
 
     proton_mass = 938.272
     traj_energy = 0.0
@@ -91,18 +113,21 @@ for evt in range(nevt):
     proton_init_ke = proton_init_4vec.E() - proton_init_4vec.M()
     proton_init_angle = proton_init_4vec.Vect().Angle(beam_angle) * 180.0 / np.pi
 
-    h_proton_ke.Fill(proton_init_ke)
-    h_proton_tcos.Fill(proton_init_angle, proton_init_ke)
-    h_pr_smearing.Fill(edep_energy, proton_init_ke)
+    with timer.stage("hist_fill"):
+        h_proton_ke.Fill(proton_init_ke)
+        h_proton_tcos.Fill(proton_init_angle, proton_init_ke)
+        h_pr_smearing.Fill(edep_energy, proton_init_ke)
 
     print("Proton intial energy: {:.4f}".format(proton_init_ke))
     print("Deposited energy : {:.4f}".format(edep_energy))
     print("Trajectory energy: {:.4f}".format(traj_energy))
 
+events.close()
 et = time.time()
 print("Total NC1p: ", num_nc1p)
 print("Total cont: ", num_cont)
 print("Total time: ", time.strftime("%H:%M:%S", time.gmtime(et-st)))
+timer.report(timing_json)
 
 output_file = RT.TFile("nc_elastic_output.root", "RECREATE")
 h_proton_ke.Write()
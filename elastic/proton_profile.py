@@ -0,0 +1,184 @@
+## Batch version of the NC elastic proton study in elastic.py
+##
+## Selects the NC1p events (primaries exactly [nu_mu, proton]) and, for every proton,
+## computes the kinetic-energy profile along its trajectory (kinetic energy, step dE and
+## dE/dx at each point, and the residual range), the energy lost along the trajectory and
+## the energy deposited by it (segments with the proton as first contributor), working on
+## whole batches of events read with event_stream.iter_batches. Nothing is printed per
+## event: the results go to a compressed .npz table (one row per NC1p event, plus the
+## profiles as jagged columns), and optionally to the same histograms as elastic.py:
+##   python3 proton_profile.py -o nc1p_protons.npz [-r nc_elastic_output.root] <input.root> [...]
+## Read the table back with np.load; profile_ke[profile_offsets[i]:profile_offsets[i+1]]
+## is the profile of the proton in row i.
+import os
+import sys
+from optparse import OptionParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+sys.path.append(os.path.join(HERE, "..", "kaons"))
+
+import batch_selections as bs
+from lar_functions import path_lengths
+
+PROTON_MASS = 938.272
+BEAM_DIRECTION = np.array([0, 0.05836, 1.0])  ## 3.343 degrees in the y-plane
+NC1P_PDGS = [14, 2212]
+
+FIELDS = ["primaries", "trajectories", "points", "segments"]
+
+
+def _gather(offsets, rows):
+    ## Flat indices of the blocks offsets[rows[i]]:offsets[rows[i]+1], and their offsets
+    starts = offsets[rows]
+    counts = offsets[rows + 1] - starts
+    new_offsets = np.concatenate([[0], np.cumsum(counts)])
+    index = np.arange(new_offsets[-1]) - np.repeat(new_offsets[:-1] - starts, counts)
+    return index, new_offsets
+
+
+def select_nc1p(primaries):
+    """Events whose primaries are exactly [14, 2212], and the proton's track id."""
+    offsets = primaries["offsets"]
+    evts = np.flatnonzero(np.diff(offsets) == len(NC1P_PDGS))
+    prim_rows = offsets[evts][:, None] + np.arange(len(NC1P_PDGS))
+    evts = evts[np.all(np.asarray(primaries["pdg"])[prim_rows] == NC1P_PDGS, axis=1)]
+    return evts, np.asarray(primaries["track_id"])[offsets[evts] + NC1P_PDGS.index(2212)]
+
+
+def proton_profiles(evts):
+    """Proton energy-loss profiles for a batch of events (event_cache.batch layout, with
+    the primaries, trajectories, points and segments tables).
+
+    Returns a dict of per-proton columns (one row per NC1p event: "event" row in the
+    batch, "proton_id", "contained", "init_ke", "angle", "edep_energy", "traj_energy",
+    "n_points") and per-point columns ("profile_ke", "profile_de", "profile_dedx",
+    "profile_residual_range") with "profile_offsets". Energies in MeV, dE/dx in MeV/cm,
+    ranges in cm, angles to the beam in degrees.
+    """
+    rows, proton_id = select_nc1p(evts["primaries"])
+    traj = evts["trajectories"]
+    traj_row = traj["offsets"][rows] + proton_id
+
+    ## Initial kinetic energy and angle to the beam
+    p4 = np.asarray(traj["p4"])[traj_row].reshape(-1, 4)
+    mass = np.sqrt(np.maximum(p4[:, 3]**2 - np.sum(p4[:, :3]**2, axis=1), 0))
+    init_ke = p4[:, 3] - mass
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cos = p4[:, :3] @ BEAM_DIRECTION / (np.linalg.norm(p4[:, :3], axis=1) * np.linalg.norm(BEAM_DIRECTION))
+    angle = np.degrees(np.arccos(np.clip(cos, -1, 1)))
+
+    ## Points of each proton, and the kinetic energy at each of them
+    points = evts["points"]
+    index, offsets = _gather(points["trajectory_offsets"], traj_row)
+    position = np.asarray(points["position"])[index]
+    momentum = np.asarray(points["momentum"])[index]
+    n_points = np.diff(offsets)
+    has_points = n_points > 0
+    last = np.where(has_points, offsets[1:] - 1, 0)
+    contained = np.zeros(len(rows), dtype=bool)
+    contained[has_points] = bs.is_2x2_contained(position[last[has_points]])
+
+    ke = np.sqrt(np.sum(momentum**2, axis=1) + PROTON_MASS**2) - PROTON_MASS
+    step, _, to_end, _ = path_lengths(position, offsets)
+    de = np.zeros(len(ke))
+    de[1:] = ke[:-1] - ke[1:]
+    de[offsets[:-1][has_points]] = 0.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dedx = np.where(step > 0, de / (step / 10.0), np.nan)
+    traj_energy = np.zeros(len(rows))
+    traj_energy[has_points] = ke[offsets[:-1][has_points]] - ke[last[has_points]]
+
+    ## Energy deposited with the proton as the first contributor
+    seg = evts["segments"]
+    seg_evt = bs.event_index(seg["offsets"])
+    proton_of_evt = np.full(len(seg["offsets"]) - 1, -2, dtype=np.int64)
+    proton_of_evt[rows] = proton_id
+    match = np.asarray(seg["contributor"]) == proton_of_evt[seg_evt]
+    edep = np.bincount(seg_evt[match], weights=np.asarray(seg["edep"])[match], minlength=len(proton_of_evt))
+
+    return {"event": rows, "proton_id": proton_id, "contained": contained, "init_ke": init_ke,
+            "angle": angle, "edep_energy": edep[rows], "traj_energy": traj_energy, "n_points": n_points,
+            "profile_ke": ke, "profile_de": de, "profile_dedx": dedx,
+            "profile_residual_range": to_end / 10.0, "profile_offsets": offsets}
+
+
+def _concatenate(parts):
+    ## Join the proton_profiles of several batches (shifting the profile offsets)
+    out = {}
+    for col in parts[0]:
+        if col == "profile_offsets":
+            shifts = np.cumsum([0] + [p[col][-1] for p in parts[:-1]])
+            out[col] = np.concatenate([[0]] + [p[col][1:] + s for p, s in zip(parts, shifts)])
+        else:
+            out[col] = np.concatenate([p[col] for p in parts])
+    return out
+
+
+def process_files(files, batch_size=1000):
+    """proton_profiles over all events of a list of edep-sim files, with the "file",
+    "entry" and "global_entry" of each row."""
+    import event_stream
+
+    parts = []
+    for evts in event_stream.iter_batches(files, FIELDS, batch_size):
+        prof = proton_profiles(evts)
+        for col in ("file", "entry", "global_entry"):
+            prof[col] = evts["meta"][col][prof["event"]]
+        del prof["event"]
+        parts.append(prof)
+    if not parts:
+        return None
+    return _concatenate(parts)
+
+
+def write_histograms(table, output_file):
+    """The pr_ke, pr_tcos and ke_smearing histograms of elastic.py, for the contained protons."""
+    import ROOT as RT
+    from hist_buffer import BufferedHist
+
+    h_proton_ke = BufferedHist(RT.TH1D("pr_ke", "pr_ke;True KE (MeV); N", 100, 0, 2500))
+    h_proton_tcos = BufferedHist(RT.TH2D("pr_tcos", "pr_tcos;#theta; True KE (MeV)", 45, 0, 90, 100, 0, 2500))
+    h_pr_smearing = BufferedHist(RT.TH2D("ke_smearing", "ke_smearing; Reco KE (MeV), True KE (MeV)", 100, 0, 2500, 100, 0, 2500))
+
+    cont = table["contained"]
+    h_proton_ke.fill_array(table["init_ke"][cont])
+    h_proton_tcos.fill_array(table["angle"][cont], table["init_ke"][cont])
+    h_pr_smearing.fill_array(table["edep_energy"][cont], table["init_ke"][cont])
+
+    output_file = RT.TFile(output_file, "RECREATE")
+    h_proton_ke.Write()
+    h_proton_tcos.Write()
+    h_pr_smearing.Write()
+    output_file.Close()
+
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage="%prog [options] <input_edepsim_file.root> [...]")
+    parser.add_option("-o", "--output", action="store", type="string", dest="output", default="nc1p_protons.npz",
+                      help="Table of per-event results to write (default %default)")
+    parser.add_option("-r", "--rootOutput", action="store", type="string", dest="rootOutput", default=None,
+                      help="Also write the elastic.py histograms to this ROOT file")
+    parser.add_option("-b", "--batchSize", action="store", type="int", dest="batchSize", default=1000,
+                      help="Events read per batch (default %default)")
+    (options, file_list) = parser.parse_args()
+
+    if len(file_list) < 1:
+        print("At least one edep-sim processed file is required as an argument!")
+        sys.exit()
+
+    table = process_files(file_list, options.batchSize)
+    if table is None:
+        print("No events read")
+        sys.exit()
+
+    np.savez_compressed(options.output, files=np.array(file_list), **table)
+    print("Total NC1p: ", len(table["proton_id"]))
+    print("Total cont: ", int(np.sum(table["contained"])))
+    print("Wrote", options.output)
+
+    if options.rootOutput:
+        write_histograms(table, options.rootOutput)
@@ -0,0 +1,389 @@
+## Columnar cache of edep-sim output
+## Reads each EDepSimEvents + DetSimPassThru/gRooTracker file once through PyROOT and
+## flattens the TG4Event contents into jagged NumPy columns (one .npy per column) with
+## per-event offset arrays. Everything can be memory-mapped, so later passes over the
+## same files never need to touch the TG4Event dictionary (or ROOT) again.
+##
+## Usage:
+##   python3 event_cache.py -o <cache_dir> <input_edepsim_file.root> [...]
+## Writes one <cache_dir>/<input_basename>.cache directory per input file.
+import os
+import sys
+import json
+from array import array
+from glob import glob
+from optparse import OptionParser
+
+import numpy as np
+
+## Bump this whenever the on-disk layout changes
+CACHE_FORMAT_VERSION = 2
+
+## Column layout: table -> {column: (dtype, number of components per row)}
+## Each table also has an "offsets" column of length n_events+1, so that
+## the rows of event i are table[offsets[i]:offsets[i+1]]
+TABLES = {
+    "segments": {
+        "volume":       ("i4", 1),   ## index into meta["volumes"] (SegmentDetectors key)
+        "start":        ("f8", 3),   ## start x, y, z (mm)
+        "stop":         ("f8", 3),   ## stop x, y, z (mm)
+        "edep":         ("f8", 1),   ## energy deposit (MeV)
+        "primary_id":   ("i4", 1),   ## GetPrimaryId()
+        "contributor":  ("i4", 1),   ## GetContributors()[0]
+        "track_length": ("f8", 1),   ## GetTrackLength() (mm)
+    },
+    "trajectories": {
+        "track_id":     ("i4", 1),
+        "parent_id":    ("i4", 1),
+        "pdg":          ("i4", 1),
+        "p4":           ("f8", 4),   ## initial px, py, pz, E (MeV)
+    },
+    "points": {
+        "position":     ("f8", 4),   ## x, y, z (mm), t (ns)
+        "momentum":     ("f8", 3),   ## px, py, pz (MeV)
+    },
+    "primaries": {
+        "track_id":     ("i4", 1),
+        "pdg":          ("i4", 1),
+        "p4":           ("f8", 4),   ## px, py, pz, E (MeV)
+        "vertex":       ("i4", 1),   ## index of the vertex in Event.Primaries
+    },
+    "vertices": {
+        "position":     ("f8", 4),   ## x, y, z (mm), t (ns)
+        "reaction":     ("U", 1),    ## GetReaction() (the GENIE EvtCode string)
+    },
+}
+
+## Per-event (one row per entry) columns taken from the GENIE pass-through tree
+GENIE_COLUMNS = {
+    "nu_pdg":   ("i4", 1),
+    "nu_p4":    ("f8", 4),   ## px, py, pz, E (MeV, converted from GeV)
+}
+
+
+class _ColumnBuffer:
+    """Growable flat buffer for one column, filled row by row while converting."""
+    def __init__(self, dtype, width):
+        self.dtype = dtype
+        self.width = width
+        if dtype == "U":
+            self.data = []
+        else:
+            self.typecode = "l" if dtype.startswith("i") else "d"
+            self.data = array(self.typecode)
+
+    def append(self, *values):
+        self.data.extend(values)
+
+    def to_numpy(self):
+        if self.dtype == "U":
+            return np.array(self.data, dtype=str)
+        arr = np.frombuffer(self.data, dtype=self.typecode).astype(self.dtype)
+        if self.width > 1:
+            arr = arr.reshape(-1, self.width)
+        return arr
+
+
+def cache_dir_name(input_file_name, output_dir):
+    """Return the cache directory used for a given input file."""
+    base = os.path.basename(input_file_name)
+    if base.endswith(".root"):
+        base = base[:-len(".root")]
+    return os.path.join(output_dir, base + ".cache")
+
+
+def _get_nu_4mom(groo_event):
+    ## Same logic as get_neutrino_4mom in example_analysis.py, but without the TLorentzVector
+    for p in range(groo_event.StdHepN):
+        if groo_event.StdHepStatus[p] != 0: continue
+        if abs(groo_event.StdHepPdg[p]) not in [12, 14, 16]: continue
+        return (groo_event.StdHepPdg[p],
+                [groo_event.StdHepP4[p*4 + i]*1000 for i in range(4)])
+    return (0, [0., 0., 0., 0.])
+
+
+def new_buffers(tables=TABLES):
+    """Empty column buffers and offsets for the given tables (points need trajectories)."""
+    buffers = {table: {col: _ColumnBuffer(*spec) for col, spec in TABLES[table].items()}
+               for table in tables}
+    offsets = {table: array("l", [0]) for table in tables}
+    if "points" in tables:
+        offsets["points_trajectory"] = array("l", [0])
+    return buffers, offsets
+
+
+def fill_event(event, buffers, offsets, volumes):
+    """Append one TG4Event to the buffers from new_buffers. Only the tables in buffers
+    are filled; volumes maps SegmentDetectors names to the ids stored in the segments."""
+
+    ## Primary vertices and particles
+    if "vertices" in buffers or "primaries" in buffers:
+        for ivtx, vtx in enumerate(event.Primaries):
+            if "vertices" in buffers:
+                pos = vtx.GetPosition()
+                buffers["vertices"]["position"].append(pos.X(), pos.Y(), pos.Z(), pos.T())
+                buffers["vertices"]["reaction"].append(str(vtx.GetReaction()))
+            if "primaries" not in buffers: continue
+            for part in vtx.Particles:
+                mom = part.GetMomentum()
+                prim = buffers["primaries"]
+                prim["track_id"].append(part.GetTrackId())
+                prim["pdg"].append(part.GetPDGCode())
+                prim["p4"].append(mom.Px(), mom.Py(), mom.Pz(), mom.E())
+                prim["vertex"].append(ivtx)
+
+    ## Trajectories and their points
+    if "trajectories" in buffers:
+        for traj in event.Trajectories:
+            mom = traj.GetInitialMomentum()
+            trj = buffers["trajectories"]
+            trj["track_id"].append(traj.GetTrackId())
+            trj["parent_id"].append(traj.GetParentId())
+            trj["pdg"].append(traj.GetPDGCode())
+            trj["p4"].append(mom.Px(), mom.Py(), mom.Pz(), mom.E())
+            if "points" not in buffers: continue
+            for pt in traj.Points:
+                pos = pt.GetPosition()
+                pmom = pt.GetMomentum()
+                buffers["points"]["position"].append(pos.X(), pos.Y(), pos.Z(), pos.T())
+                buffers["points"]["momentum"].append(pmom.X(), pmom.Y(), pmom.Z())
+            offsets["points_trajectory"].append(len(buffers["points"]["momentum"].data)//3)
+
+    ## Energy deposits, one block per sensitive detector
+    if "segments" in buffers:
+        seg_buf = buffers["segments"]
+        for det in event.SegmentDetectors:
+            vol_id = volumes.setdefault(str(det[0]), len(volumes))
+            for seg in det[1]:
+                start = seg.GetStart()
+                stop = seg.GetStop()
+                seg_buf["volume"].append(vol_id)
+                seg_buf["start"].append(start.X(), start.Y(), start.Z())
+                seg_buf["stop"].append(stop.X(), stop.Y(), stop.Z())
+                seg_buf["edep"].append(seg.GetEnergyDeposit())
+                seg_buf["primary_id"].append(seg.GetPrimaryId())
+                seg_buf["contributor"].append(seg.GetContributors()[0])
+                seg_buf["track_length"].append(seg.GetTrackLength())
+
+    for table in buffers:
+        first_col = next(iter(TABLES[table]))
+        buf = buffers[table][first_col]
+        offsets[table].append(len(buf.data)//buf.width)
+
+
+def buffers_to_arrays(buffers, offsets):
+    """{table: {column: array, "offsets": array}} from filled buffers, in the layout
+    of EventCache.batch."""
+    out = {}
+    for table, cols in buffers.items():
+        out[table] = {col: buf.to_numpy() for col, buf in cols.items()}
+        out[table]["offsets"] = np.frombuffer(offsets[table], dtype="l").astype("i8")
+    if "points" in buffers:
+        out["points"]["trajectory_offsets"] = np.frombuffer(offsets["points_trajectory"], dtype="l").astype("i8")
+    return out
+
+
+def convert_file(input_file_name, output_dir, genie_tree="DetSimPassThru/gRooTracker"):
+    """Convert a single edep-sim file into a columnar cache directory.
+
+    Parameters
+    ----------
+    input_file_name : str
+        Path to the edep-sim output file
+    output_dir : str
+        Directory in which the <basename>.cache directory is created
+    genie_tree : str, optional
+        Name of the GENIE pass-through tree (None to skip the GENIE columns)
+
+    Returns
+    -------
+    str : path of the cache directory
+    """
+    import ROOT
+
+    edep_chain = ROOT.TChain("EDepSimEvents")
+    edep_chain.Add(input_file_name)
+    groo_chain = None
+    if genie_tree:
+        groo_chain = ROOT.TChain(genie_tree)
+        groo_chain.Add(input_file_name)
+
+    buffers, offsets = new_buffers()
+    genie = {col: _ColumnBuffer(*spec) for col, spec in GENIE_COLUMNS.items()}
+    volumes = {}
+
+    nevt = edep_chain.GetEntries()
+    print("Caching", nevt, "events from", input_file_name)
+
+    for evt in range(nevt):
+
+        if nevt >= 10 and evt % (int(nevt/10)) == 0 and evt != 0:
+            print("Processed event:", evt)
+
+        edep_chain.GetEntry(evt)
+        fill_event(edep_chain.Event, buffers, offsets, volumes)
+
+        ## GENIE pass-through info (same number of entries)
+        if groo_chain:
+            groo_chain.GetEntry(evt)
+            nu_pdg, nu_p4 = _get_nu_4mom(groo_chain)
+            genie["nu_pdg"].append(nu_pdg)
+            genie["nu_p4"].append(*nu_p4)
+
+    ## Write everything out (write to a temporary name, then move into place)
+    out_path = cache_dir_name(input_file_name, output_dir)
+    tmp_path = out_path + ".tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    for table, cols in buffers_to_arrays(buffers, offsets).items():
+        for col, arr in cols.items():
+            name = "points_trajectory_offsets.npy" if col == "trajectory_offsets" else "{}_{}.npy".format(table, col)
+            np.save(os.path.join(tmp_path, name), arr)
+    if groo_chain:
+        for col, buf in genie.items():
+            np.save(os.path.join(tmp_path, "genie_{}.npy".format(col)), buf.to_numpy())
+
+    meta = {"format_version": CACHE_FORMAT_VERSION,
+            "source": os.path.abspath(input_file_name),
+            "n_events": nevt,
+            "volumes": sorted(volumes, key=volumes.get),
+            "genie": bool(groo_chain)}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=1)
+
+    if os.path.isdir(out_path):
+        for old in glob(os.path.join(out_path, "*")):
+            os.remove(old)
+        os.rmdir(out_path)
+    os.rename(tmp_path, out_path)
+    print("Wrote", nevt, "events to", out_path)
+    return out_path
+
+
+def get_cache(input_file_name, output_dir, genie_tree="DetSimPassThru/gRooTracker"):
+    """Open the cache for an input file, (re)converting it first if it doesn't exist
+    or was written with a different format version."""
+    path = cache_dir_name(input_file_name, output_dir)
+    try:
+        return EventCache(path)
+    except (OSError, ValueError):
+        return EventCache(convert_file(input_file_name, output_dir, genie_tree))
+
+
+class EventCache:
+    """Read-only view of a cache directory written by convert_file.
+
+    All columns are memory-mapped on first access. Columns are accessed as
+    cache.segments["stop"], cache.trajectories["pdg"], ..., and the per-event
+    offsets as cache.segments["offsets"]. Use event(num) to get the rows for a
+    single event.
+    """
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format_version"] != CACHE_FORMAT_VERSION:
+            raise ValueError("Cache {} has format version {}, expected {}".format(
+                path, self.meta["format_version"], CACHE_FORMAT_VERSION))
+        self.volumes = self.meta["volumes"]
+        self._columns = {}
+
+    def __len__(self):
+        return self.meta["n_events"]
+
+    def column(self, table, col):
+        """Return a single (memory-mapped) column of a table."""
+        key = (table, col)
+        if key not in self._columns:
+            self._columns[key] = np.load(os.path.join(self.path, "{}_{}.npy".format(table, col)),
+                                         mmap_mode=self.mmap_mode)
+        return self._columns[key]
+
+    def _table(self, table):
+        names = list(TABLES.get(table, {})) + ["offsets"]
+        if table == "genie":
+            names = list(GENIE_COLUMNS)
+        if table == "points":
+            names.append("trajectory_offsets")
+        return {col: self.column(table, col) for col in names}
+
+    @property
+    def segments(self):
+        return self._table("segments")
+
+    @property
+    def trajectories(self):
+        return self._table("trajectories")
+
+    @property
+    def points(self):
+        return self._table("points")
+
+    @property
+    def primaries(self):
+        return self._table("primaries")
+
+    @property
+    def vertices(self):
+        return self._table("vertices")
+
+    @property
+    def genie(self):
+        return self._table("genie")
+
+    def batch(self, first, last):
+        """Return {table: {column: rows}} for events [first, last), with every
+        table's offsets shifted to start at 0 (the layout batch_selections.py expects).
+        """
+        out = {}
+        for table in TABLES:
+            off = self.column(table, "offsets")[first:last+1]
+            lo, hi = off[0], off[-1]
+            out[table] = {col: self.column(table, col)[lo:hi] for col in TABLES[table]}
+            out[table]["offsets"] = off - lo
+        traj_off = self.column("trajectories", "offsets")
+        pt_off = self.column("points", "trajectory_offsets")[traj_off[first]:traj_off[last]+1]
+        out["points"]["trajectory_offsets"] = pt_off - pt_off[0]
+        if self.meta["genie"]:
+            out["genie"] = {col: self.column("genie", col)[first:last] for col in GENIE_COLUMNS}
+        return out
+
+    def event(self, num):
+        """Return {table: {column: rows of event num}} for a single event.
+
+        The point rows keep their per-trajectory offsets, shifted to start at 0.
+        """
+        out = {}
+        for table in TABLES:
+            off = self.column(table, "offsets")
+            lo, hi = off[num], off[num+1]
+            out[table] = {col: self.column(table, col)[lo:hi] for col in TABLES[table]}
+        traj_off = self.column("trajectories", "offsets")
+        pt_off = self.column("points", "trajectory_offsets")[traj_off[num]:traj_off[num+1]+1]
+        out["points"]["trajectory_offsets"] = pt_off - pt_off[0]
+        if self.meta["genie"]:
+            out["genie"] = {col: self.column("genie", col)[num] for col in GENIE_COLUMNS}
+        return out
+
+
+if __name__ == '__main__':
+
+    ## Get arguments
+    parser = OptionParser(usage="%prog -o <cache_dir> <input_file.root> [...]")
+    parser.add_option("-o", "--outDir", action="store", type="string", dest="outDir", default=".")
+    parser.add_option("--genieTree", action="store", type="string", dest="genieTree",
+                      default="DetSimPassThru/gRooTracker",
+                      help="GENIE pass-through tree name (use 'none' to skip)")
+    (options, args) = parser.parse_args()
+
+    if len(args) < 1:
+        print("At least one edep-sim processed file is required as an argument!")
+        sys.exit()
+
+    genie_tree = None if options.genieTree.lower() == "none" else options.genieTree
+    os.makedirs(options.outDir, exist_ok=True)
+    for file in args:
+        ## Allow for escaped wildcards in the input...
+        for f in glob(file):
+            convert_file(f, options.outDir, genie_tree)
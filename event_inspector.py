@@ -1,5 +1,6 @@
 import sys
 import math
+import numpy as np
 import ROOT as RT
 
 GENIE_STATUS_DEF = {
@@ -25,8 +26,25 @@ class Inspector:
     the first event by default.
     """
     def __init__(self, file_list):
+        self.geometry = None
         self.load_files(file_list)
 
+    def load_geometry(self, gdml_file=None):
+        """Use the GDML geometry (instead of the 2x2 box approximation) for the
+        containment checks and point_volume.
+
+        Parameters
+        ----------
+        gdml_file : string, optional
+            GDML file to load, defaults to inputs/Merged2x2MINERvA_noRock.gdml
+
+        Returns
+        -------
+        None
+        """
+        import geometry
+        self.geometry = geometry.load_geometry(gdml_file or geometry.DEFAULT_GDML)
+
     def load_files(self, file_list):
         """Load a list of edep-sim files for inspection. Adds each file to
         a TChain, and loads the GENIE pass-through information.
@@ -74,8 +92,122 @@ class Inspector:
         self.Vtx  = self.edep_tree.Event.Primaries[0]
         self.Traj = self.edep_tree.Event.Trajectories
         self.get_neutrino()
+        self.build_traj_index()
+        self.build_segment_index()
         return
 
+    def build_traj_index(self):
+        """Build a cached index of the trajectory tree of the loaded event, so that
+        the parent/children/PDG queries don't have to rescan every trajectory. Called
+        by load_event. Stores the following class members:
+        - traj_parent : parent track ID of each track
+        - traj_pdg : PDG code of each track
+        - traj_children : dict of track ID -> list of children track IDs
+        - pdg_tracks : dict of PDG code -> list of track IDs
+        - traj_depth : number of generations below the neutrino (primaries have depth 0)
+        - traj_primary : track ID of the primary particle each track descends from
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.traj_parent = []
+        self.traj_pdg = []
+        self.traj_children = {}
+        self.pdg_tracks = {}
+
+        for trk in self.Traj:
+            trk_id = trk.GetTrackId()
+            parent_id = trk.GetParentId()
+            pdg = trk.GetPDGCode()
+            self.traj_parent.append(parent_id)
+            self.traj_pdg.append(pdg)
+            self.traj_children.setdefault(parent_id, []).append(trk_id)
+            self.pdg_tracks.setdefault(pdg, []).append(trk_id)
+
+        ## Parents almost always come before their children, but don't rely on it
+        n_trk = len(self.traj_parent)
+        self.traj_depth = [-1] * n_trk
+        self.traj_primary = [-1] * n_trk
+        for trk_id in range(n_trk):
+            chain = []
+            curr_id = trk_id
+            while curr_id != -1 and self.traj_depth[curr_id] == -1:
+                chain.append(curr_id)
+                curr_id = self.traj_parent[curr_id]
+
+            if curr_id == -1:
+                depth, primary = -1, chain[-1]
+            else:
+                depth, primary = self.traj_depth[curr_id], self.traj_primary[curr_id]
+
+            for curr_id in reversed(chain):
+                depth += 1
+                self.traj_depth[curr_id] = depth
+                self.traj_primary[curr_id] = primary
+
+    def build_segment_index(self):
+        """Group the energy deposits of the loaded event by track in a single pass
+        over SegmentDetectors. Called by load_event. Each of the following class members
+        is a dict with a "contrib" entry (grouped by the first contributor of each
+        segment) and a "primary" entry (grouped by the PrimaryId of each segment),
+        each mapping track ID -> value:
+        - trk_edep : summed energy deposit
+        - trk_length : summed segment track length
+        - trk_segments : list of segments
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self.trk_edep = {"contrib": {}, "primary": {}}
+        self.trk_length = {"contrib": {}, "primary": {}}
+        self.trk_segments = {"contrib": {}, "primary": {}}
+
+        segment_det = self.edep_tree.Event.SegmentDetectors
+        for k,v in segment_det:
+            for edep in v:
+                energy = edep.GetEnergyDeposit()
+                length = edep.GetTrackLength()
+                keys = (("contrib", edep.GetContributors()[0]), ("primary", edep.GetPrimaryId()))
+                for group, trk_id in keys:
+                    self.trk_edep[group][trk_id] = self.trk_edep[group].get(trk_id, 0) + energy
+                    self.trk_length[group][trk_id] = self.trk_length[group].get(trk_id, 0) + length
+                    self.trk_segments[group].setdefault(trk_id, []).append(edep)
+
+    def export_traj_index(self):
+        """Export the trajectory index of the loaded event as NumPy arrays for batch use.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict : with the following arrays, indexed by track ID
+            parent, pdg, depth, primary : see build_traj_index
+            children, children_offsets : children of track i are
+                children[children_offsets[i]:children_offsets[i+1]]
+        """
+        n_trk = len(self.traj_parent)
+        n_children = [len(self.traj_children.get(trk_id, [])) for trk_id in range(n_trk)]
+        children = [c for trk_id in range(n_trk) for c in self.traj_children.get(trk_id, [])]
+
+        return {"parent"  : np.array(self.traj_parent, dtype=np.int32),
+                "pdg"     : np.array(self.traj_pdg, dtype=np.int32),
+                "depth"   : np.array(self.traj_depth, dtype=np.int32),
+                "primary" : np.array(self.traj_primary, dtype=np.int32),
+                "children": np.array(children, dtype=np.int32),
+                "children_offsets": np.concatenate(([0], np.cumsum(n_children))).astype(np.int64)}
+
     def get_neutrino(self):
         """Extracts neutrino kinematics and PDG code from the GENIE tree. Information
         is stored as class members for use in other functions.
@@ -200,7 +332,7 @@ class Inspector:
         -------
         None
         """
-        parent_id = self.Traj[trk_id].GetParentId()
+        parent_id = self.traj_parent[trk_id]
 
         if parent_id == -1:
             print("Primary particle. Parent ID is -1")
@@ -223,10 +355,9 @@ class Inspector:
         -------
         None
         """
-        for trk in self.Traj:
-            parent_id = trk.GetParentId()
-            if parent_id == trk_id and trk.GetPDGCode() not in filter:
-                self.trk_print(trk)
+        for child_id in self.traj_children.get(trk_id, []):
+            if self.traj_pdg[child_id] not in filter:
+                self.trk_print(self.Traj[child_id])
 
     def list_ancestors(self, trk_id):
         """List all ancestor particles/tracks of the given track.
@@ -241,16 +372,15 @@ class Inspector:
         -------
         None
         """
-        curr_track = self.Traj[trk_id]
-        parent_id  = curr_track.GetParentId()
+        parent_id = self.traj_parent[trk_id]
         print("\u2605", end = " ")
-        self.trk_print(curr_track)
+        self.trk_print(self.Traj[trk_id])
 
         while(parent_id != -1):
-            curr_track = self.Traj[parent_id]
-            parent_id  = curr_track.GetParentId()
+            curr_id   = parent_id
+            parent_id = self.traj_parent[curr_id]
             print("\u2BA1", end = " ")
-            self.trk_print(curr_track)
+            self.trk_print(self.Traj[curr_id])
 
     def find_particle(self, pdg_code):
         """List all tracks with the given PDG code.
@@ -264,9 +394,8 @@ class Inspector:
         -------
         None
         """
-        for trk in self.Traj:
-            if trk.GetPDGCode() == pdg_code:
-                self.trk_print(trk)
+        for trk_id in self.pdg_tracks.get(pdg_code, []):
+            self.trk_print(self.Traj[trk_id])
 
     def energy_deposit_trk(self, trk_id, use_primary=False):
         """Get the total energy deposited along the given track as stored
@@ -285,21 +414,8 @@ class Inspector:
         -------
         reco_energy : the sum of energy deposited in each segment
         """
-        reco_energy = 0
-        segment_det = self.edep_tree.Event.SegmentDetectors
-        for k,v in segment_det:
-            for edep in v:
-                edep_id = -1
-
-                if use_primary:
-                    edep_id = edep.GetPrimaryId()
-                else:
-                    edep_id = edep.GetContributors()[0]
-
-                if trk_id == edep_id:
-                    reco_energy += edep.GetEnergyDeposit()
-
-        return reco_energy
+        group = "primary" if use_primary else "contrib"
+        return self.trk_edep[group].get(trk_id, 0)
 
     def trk_info(self, trk_id):
         """Print the following information for a given track:
@@ -325,7 +441,7 @@ class Inspector:
         P = trk_4vec.P()
         T = trk_4vec.E() - trk_4vec.M()
 
-        parent_id = trk.GetParentId()
+        parent_id = self.traj_parent[trk_id]
         if parent_id != -1:
             parent_name = self.Traj[parent_id].GetName()
         else:
@@ -338,24 +454,30 @@ class Inspector:
 
         print("PDG   : {:8s} {:5d} | TrkID: {:4d}".format(trk.GetName(), trk.GetPDGCode(), trk.GetTrackId()))
         print("Parent: {:14s} | TrkID: {:4d}".format(parent_name, parent_id))
+        print("Primary ancestor TrkID: {:4d}, generation: {:d}".format(self.traj_primary[trk_id], self.traj_depth[trk_id]))
         print("Energy = {:.3f}, P = {:.3f}, T = {:.3f}".format(E, P, T))
         print("Energy deposited: {:.4f}".format(trk_edep))
         print("Start : ({:.2f}, {:.2f}, {:.2f})".format(start.X(), start.Y(), start.Z()))
         print("End   : ({:.2f}, {:.2f}, {:.2f})".format(end.X(), end.Y(), end.Z()))
         print("Contained: {}".format(self.is_track_contained(trk)))
 
-    def get_edep_segments(self, trk_id):
+    def get_edep_segments(self, trk_id, use_primary=False):
+        """Get the list of energy deposits (segments) for the given track.
 
-        edep_list = []
-        segment_det = self.edep_tree.Event.SegmentDetectors
-        for k,v in segment_det:
-            for edep in v:
-                prim_id = edep.GetPrimaryId()
-                contrib = edep.GetContributors()
-                if trk_id == contrib[0]:
-                    edep_list.append(edep)
+        Parameters
+        ----------
+        track_id : int
+            ID of the track to get the segments for
+        use_primary : bool, optional
+            Use the PrimaryId of the energy deposit instead of the
+            first contributor when deciding to include the segment
 
-        return edep_list
+        Returns
+        -------
+        edep_list : list of segments
+        """
+        group = "primary" if use_primary else "contrib"
+        return self.trk_segments[group].get(trk_id, [])
 
     def list_dedx(self, trk_id):
 
@@ -368,6 +490,32 @@ class Inspector:
 
         print(dedx_sum / len(edep_list))
 
+    def list_tracks(self, use_primary=False):
+        """Print a one-line summary of every track in the event: PDG, track and parent IDs,
+        kinetic energy, energy deposited, number of segments and summed segment length.
+
+        Parameters
+        ----------
+        use_primary : bool, optional
+            Group the energy deposits by PrimaryId instead of first contributor
+
+        Returns
+        -------
+        None
+        """
+        group = "primary" if use_primary else "contrib"
+        edep_sum = self.trk_edep[group]
+        length_sum = self.trk_length[group]
+        segments = self.trk_segments[group]
+
+        print("{:>5s} {:>6s} {:>6s} {:>10s} {:>10s} {:>6s} {:>10s}".format(
+            "TrkID", "PDG", "Parent", "T", "Edep", "N.seg", "Length"))
+        for trk_id, trk in enumerate(self.Traj):
+            T = trk.GetInitialMomentum().E() - trk.GetInitialMomentum().M()
+            print("{:5d} {:6d} {:6d} {:10.3f} {:10.4f} {:6d} {:10.2f}".format(
+                trk_id, self.traj_pdg[trk_id], self.traj_parent[trk_id], T,
+                edep_sum.get(trk_id, 0), len(segments.get(trk_id, [])), length_sum.get(trk_id, 0)))
+
     def trk_print(self, trk):
         T = trk.GetInitialMomentum().E() - trk.GetInitialMomentum().M()
         # print("PDG: {:5d} {:8s} | TrkID: {:4d} E: {:.3f}".format(trk.GetPDGCode(), trk.GetName(), trk.GetTrackId(), trk.GetInitialMomentum().E()))
@@ -384,11 +532,28 @@ class Inspector:
         -------
         bool : True if contained, False if not contained
         """
+        if self.geometry is not None:
+            return bool(self.geometry.contained(np.array([[pos[0], pos[1], pos[2]]]))[0])
         if abs(pos[0]) > 670: return False
         if abs(pos[1] - 430) > 670: return False
         if abs(pos[2]) > 670: return False
         return True
 
+    def point_volume(self, pos):
+        """Name of the deepest geometry volume containing the given (X,Y,Z) point.
+        Requires load_geometry() to have been called.
+
+        Parameters
+        ----------
+        pos : List or vector of position in (X,Y,Z)
+
+        Returns
+        -------
+        string : Logical volume name, empty if outside the world volume
+        """
+        volume = self.geometry.volume_of(np.array([[pos[0], pos[1], pos[2]]]))
+        return str(self.geometry.volume_names(volume)[0])
+
     def is_track_contained(self, trk):
         """Checks if the given track is contained in the 2x2 volume.
 
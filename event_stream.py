@@ -0,0 +1,178 @@
+## Streaming access to edep-sim files in fixed-size batches
+##
+## iter_batches walks any number of edep-sim files in order and yields batches of
+## batch_size events, decoded into the same jagged NumPy layout as EventCache.batch
+## (see event_cache.py and batch_selections.py), with the GENIE pass-through entries
+## aligned to the EDepSimEvents entries. Only the requested fields are decoded (and only
+## their branches read), and each batch is built from scratch, so memory use is set by
+## batch_size, not by the size of the dataset.
+##
+##   for evts in iter_batches(files, ["primaries", "segments", "genie"], batch_size=5000):
+##       mask = batch_selections.is_hadronic_contained_batch(...)
+##       evts["meta"]["file"][i], evts["meta"]["entry"][i]   ## where row i came from
+import numpy as np
+
+from event_cache import TABLES, GENIE_COLUMNS, _ColumnBuffer, _get_nu_4mom, new_buffers, fill_event, buffers_to_arrays
+
+EDEP_TREE = "EDepSimEvents"
+GENIE_TREE = "DetSimPassThru/gRooTracker"
+
+## GENIE StdHep record, one row per particle (momenta converted to MeV, as elsewhere)
+STDHEP_COLUMNS = {
+    "status":   ("i4", 1),
+    "pdg":      ("i4", 1),
+    "p4":       ("f8", 4),   ## px, py, pz, E (MeV)
+}
+
+## Fields that can be requested: the event_cache tables, plus from the GENIE tree
+##  "genie"  : nu_pdg, nu_p4 and the EvtCode string ("code"), one row per event
+##  "stdhep" : the full StdHep record of each event
+FIELDS = list(TABLES) + ["genie", "stdhep"]
+DEFAULT_FIELDS = ["primaries", "trajectories", "segments", "genie"]
+
+## Branches read for each field (everything else is switched off)
+FIELD_BRANCHES = {
+    "vertices":     ["*Primaries*"],
+    "primaries":    ["*Primaries*"],
+    "trajectories": ["*Trajectories*"],
+    "points":       ["*Trajectories*"],
+    "segments":     ["*SegmentDetectors*"],
+    "genie":        ["StdHepN", "StdHepStatus*", "StdHepPdg*", "StdHepP4*", "EvtCode*"],
+    "stdhep":       ["StdHepN", "StdHepStatus*", "StdHepPdg*", "StdHepP4*"],
+}
+
+
+class _BatchBuilder:
+    """Buffers for one batch of events."""
+    def __init__(self, tables, fields):
+        self.buffers, self.offsets = new_buffers(tables)
+        self.genie = None
+        if "genie" in fields:
+            self.genie = {col: _ColumnBuffer(*spec) for col, spec in GENIE_COLUMNS.items()}
+            self.genie["code"] = _ColumnBuffer("U", 1)
+        self.stdhep = None
+        if "stdhep" in fields:
+            self.stdhep = {col: _ColumnBuffer(*spec) for col, spec in STDHEP_COLUMNS.items()}
+            self.stdhep_offsets = [0]
+        self.file = []
+        self.entry = []
+
+    def __len__(self):
+        return len(self.entry)
+
+    def add(self, event, groo, ifile, entry, volumes):
+        fill_event(event, self.buffers, self.offsets, volumes)
+        if self.genie:
+            nu_pdg, nu_p4 = _get_nu_4mom(groo)
+            self.genie["nu_pdg"].append(nu_pdg)
+            self.genie["nu_p4"].append(*nu_p4)
+            self.genie["code"].append(str(groo.EvtCode.GetString()))
+        if self.stdhep:
+            for p in range(groo.StdHepN):
+                self.stdhep["status"].append(groo.StdHepStatus[p])
+                self.stdhep["pdg"].append(groo.StdHepPdg[p])
+                self.stdhep["p4"].append(*[groo.StdHepP4[p*4 + i]*1000 for i in range(4)])
+            self.stdhep_offsets.append(self.stdhep_offsets[-1] + groo.StdHepN)
+        self.file.append(ifile)
+        self.entry.append(entry)
+
+    def finish(self, files, volumes, first_global):
+        out = buffers_to_arrays(self.buffers, self.offsets)
+        if self.genie:
+            out["genie"] = {col: buf.to_numpy() for col, buf in self.genie.items()}
+        if self.stdhep:
+            out["stdhep"] = {col: buf.to_numpy() for col, buf in self.stdhep.items()}
+            out["stdhep"]["offsets"] = np.array(self.stdhep_offsets, dtype="i8")
+        out["meta"] = {"file": np.array(self.file, dtype="i8"),
+                       "entry": np.array(self.entry, dtype="i8"),
+                       "global_entry": first_global + np.arange(len(self.entry)),
+                       "files": list(files),
+                       "volumes": sorted(volumes, key=volumes.get)}
+        return out
+
+
+def _select_branches(tree, fields):
+    tree.SetBranchStatus("*", 0)
+    for field in fields:
+        for branch in FIELD_BRANCHES[field]:
+            tree.SetBranchStatus(branch, 1)
+
+
+def iter_batches(files, fields=DEFAULT_FIELDS, batch_size=1000, entry_range=None, genie_tree=GENIE_TREE):
+    """Yield batches of decoded events from a list of edep-sim files.
+
+    Parameters
+    ----------
+    files : list of str
+        edep-sim files, read in this order as one continuous sequence of entries
+    fields : list of str, optional
+        Which fields to decode (see FIELDS); "points" also decodes "trajectories"
+    batch_size : int, optional
+        Events per batch (the last batch may be shorter); batches span file boundaries
+    entry_range : (first, last), optional
+        Only read entries [first, last) of the combined sequence (last may be None)
+    genie_tree : str, optional
+        Name of the GENIE pass-through tree, read only for the "genie"/"stdhep" fields
+
+    Yields
+    ------
+    dict : {field: {column: array, "offsets": array}, "meta": {...}}, with tables in the
+        EventCache.batch layout, "genie" columns with one row per event, and "meta"
+        holding, for every event, its "file" (index into files), "entry" (within that
+        file) and "global_entry", plus the "files" list and the segment "volumes" names
+    """
+    import ROOT
+
+    fields = list(fields)
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError("Unknown fields {}, expected some of {}".format(unknown, FIELDS))
+    if "points" in fields and "trajectories" not in fields:
+        fields.append("trajectories")
+    tables = [t for t in TABLES if t in fields]
+    genie_fields = [f for f in fields if f in ("genie", "stdhep")]
+
+    first, last = entry_range if entry_range else (0, None)
+    volumes = {}
+    batch = _BatchBuilder(tables, fields)
+    batch_first = first
+    file_start = 0
+
+    for ifile, file_name in enumerate(files):
+        if last is not None and file_start >= last: break
+
+        edep_chain = ROOT.TChain(EDEP_TREE)
+        edep_chain.Add(file_name)
+        nentries = edep_chain.GetEntries()
+        lo = max(first - file_start, 0)
+        hi = nentries if last is None else min(last - file_start, nentries)
+
+        if lo < hi:
+            groo_chain = None
+            if genie_fields:
+                groo_chain = ROOT.TChain(genie_tree)
+                groo_chain.Add(file_name)
+                if groo_chain.GetEntries() != nentries:
+                    raise ValueError("{} has {} {} entries but {} {} entries".format(
+                        file_name, nentries, EDEP_TREE, groo_chain.GetEntries(), genie_tree))
+                _select_branches(groo_chain, genie_fields)
+            _select_branches(edep_chain, [f for f in fields if f in TABLES])
+
+            for entry in range(lo, hi):
+                event = None
+                if tables:
+                    edep_chain.GetEntry(entry)
+                    event = edep_chain.Event
+                if groo_chain:
+                    groo_chain.GetEntry(entry)
+                batch.add(event, groo_chain, ifile, entry, volumes)
+
+                if len(batch) == batch_size:
+                    yield batch.finish(files, volumes, batch_first)
+                    batch_first += batch_size
+                    batch = _BatchBuilder(tables, fields)
+
+        file_start += nentries
+
+    if len(batch):
+        yield batch.finish(files, volumes, batch_first)
@@ -4,6 +4,15 @@ from ROOT import TLorentzVector
 from math import sqrt
 import sys
 from glob import glob
+from functools import partial
+from multiprocessing import Pool
+from optparse import OptionParser
+import numpy as np
+
+from product_cache import ProductCache, code_fingerprint
+import prefetch
+import loop_timer
+from hist_buffer import BufferedHist
 
 ## Make ROOT non-hideous
 ROOT.gROOT.SetBatch(1)
@@ -249,23 +258,14 @@ def get_neutrino_4mom(groo_event):
     ## Should never happen...
     return None
         
-## Example event loop
-def test_containment(infilelist):
+## Expand any (escaped) wildcards in the input file list
+def expand_file_list(infilelist):
+    return [f for file in infilelist for f in sorted(glob(file))]
 
-    ## Get the file(s)
-    edep_tree = ROOT.TChain("EDepSimEvents")
-    groo_tree = ROOT.TChain("DetSimPassThru/gRooTracker")
 
-    ## Loop over the file list and add them to the chain
-    for file in infilelist:
-        ## Allow for escaped wildcards in the input...
-        for f in glob(file):
-            edep_tree.Add(f)
-            groo_tree.Add(f)
+## Make the histograms filled by test_containment
+def make_histograms():
 
-    nevts  = edep_tree.GetEntries()
-    
-    ## Set up histograms
     q2_all = ROOT.TH1D("q2_all",
                        "q2_all;Q^{2} (GeV); N. events",
                        25, 0, 5)
@@ -277,32 +277,69 @@ def test_containment(infilelist):
     pi_energy_smearing = ROOT.TH2D("pi_energy_smearing",
                                    "pi_energy_smearing;p_{#pi}^{true} (GeV); p_{#pi}^{reco} (GeV); N. events",
                                    20, 0, 0.5, 20, 0, 0.5)
+    return q2_all, q2_cont, pi_energy_smearing
+
+
+## Run the selection over a list of files, and return the values to fill the histograms with
+## (rather than filling them directly), so that the files can be split over several processes
+## and the histograms filled afterwards in exactly the same order
+## With read_ahead > 0, the events are read in a background thread (see prefetch.py)
+## Pass a loop_timer.LoopTimer as timer to record the time spent in each stage
+def process_files(infilelist, read_ahead=0, timer=None):
+
+    if timer is None: timer = loop_timer.NullTimer()
+
+    ## Get the file(s)
+    with timer.stage("chain_open"):
+        edep_tree = ROOT.TChain("EDepSimEvents")
+        groo_tree = ROOT.TChain("DetSimPassThru/gRooTracker")
+
+        ## Loop over the file list and add them to the chain
+        for f in infilelist:
+            edep_tree.Add(f)
+            groo_tree.Add(f)
+
+        nevts  = edep_tree.GetEntries()
+        events = prefetch.event_reader(edep_tree, infilelist, read_ahead)
+
+    ## Values to fill each histogram with, in event order
+    fills = {"q2_all": [], "q2_cont": [], "pi_energy_smearing": []}
     
     ## Loop over events
     print("Looping over", nevts, "events")
+    timer.start_loop(nevts)
     for evt in range(nevts):
 
-        if evt%(int(nevts/10)) == 0 and evt != 0: print("Processed event:", evt)
+        timer.event(evt)
         
-        edep_tree.GetEntry(evt)
-        groo_tree.GetEntry(evt)
+        with timer.stage("get_entry_edep"):
+            event = events.get(evt)
+        with timer.stage("get_entry_genie"):
+            groo_tree.GetEntry(evt)
         
         ## Vertex info
         ## Note the assumption that there's one vertex/event here
         ## This won't be true for full spill simulation!
-        vertex = edep_tree.Event.Primaries[0]
+        vertex = event.Primaries[0]
 
         ## Get the list of pdgs in this event (can be used to classify the topology)
         prim_pdg_list = tuple(x.GetPDGCode() for x in vertex.Particles)
 
         ## Is this event "signal"? If not, skip it
-        if not is_ccinc(prim_pdg_list): continue
+        with timer.stage("is_ccinc"):
+            signal = is_ccinc(prim_pdg_list)
+        if not signal: continue
 
-        ## Is this event contained?
-        cont = is_event_contained(edep_tree.Event)
+        ## Is this event contained? (as is_event_contained, but timing each part)
+        with timer.stage("is_muon_tagged"):
+            cont = is_muon_tagged(event)
+        if cont:
+            with timer.stage("is_hadronic_contained"):
+                cont = is_hadronic_contained(event)
 
         ## Get the neutrino info from the gRooTracker tree
-        nu_4mom = get_neutrino_4mom(groo_tree)
+        with timer.stage("neutrino_4mom"):
+            nu_4mom = get_neutrino_4mom(groo_tree)
 
         ## Check the neutrino exists... if not, something very funky has happened
         if not nu_4mom:
@@ -323,13 +360,13 @@ def test_containment(infilelist):
         q2 = -1 *(mu_4mom - nu_4mom).Mag2()/1e6
 
         ## Keep track of the Q2 for all events
-        q2_all .Fill(q2)
+        fills["q2_all"].append((q2,))
         
         ## Only continue with contained events
         if not cont: continue
 
         ## Keep track of the Q2 for contained events
-        q2_cont .Fill(q2)
+        fills["q2_cont"].append((q2,))
         
         ## Now, look at the energy reconstruction for all charged pion from contained events
         ## (randomly picked as an example)
@@ -343,9 +380,133 @@ def test_containment(infilelist):
             true_e = true_4mom.E() - true_4mom.M()
 
             ## Calculate the energy deposited
-            reco_e = get_reco_energy(edep_tree.Event, pion.GetTrackId())
+            with timer.stage("get_reco_energy"):
+                reco_e = get_reco_energy(event, pion.GetTrackId())
+
+            fills["pi_energy_smearing"].append((true_e/1000, reco_e/1000))
+
+    events.close()
+    return fills
+
+
+## process_files with its own LoopTimer, returned along with the fills
+## (so that the timing also comes back from worker processes)
+def timed_process_files(infilelist, read_ahead=0):
+    timer = loop_timer.LoopTimer(", ".join(infilelist))
+    fills = process_files(infilelist, read_ahead, timer)
+    timer.record_memory()
+    return fills, timer
+
+
+## Number of values per fill for each histogram
+FILL_DIMS = {"q2_all": 1, "q2_cont": 1, "pi_energy_smearing": 2}
+
+## Name of the per-file product cached by test_containment, and the code it depends on
+## (changing any of these functions invalidates the cached results)
+FILLS_PRODUCT = "containment_fills"
+FILLS_CODE = [process_files, is_ccinc, is_muon_tagged, is_hadronic_contained, is_2x2_contained,
+              get_neutron_and_daughter_ids, get_low_energy_ids, get_traj_ids_for_pdg,
+              get_traj_for_pdg, get_reco_energy, get_neutrino_4mom]
 
-            pi_energy_smearing.Fill(true_e/1000, reco_e/1000)
+
+## Convert the output of process_files to/from arrays for the product cache
+def fills_to_arrays(fills):
+    return {name: np.array(values, dtype=float).reshape(len(values), FILL_DIMS[name])
+            for name, values in fills.items()}
+
+def arrays_to_fills(arrays):
+    return {name: [tuple(v) for v in arrays[name].tolist()] for name in FILL_DIMS}
+
+
+## Example event loop
+## With nworkers > 1, the files are shared out over a pool of processes (one file at a time)
+## The results are collected in file order, so the histograms are identical for any nworkers
+## With a cache_dir, the results for each file are cached (see product_cache.py), and only
+## new/changed files, or all files if the selection code changed, are processed again
+## With timing, the time spent in each stage is summed over all files and printed at the end
+## (and written to timing_json if given)
+## With backend="rdf" the selection runs as an RDataFrame graph instead (see rdf_backend.py),
+## each file using nthreads threads (0 = all cores) rather than a pool of processes
+def test_containment(infilelist, nworkers=1, cache_dir=None, cache_quota_gb=20., read_ahead=0,
+                     timing=False, timing_json=None, backend="python", nthreads=0):
+
+    timer = loop_timer.make_timer(timing, "test_containment")
+
+    ## Allow for escaped wildcards in the input...
+    file_list = expand_file_list(infilelist)
+    if not file_list:
+        print("No input files match", " ".join(infilelist))
+        return
+
+    ## Set up histograms
+    q2_all, q2_cont, pi_energy_smearing = make_histograms()
+    hists = {"q2_all": q2_all, "q2_cont": q2_cont, "pi_energy_smearing": pi_energy_smearing}
+    hists = {name: BufferedHist(hist) for name, hist in hists.items()}
+
+    ## The function producing the fills for a list of files
+    if backend == "rdf":
+        import rdf_backend
+        fills_code = [rdf_backend.process_files, rdf_backend.build_graph]
+        fills_version = rdf_backend.TRUTH_RDF_CODE
+        process = partial(rdf_backend.process_files, nthreads=nthreads)
+        if nworkers > 1 or read_ahead:
+            print("The rdf backend uses threads within ROOT: ignoring --workers and --prefetch")
+        nworkers = 1
+    elif backend == "python":
+        fills_code = FILLS_CODE
+        fills_version = ""
+        process = partial(timed_process_files if timing else process_files, read_ahead=read_ahead)
+    else:
+        raise ValueError("Unknown backend {} (python or rdf)".format(backend))
+
+    ## Pick up anything which has already been processed
+    cached = {}
+    if cache_dir:
+        cache = ProductCache(cache_dir, cache_quota_gb)
+        fingerprint = code_fingerprint(*fills_code, version=fills_version)
+        for f in file_list:
+            arrays = cache.get(f, FILLS_PRODUCT, fingerprint)
+            if arrays is not None:
+                cached[f] = arrays_to_fills(arrays)
+        print("Found", len(cached), "of", len(file_list), "files in the cache")
+
+    todo = [f for f in file_list if f not in cached]
+    pool = None
+    if nworkers > 1 and len(todo) > 1:
+        print("Processing", len(todo), "files with", nworkers, "workers")
+        pool = Pool(min(nworkers, len(todo)))
+        results = pool.imap(process, [[f] for f in todo])
+    else:
+        results = map(process, [[f] for f in todo])
+
+    ## Fill the histograms file by file, in the original order
+    for f in file_list:
+        if f in cached:
+            arrays = fills_to_arrays(cached.pop(f))
+        else:
+            if backend == "rdf":
+                ## The whole event loop runs inside ROOT, so it's timed as one stage
+                with timer.stage("rdf_event_loop"):
+                    fills = next(results)
+            else:
+                fills = next(results)
+                if timing:
+                    fills, file_timer = fills
+                    timer.merge(file_timer)
+            arrays = fills_to_arrays(fills)
+            if cache_dir:
+                cache.put(f, FILLS_PRODUCT, fingerprint, arrays)
+
+        ## One FillN per histogram and file
+        with timer.stage("hist_fill"):
+            for name, values in arrays.items():
+                hists[name].fill_array(*values.T)
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    timer.report(timing_json)
 
     ## Calculate the containment efficiency
     q2_cont.Divide(q2_all)
@@ -383,9 +544,29 @@ def test_containment(infilelist):
 
 if __name__ == '__main__':
 
-    if len(sys.argv) < 2:
+    parser = OptionParser(usage="%prog [options] <input_edepsim_file.root> [...]")
+    parser.add_option("-j", "--workers", action="store", type="int", dest="workers", default=1,
+                      help="Number of processes to share the input files between (default 1)")
+    parser.add_option("-c", "--cache-dir", action="store", type="string", dest="cache_dir", default=None,
+                      help="Cache the per-file results here, and only reprocess new or changed files")
+    parser.add_option("--cache-quota", action="store", type="float", dest="cache_quota", default=20.,
+                      help="Maximum size of the cache in GB (default 20)")
+    parser.add_option("--prefetch", action="store", type="int", dest="prefetch", default=0,
+                      help="Read up to this many events ahead in a background thread (default 0, off)")
+    parser.add_option("--timing", action="store_true", dest="timing", default=False,
+                      help="Print the time spent in each stage of the event loop, events/s and peak memory")
+    parser.add_option("--timing-json", action="store", type="string", dest="timing_json", default=None,
+                      help="Also write the timing summary to this JSON file (implies --timing)")
+    parser.add_option("--backend", action="store", type="choice", choices=["python", "rdf"], dest="backend",
+                      default="python", help="Event loop: python, or rdf for a multithreaded RDataFrame (default %default)")
+    parser.add_option("-t", "--threads", action="store", type="int", dest="threads", default=0,
+                      help="Threads for the rdf backend (default 0, all cores; 1 for no multithreading)")
+    (options, file_list) = parser.parse_args()
+
+    if len(file_list) < 1:
         print("At least one edep-sim processed file is required as an argument!")
         sys.exit()
 
-    file_list = [sys.argv[x] for x in range(1, len(sys.argv))]
-    test_containment(file_list)
+    test_containment(file_list, options.workers, options.cache_dir, options.cache_quota, options.prefetch,
+                     options.timing or bool(options.timing_json), options.timing_json,
+                     options.backend, options.threads)
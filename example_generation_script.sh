@@ -84,11 +84,10 @@ gntpc -i ${OUTFILEPREFIX}_GHEP.root -f rootracker -o ${OUTFILEPREFIX}_ROO.root &
 ## Now cherrypick events which have vertices in the 2x2 active volume
 ## This is entirely optional, but the POT should be reduced by a factor of 10 if it is skipped
 echo "Running cherrypicker.py..."
-python3 inputs/cherrypicker.py -i  ${OUTFILEPREFIX}_ROO.root -o ${OUTFILEPREFIX}_ROO_CHERRY.root
+python3 inputs/cherrypicker.py --bulk -i  ${OUTFILEPREFIX}_ROO.root -o ${OUTFILEPREFIX}_ROO_CHERRY.root
 
-## Get the number of events for edepsim (I know, I know...)
-NEVENTS=$(echo "TTree* tree = (TTree*)_file0->Get(\"gRooTracker\"); std::cout << tree->GetEntries() << std::endl;" | \
-	      root -l -b ${OUTFILEPREFIX}_ROO_CHERRY.root | tail -1)
+## Get the number of events for edepsim (cherrypicker.py writes the counts to a .json file next to its output)
+NEVENTS=$(python3 -c "import json; print(json.load(open('${OUTFILEPREFIX}_ROO_CHERRY.root.json'))['saved_events'])")
 
 ## The mac file defines the behaviour of edep-sim and G4
 cp inputs/2x2_beam.mac this_edep_example.mac
@@ -0,0 +1,407 @@
+## Fast point-in-volume lookup from the GDML geometry
+##
+## The GDML file is parsed once into compact tables:
+##  - for each logical volume, its daughters (transforms, bounding boxes) and a voxel
+##    grid listing the daughters that overlap each cell, used by volume_of to descend
+##    the hierarchy one level at a time for all points at once (as Geant4 navigates)
+##  - every placed volume (instance) with its world->local transform and world-frame
+##    bounding box, used by contained to test the placements of one volume directly
+## The tables are cached next to the GDML file (keyed on its contents), so later loads
+## skip the XML parsing entirely.
+##
+## The solids used in the 2x2+MINERvA geometry (box, tube, trd, torus and their
+## boolean combinations) are tested exactly, so the four-module structure and the
+## gaps between the TPCs are respected, unlike the hard-coded 670 mm box.
+##
+##   geom = load_geometry("inputs/Merged2x2MINERvA_noRock.gdml")
+##   names = geom.volume_names(geom.volume_of(points))        ## deepest volume of each point
+##   mask = geom.contained(points, volume="volLArActive")     ## inside any volLArActive
+## Points are (N, 3) arrays of global x, y, z in mm (the edep-sim coordinates).
+import os
+import pickle
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from product_cache import content_hash
+
+DEFAULT_GDML = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "inputs", "Merged2x2MINERvA_noRock.gdml")
+
+## Bump this whenever the cached table changes
+GEOMETRY_CACHE_VERSION = 2
+
+LENGTH_UNITS = {"mm": 1., "cm": 10., "m": 1000., "km": 1e6, "um": 1e-3}
+ANGLE_UNITS = {"rad": 1., "radian": 1., "mrad": 1e-3, "deg": np.pi/180., "degree": np.pi/180.}
+
+
+def _rot_x(a):
+    c, s = np.cos(a), np.sin(a)
+    return np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+
+def _rot_y(a):
+    c, s = np.cos(a), np.sin(a)
+    return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+def _rot_z(a):
+    c, s = np.cos(a), np.sin(a)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+def rotation_matrix(angles):
+    """GDML rotation angles (rad) -> the matrix M with x_daughter = M (x_mother - position).
+
+    Geant4 builds M with rotateX, rotateY, rotateZ in turn, and places the daughter with
+    the inverse of M (see G4GDMLReadStructure::PhysvolRead).
+    """
+    return _rot_z(angles[2]) @ _rot_y(angles[1]) @ _rot_x(angles[0])
+
+
+class _GDMLReader:
+    """Turns the XML into plain Python: solids, logical volumes and assemblies."""
+    def __init__(self, gdml_file):
+        root = ET.parse(gdml_file).getroot()
+        self.positions = {}
+        self.rotations = {}
+        for el in root.find("define"):
+            if el.tag == "position":
+                self.positions[el.get("name")] = self._vector(el, LENGTH_UNITS, "mm")
+            elif el.tag == "rotation":
+                self.rotations[el.get("name")] = self._vector(el, ANGLE_UNITS, "rad")
+
+        self.solids = {el.get("name"): self._solid(el) for el in root.find("solids")}
+
+        self.volumes = {}
+        self.assemblies = {}
+        for el in root.find("structure"):
+            placements = [self._physvol(pv) for pv in el.findall("physvol")]
+            if el.tag == "volume":
+                self.volumes[el.get("name")] = (el.find("solidref").get("ref"), placements)
+            elif el.tag == "assembly":
+                self.assemblies[el.get("name")] = placements
+
+        self.world = root.find("setup").find("world").get("ref")
+
+    @staticmethod
+    def _vector(el, units, default_unit):
+        scale = units[el.get("unit", default_unit)]
+        return np.array([float(el.get(ax, 0)) for ax in "xyz"]) * scale
+
+    def _transform(self, el, prefix=""):
+        ## Position and rotation of a daughter/second solid, inline or by reference
+        pos = np.zeros(3)
+        rot = np.zeros(3)
+        for child in el:
+            if child.tag == prefix + "position":
+                pos = self._vector(child, LENGTH_UNITS, "mm")
+            elif child.tag == prefix + "positionref":
+                pos = self.positions[child.get("ref")]
+            elif child.tag == prefix + "rotation":
+                rot = self._vector(child, ANGLE_UNITS, "rad")
+            elif child.tag == prefix + "rotationref":
+                rot = self.rotations[child.get("ref")]
+        return rotation_matrix(rot), pos
+
+    def _physvol(self, el):
+        matrix, pos = self._transform(el)
+        return el.find("volumeref").get("ref"), matrix, pos
+
+    def _solid(self, el):
+        lunit = LENGTH_UNITS[el.get("lunit", "mm")]
+        aunit = ANGLE_UNITS[el.get("aunit", "rad")]
+        get = lambda key, default=0.: float(el.get(key, default))
+
+        if el.tag == "box":
+            return ("box", np.array([get("x"), get("y"), get("z")]) * lunit / 2.)
+        if el.tag == "tube":
+            return ("tube", get("rmin")*lunit, get("rmax")*lunit, get("z")*lunit/2.,
+                    get("startphi")*aunit, get("deltaphi", 2*np.pi/aunit)*aunit)
+        if el.tag == "trd":
+            return ("trd", get("x1")*lunit/2., get("x2")*lunit/2., get("y1")*lunit/2.,
+                    get("y2")*lunit/2., get("z")*lunit/2.)
+        if el.tag == "torus":
+            return ("torus", get("rmin")*lunit, get("rmax")*lunit, get("rtor")*lunit,
+                    get("startphi")*aunit, get("deltaphi", 2*np.pi/aunit)*aunit)
+        if el.tag in ("union", "subtraction", "intersection"):
+            matrix, pos = self._transform(el)
+            return (el.tag, el.find("first").get("ref"), el.find("second").get("ref"), matrix, pos)
+        raise ValueError("Unsupported GDML solid <{}> ({})".format(el.tag, el.get("name")))
+
+
+def _phi_mask(x, y, startphi, deltaphi):
+    if deltaphi >= 2*np.pi:
+        return np.ones(len(x), dtype=bool)
+    phi = np.mod(np.arctan2(y, x) - startphi, 2*np.pi)
+    return phi <= deltaphi
+
+
+class GeometryTable:
+    """Compact table of the volumes of a GDML geometry (see module comments)."""
+    def __init__(self, gdml_file):
+        reader = _GDMLReader(gdml_file)
+        self.source = os.path.abspath(gdml_file)
+        self.solids = reader.solids
+
+        ## Logical volume and solid names, referred to by index everywhere else
+        self.logical_names = sorted(reader.volumes)
+        self.solid_names = sorted(self.solids)
+        logical_index = {name: i for i, name in enumerate(self.logical_names)}
+        solid_index = {name: i for i, name in enumerate(self.solid_names)}
+        self.world = logical_index[reader.world]
+        self.logical_solid = np.array([solid_index[reader.volumes[name][0]] for name in self.logical_names])
+        self.solid_corners = np.array([self._corners(*self.solid_bbox(name)) for name in self.solid_names])
+
+        ## Daughters of each logical volume, in the mother's frame (assemblies flattened)
+        self.daughters = [self._daughter_table(reader, reader.volumes[name][1], logical_index)
+                          for name in self.logical_names]
+
+        ## Flat table of every placed volume (instance), with world->local transforms
+        logical, depth, rot, trans = [], [], [], []
+        stack = [(self.world, 0, np.identity(3), np.zeros(3))]
+        while stack:
+            lv, lvl, R, t = stack.pop()
+            logical.append(lv)
+            depth.append(lvl)
+            rot.append(R)
+            trans.append(t)
+            D = self.daughters[lv]
+            for d_lv, M, pos in zip(D["logical"], D["matrix"], D["position"]):
+                stack.append((d_lv, lvl + 1, M @ R, M @ (t - pos)))
+
+        self.logical = np.array(logical, dtype=np.int32)
+        self.depth = np.array(depth, dtype=np.int32)
+        self.rotation = np.array(rot)
+        self.translation = np.array(trans)
+
+        ## World-frame bounding box of every instance (local = R @ x + t, so x = R^T (local - t))
+        corners = self.solid_corners[self.logical_solid[self.logical]]
+        world = np.einsum("nkj,nji->nki", corners - self.translation[:, None, :], self.rotation)
+        self.bbox = np.stack([world.min(axis=1), world.max(axis=1)], axis=1)
+
+    @staticmethod
+    def _corners(lo, hi):
+        return np.array([[(lo, hi)[(k >> a) & 1][a] for a in range(3)] for k in range(8)])
+
+    def _daughter_table(self, reader, placements, logical_index, M0=np.identity(3), pos0=np.zeros(3)):
+        """Daughters of a volume as arrays, plus a voxel grid over their bounding boxes."""
+        logical, matrix, position = [], [], []
+        stack = [(placements, M0, pos0)]
+        while stack:
+            pvs, M_a, pos_a = stack.pop()
+            for name, M, pos in pvs:
+                ## x_d = M (M_a (x - pos_a) - pos) = (M M_a) (x - (pos_a + M_a^T pos))
+                M_d = M @ M_a
+                pos_d = pos_a + M_a.T @ pos
+                if name in reader.assemblies:
+                    ## Assemblies have no volume of their own: place their contents directly
+                    stack.append((reader.assemblies[name], M_d, pos_d))
+                else:
+                    logical.append(logical_index[name])
+                    matrix.append(M_d)
+                    position.append(pos_d)
+
+        table = {"logical": np.array(logical, dtype=np.int32),
+                 "matrix": np.array(matrix).reshape(-1, 3, 3),
+                 "position": np.array(position).reshape(-1, 3)}
+        if not logical:
+            return table
+
+        ## Bounding boxes in the mother frame: x = M^T x_d + pos
+        solids = [self.logical_solid[lv] for lv in logical]
+        corners = np.array([self._corners(*self.solid_bbox(self.solid_names[s])) for s in solids])
+        mother = np.einsum("nkj,nji->nki", corners, table["matrix"]) + table["position"][:, None, :]
+        table["bbox"] = np.stack([mother.min(axis=1), mother.max(axis=1)], axis=1)
+        table["solid"] = np.array(solids, dtype=np.int32)
+
+        ## Voxel grid (in the mother frame) listing the daughters overlapping each cell
+        n = len(logical)
+        nvox = int(np.clip(np.ceil(2*n**(1/3.)), 1, 32))
+        lo = table["bbox"][:, 0].min(axis=0)
+        hi = table["bbox"][:, 1].max(axis=0)
+        size = np.where(hi > lo, (hi - lo) / nvox, 1.)
+        lo_cell = np.clip(np.floor((table["bbox"][:, 0] - lo) / size).astype(np.int64), 0, nvox - 1)
+        hi_cell = np.clip(np.floor((table["bbox"][:, 1] - lo) / size).astype(np.int64), 0, nvox - 1)
+        cells, items = [], []
+        for i in range(n):
+            ix, iy, iz = np.meshgrid(*[np.arange(lo_cell[i, a], hi_cell[i, a] + 1) for a in range(3)],
+                                     indexing="ij")
+            flat = ((ix*nvox + iy)*nvox + iz).ravel()
+            cells.append(flat)
+            items.append(np.full(len(flat), i))
+        cells = np.concatenate(cells)
+        order = np.argsort(cells, kind="stable")
+        table["voxel_items"] = np.concatenate(items)[order].astype(np.int32)
+        table["voxel_offsets"] = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=nvox**3))))
+        table["voxel_lo"] = lo
+        table["voxel_size"] = size
+        table["voxel_n"] = nvox
+        return table
+
+    def solid_bbox(self, name):
+        """Local (lo, hi) bounding box corners of a solid."""
+        solid = self.solids[name]
+        kind = solid[0]
+        if kind == "box":
+            return -solid[1], solid[1]
+        if kind == "tube":
+            r, hz = solid[2], solid[3]
+            return np.array([-r, -r, -hz]), np.array([r, r, hz])
+        if kind == "trd":
+            hx, hy, hz = max(solid[1], solid[2]), max(solid[3], solid[4]), solid[5]
+            return np.array([-hx, -hy, -hz]), np.array([hx, hy, hz])
+        if kind == "torus":
+            r = solid[3] + solid[2]
+            return np.array([-r, -r, -solid[2]]), np.array([r, r, solid[2]])
+
+        lo, hi = self.solid_bbox(solid[1])
+        if kind == "subtraction":
+            return lo, hi
+
+        ## The second solid's corners, moved into the first solid's frame
+        corners = self._corners(*self.solid_bbox(solid[2])) @ solid[3].T + solid[4]
+        if kind == "union":
+            return np.minimum(lo, corners.min(axis=0)), np.maximum(hi, corners.max(axis=0))
+        return np.maximum(lo, corners.min(axis=0)), np.minimum(hi, corners.max(axis=0))
+
+    def solid_inside(self, name, pts):
+        """Which of the (N, 3) local points are inside the solid (surface included)."""
+        solid = self.solids[name]
+        kind = solid[0]
+        x, y, z = pts[:, 0], pts[:, 1], pts[:, 2]
+        if kind == "box":
+            return np.all(np.abs(pts) <= solid[1], axis=1)
+        if kind == "tube":
+            _, rmin, rmax, hz, startphi, deltaphi = solid
+            r2 = x*x + y*y
+            return ((r2 >= rmin*rmin) & (r2 <= rmax*rmax) & (np.abs(z) <= hz) &
+                    _phi_mask(x, y, startphi, deltaphi))
+        if kind == "trd":
+            _, x1, x2, y1, y2, hz = solid
+            frac = (z + hz) / (2*hz)
+            return ((np.abs(z) <= hz) & (np.abs(x) <= x1 + (x2 - x1)*frac) &
+                    (np.abs(y) <= y1 + (y2 - y1)*frac))
+        if kind == "torus":
+            _, rmin, rmax, rtor, startphi, deltaphi = solid
+            d2 = (np.sqrt(x*x + y*y) - rtor)**2 + z*z
+            return (d2 >= rmin*rmin) & (d2 <= rmax*rmax) & _phi_mask(x, y, startphi, deltaphi)
+
+        ## Boolean solids: the second solid sits at x_second = M^T (x_first - pos), i.e. the
+        ## rotation is the transpose of a physvol's. This is what Geant4 does with these
+        ## files: G4Navigator agrees on every point, and with the physvol convention the
+        ## rotated MINERvA box/hexagon intersections collapse to slivers (checked with
+        ## benchmarks/geometry_vs_g4.py)
+        _, first, second, M, pos = solid
+        in_first = self.solid_inside(first, pts)
+        in_second = self.solid_inside(second, (pts - pos) @ M)
+        if kind == "union":
+            return in_first | in_second
+        if kind == "subtraction":
+            return in_first & ~in_second
+        return in_first & in_second
+
+    def _inside_by_solid(self, solid, local):
+        inside = np.zeros(len(solid), dtype=bool)
+        for s in np.unique(solid):
+            sel = solid == s
+            inside[sel] = self.solid_inside(self.solid_names[s], local[sel])
+        return inside
+
+    def _find_daughter(self, D, local):
+        """For points (in a mother's frame), the daughter slot containing each (-1 if none),
+        and the points in that daughter's frame."""
+        found = np.full(len(local), -1, dtype=np.int64)
+        local_d = np.zeros_like(local)
+
+        ## Candidate (point, daughter) pairs from the mother's voxel grid
+        nvox = D["voxel_n"]
+        c = np.clip(np.floor((local - D["voxel_lo"]) / D["voxel_size"]).astype(np.int64), 0, nvox - 1)
+        cell = (c[:, 0]*nvox + c[:, 1])*nvox + c[:, 2]
+        start = D["voxel_offsets"][cell]
+        count = D["voxel_offsets"][cell + 1] - start
+        pair_point = np.repeat(np.arange(len(local)), count)
+        pair_slot = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(start, count)
+        pair_d = D["voxel_items"][pair_slot]
+
+        ## Cheap bounding box check, then the exact solid test in the daughter frame
+        p = local[pair_point]
+        keep = np.all((p >= D["bbox"][pair_d, 0]) & (p <= D["bbox"][pair_d, 1]), axis=1)
+        pair_point, pair_d, p = pair_point[keep], pair_d[keep], p[keep]
+        p_d = np.einsum("nij,nj->ni", D["matrix"][pair_d], p - D["position"][pair_d])
+        inside = self._inside_by_solid(D["solid"][pair_d], p_d)
+
+        ## Daughters don't overlap, so take any hit (the first, for points on a shared surface)
+        hit = np.flatnonzero(inside)
+        pts, first = np.unique(pair_point[hit], return_index=True)
+        found[pts] = pair_d[hit[first]]
+        local_d[pts] = p_d[hit[first]]
+        return found, local_d
+
+    def volume_of(self, points):
+        """Logical volume index of the deepest volume containing each point, found by
+        descending the hierarchy from the world. Points outside the world get -1."""
+        pts = np.asarray(points, dtype=float)[:, :3]
+        result = np.full(len(pts), -1, dtype=np.int64)
+        inside_world = self.solid_inside(self.solid_names[self.logical_solid[self.world]], pts)
+        result[inside_world] = self.world
+
+        active = np.flatnonzero(inside_world)
+        local = pts[active]
+        while len(active):
+            current = result[active]
+            next_active, next_local = [], []
+            for lv in np.unique(current):
+                D = self.daughters[lv]
+                if len(D["logical"]) == 0: continue
+                sel = np.flatnonzero(current == lv)
+                found, local_d = self._find_daughter(D, local[sel])
+                into = found >= 0
+                result[active[sel[into]]] = D["logical"][found[into]]
+                next_active.append(active[sel[into]])
+                next_local.append(local_d[into])
+            if not next_active: break
+            active = np.concatenate(next_active)
+            local = np.concatenate(next_local)
+        return result
+
+    def volume_names(self, volumes):
+        """Logical volume names for indices from volume_of ("" for -1)."""
+        names = np.array(self.logical_names + [""])
+        volumes = np.asarray(volumes)
+        return names[np.where(volumes >= 0, volumes, len(self.logical_names))]
+
+    def instances_of(self, volume):
+        """Instance indices (into the flat instance table) of every placement of a logical volume."""
+        return np.flatnonzero(self.logical == self.logical_names.index(volume))
+
+    def contained(self, points, volume="volLArActive"):
+        """Whether each point is inside any placement of the given logical volume
+        (including anything placed inside it)."""
+        pts = np.asarray(points, dtype=float)[:, :3]
+        mask = np.zeros(len(pts), dtype=bool)
+        solid = self.solid_names[self.logical_solid[self.logical_names.index(volume)]]
+        for inst in self.instances_of(volume):
+            sel = np.flatnonzero(~mask & np.all((pts >= self.bbox[inst, 0]) & (pts <= self.bbox[inst, 1]), axis=1))
+            local = pts[sel] @ self.rotation[inst].T + self.translation[inst]
+            mask[sel[self.solid_inside(solid, local)]] = True
+        return mask
+
+
+def load_geometry(gdml_file=DEFAULT_GDML, cache_file=None):
+    """Load the GeometryTable for a GDML file, from its cache if it's up to date.
+    The cache is <gdml_file>.volumes.pkl unless given."""
+    if cache_file is None:
+        cache_file = gdml_file + ".volumes.pkl"
+    gdml_hash = content_hash(gdml_file)
+
+    if os.path.isfile(cache_file):
+        with open(cache_file, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("version") == GEOMETRY_CACHE_VERSION and cached.get("hash") == gdml_hash:
+            return cached["table"]
+
+    table = GeometryTable(gdml_file)
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump({"version": GEOMETRY_CACHE_VERSION, "hash": gdml_hash, "table": table}, f)
+    os.replace(tmp_file, cache_file)
+    return table
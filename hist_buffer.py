@@ -0,0 +1,91 @@
+## Buffered filling of ROOT histograms
+##
+## Every TH1::Fill call from Python crosses the PyROOT boundary. BufferedHist wraps a
+## TH1/TH2 and keeps the values (and weights) passed to Fill in arrays instead, handing
+## them to the histogram in one FillN call whenever the buffer is full, and before any
+## other method of the histogram is used. FillN fills exactly as the same Fill calls in
+## the same order would (bin contents, entries and statistics), so the histograms, their
+## names and what is written to the output files don't change:
+##   h_ke = BufferedHist(RT.TH1D("pr_ke", "pr_ke;True KE (MeV); N", 100, 0, 2500))
+##   h_ke.Fill(ke)              ## buffered
+##   h_ke.fill_array(kes)       ## a whole array at once
+##   h_ke.Write()               ## flushes, then calls TH1D::Write
+## To pass the histogram to ROOT (e.g. h2.Divide(h1)), use h1.hist after h1.flush().
+from array import array
+
+import numpy as np
+
+DEFAULT_CAPACITY = 10000
+
+
+class BufferedHist:
+    """Buffers the Fill calls of a 1D or 2D histogram (see module comments).
+
+    Parameters
+    ----------
+    hist : ROOT.TH1 or ROOT.TH2
+        Histogram to fill; any attribute not defined here is taken from it (after a flush)
+    capacity : int, optional
+        Number of buffered fills that triggers a flush
+    """
+    def __init__(self, hist, capacity=DEFAULT_CAPACITY):
+        self.hist = hist
+        self.ndim = hist.GetDimension()
+        if self.ndim not in (1, 2):
+            raise ValueError("BufferedHist supports 1D and 2D histograms, not {}D".format(self.ndim))
+        self.capacity = capacity
+        self.values = [array("d") for _ in range(self.ndim)]
+        self.weights = array("d")
+
+    def __len__(self):
+        return len(self.weights)
+
+    def Fill(self, *args):
+        """Same arguments as TH1::Fill(x[, w]) or TH2::Fill(x, y[, w])."""
+        if len(args) not in (self.ndim, self.ndim + 1):
+            raise TypeError("Fill takes {} or {} values for a {}D histogram".format(
+                self.ndim, self.ndim + 1, self.ndim))
+        for buf, value in zip(self.values, args):
+            buf.append(value)
+        self.weights.append(args[self.ndim] if len(args) > self.ndim else 1.0)
+        if len(self.weights) >= self.capacity:
+            self.flush()
+
+    def fill_array(self, x, y=None, weights=None):
+        """Fill with whole arrays of values (y for 2D histograms), in order."""
+        cols = [x] if self.ndim == 1 else [x, y]
+        if any(c is None for c in cols):
+            raise TypeError("fill_array needs x and y for a 2D histogram")
+        cols = [np.ascontiguousarray(c, dtype=np.float64).ravel() for c in cols]
+        w = np.ones(len(cols[0])) if weights is None else np.ascontiguousarray(weights, dtype=np.float64)
+        self.flush()
+        self._fill_n(cols, w)
+
+    def _fill_n(self, cols, w):
+        if len(w) == 0: return
+        if self.ndim == 1:
+            self.hist.FillN(len(w), cols[0], w)
+        else:
+            self.hist.FillN(len(w), cols[0], cols[1], w)
+
+    def flush(self):
+        """Hand the buffered values to the histogram."""
+        if not len(self.weights): return
+        cols = [np.frombuffer(buf, dtype=np.float64) for buf in self.values]
+        self._fill_n(cols, np.frombuffer(self.weights, dtype=np.float64))
+        self.values = [array("d") for _ in range(self.ndim)]
+        self.weights = array("d")
+
+    def __getattr__(self, name):
+        ## Anything else (Write, Draw, GetEntries, Divide, ...) sees every fill so far
+        if name in ("hist", "values", "weights", "ndim", "capacity"):
+            raise AttributeError(name)
+        self.flush()
+        return getattr(self.hist, name)
+
+
+def flush_all(hists):
+    """Flush every BufferedHist in an iterable (other objects are ignored)."""
+    for hist in hists:
+        if isinstance(hist, BufferedHist):
+            hist.flush()
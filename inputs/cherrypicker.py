@@ -1,5 +1,7 @@
 import sys
+import json
 import ROOT
+import numpy as np
 from optparse import OptionParser
 
 def is_in_region(pos):
@@ -13,6 +15,96 @@ def is_in_region(pos):
     return True
 
 
+## Vectorised is_in_region, for an (N, 3) array of vertex positions
+def in_region_mask(pos):
+    return ((np.abs(pos[:, 0]) <= 0.67) &
+            (np.abs(pos[:, 1] - 0.43) <= 0.67) &
+            (np.abs(pos[:, 2]) <= 0.67))
+
+
+## Read the (x, y, z) vertex position of every entry into one (N, 3) array
+## (TTree::Draw with "goff" fills its internal buffers without making a histogram)
+def read_vertices(tree):
+
+    nevt = tree.GetEntries()
+    tree .SetEstimate(nevt + 1)
+    nrows = tree.Draw("EvtVtx[0]:EvtVtx[1]:EvtVtx[2]", "", "goff")
+
+    vtx = np.empty((nrows, 3))
+    for i, buf in enumerate([tree.GetV1(), tree.GetV2(), tree.GetV3()]):
+        buf .SetSize(nrows)
+        vtx[:, i] = np.frombuffer(buf, dtype=np.float64, count=nrows)
+    return vtx
+
+
+## Write the event counts next to the output, so the edep-sim job can be sized from them
+def write_summary(output_file_name, nevt, nsaved):
+
+    summary = {"input_events": nevt,
+               "saved_events": nsaved,
+               "keep_fraction": nsaved/float(nevt) if nevt else 0.}
+    with open(output_file_name + ".json", "w") as f:
+        json.dump(summary, f, indent=1)
+
+
+## Bulk version of skim_file: the vertices are read as one array, the selection is made
+## with NumPy, and the selected entries are copied in one go through a TEntryList
+def skim_file_bulk(input_file_name, output_file_name):
+
+    ## Open the input file
+    chain = ROOT.TChain("gRooTracker")
+    chain .Add(input_file_name)
+    chain .LoadTree(0)
+    tree = chain.GetTree()
+
+    nevt = tree.GetEntries()
+    print("Skimming", nevt, "events from", input_file_name)
+
+    ## Only the vertex branch is needed to make the selection
+    tree .SetBranchStatus("*", 0)
+    tree .SetBranchStatus("EvtVtx", 1)
+    keep = np.flatnonzero(in_region_mask(read_vertices(tree)))
+    tree .SetBranchStatus("*", 1)
+
+    elist = ROOT.TEntryList(tree)
+    for x in keep:
+        elist .Enter(int(x))
+    tree .SetEntryList(elist)
+
+    ## Make the skim file and tree
+    skim_file = ROOT.TFile(output_file_name, "RECREATE")
+    skim_tree = tree.CopyTree("")
+    nsaved = skim_tree.GetEntries()
+
+    ## Save output
+    skim_tree.Write()
+    skim_file.Close()
+    write_summary(output_file_name, nevt, nsaved)
+    print("Saved", nsaved, "events to", output_file_name, "(%.3f)"%(nsaved/float(nevt)))
+    return
+
+
+## First pass: only read the vertex branch of each entry (the particle stack is never
+## decompressed for events that are thrown away), and return the list of entries to keep
+def select_entries(chain):
+
+    chain .SetBranchStatus("*", 0)
+    chain .SetBranchStatus("EvtVtx", 1)
+
+    keep_list = []
+    for x in range(chain.GetEntries()):
+        chain.GetEntry(x)
+
+        vtx = chain.EvtVtx
+        vtx .SetSize(4)
+
+        ## Save this event?
+        if is_in_region(vtx): keep_list.append(x)
+
+    chain .SetBranchStatus("*", 1)
+    return keep_list
+
+
 def skim_file(input_file_name, output_file_name):
 
     ## Open the input file
@@ -30,22 +122,17 @@ def skim_file(input_file_name, output_file_name):
     ## Loop over events, decide if they're in the active region
     nevt = chain.GetEntries()
     print("Skimming", nevt, "events from", input_file_name)
-    
-    for x in range(nevt):
-        chain.GetEntry(x)
 
-        npart = chain.StdHepN
-        vtx = chain.EvtVtx
-        vtx .SetSize(4)
-
-        ## Save this event?
-        if not is_in_region(vtx): continue
+    ## Then only read the full entries that are kept
+    for x in select_entries(chain):
+        chain.GetEntry(x)
         nsaved += 1
         skim_tree .Fill()
 
     ## Save output
     skim_tree.Write()
     skim_file.Close()
+    write_summary(output_file_name, nevt, nsaved)
     print("Saved", nsaved, "events to", output_file_name, "(%.3f)"%(nsaved/float(nevt)))
     return
     
@@ -55,7 +142,12 @@ if __name__ == '__main__':
     parser = OptionParser()
     parser .add_option("-i", "--inFile",  action="store", type="string", dest="inFile"     )
     parser .add_option("-o", "--outFile", action="store", type="string", dest="outFile"    )
+    parser .add_option("-b", "--bulk",    action="store_true", dest="bulk", default=False,
+                       help="Select with NumPy on all vertices at once, and copy the selected entries in bulk")
     (options, sys.argv[1:]) = parser.parse_args()
 
     ## Skim!
-    skim_file(options.inFile, options.outFile)
+    if options.bulk:
+        skim_file_bulk(options.inFile, options.outFile)
+    else:
+        skim_file(options.inFile, options.outFile)
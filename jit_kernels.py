@@ -0,0 +1,112 @@
+## Numba-compiled kernels for the per-event loops over jagged (offsets) arrays
+##
+## Some of the batch selections are really loops over the rows of each event with an
+## early exit, or a dependency between rows of the same event (a neutron daughter is
+## only known once its parent is): batch_selections.py writes them as whole-array NumPy
+## operations, iterating to convergence where it has to. When Numba is installed, the
+## functions here do the same as straightforward loops, compiled in nopython mode and
+## run in parallel over the events (prange), and batch_selections uses them instead:
+##  - neutron_and_daughter_mask: a single pass per event, as get_neutron_and_daughter_ids
+##  - hadronic_contained / muon_tagged: stop at the first segment that fails the event
+## (Max/min over the rows of each event are left to np.maximum/minimum.reduceat, see
+## batch_selections.jagged_max: a compiled loop was slower per thread.)
+## The kernels take the table columns and the constants as plain arrays and numbers,
+## and fill results into arrays (out) allocated by the caller.
+##
+## Without Numba, or with TRUTH_NO_JIT=1 in the environment (see JIT_ENV), ENABLED is
+## False and batch_selections keeps to its NumPy versions; the kernels are then plain
+## Python functions (prange is range), which is slow but lets them be checked anywhere:
+##   python benchmarks/jit_vs_numpy.py     ## kernels against the NumPy and per-event code
+import os
+
+import numpy as np
+
+JIT_ENV = "TRUTH_NO_JIT"
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+ENABLED = HAVE_NUMBA and os.environ.get(JIT_ENV, "") in ("", "0")
+
+
+if HAVE_NUMBA:
+    prange = numba.prange
+
+    def _compile(func):
+        return numba.njit(parallel=True, nogil=True, cache=True)(func)
+else:
+    prange = range
+
+    def _compile(func):
+        return func
+
+
+@_compile
+def neutron_and_daughter_mask(offsets, parent_id, is_neutron, out):
+    ## One pass over each event's trajectories: a daughter is kept if its parent comes
+    ## earlier in the same event and is itself a neutron or a daughter
+    for evt in prange(len(offsets) - 1):
+        start = offsets[evt]
+        for row in range(start, offsets[evt + 1]):
+            if is_neutron[row]:
+                out[row] = True
+                continue
+            parent = parent_id[row]
+            out[row] = parent >= 0 and parent < row - start and out[start + parent]
+    return out
+
+
+@_compile
+def hadronic_contained(seg_offsets, stop, primary_id, contributor, traj_offsets,
+                       neutron_mask, low_energy_mask, muon_mask, half_width, y_offset, out):
+    ## Box containment of every segment not from a muon, neutron (descendant) or
+    ## low-energy trajectory, stopping at the first one outside
+    for evt in prange(len(seg_offsets) - 1):
+        start = traj_offsets[evt]
+        n_traj = traj_offsets[evt + 1] - start
+        contained = True
+        for seg in range(seg_offsets[evt], seg_offsets[evt + 1]):
+            prim = primary_id[seg]
+            if prim >= 0 and prim < n_traj and muon_mask[start + prim]:
+                continue
+            key = contributor[seg]
+            if key >= 0 and key < n_traj and (neutron_mask[start + key] or low_energy_mask[start + key]):
+                continue
+            if (abs(stop[seg, 0]) > half_width or abs(stop[seg, 1] - y_offset) > half_width
+                    or abs(stop[seg, 2]) > half_width):
+                contained = False
+                break
+        out[evt] = contained
+    return out
+
+
+@_compile
+def muon_tagged(seg_offsets, stop, primary_id, traj_offsets, muon_mask, n_muons,
+                z_max, approx_rad, y_offset, out):
+    ## As is_muon_tagged: at least one muon segment past z_max, and none of those at or
+    ## before z_max outside the MINERvA cylinder, whatever their order (the loop stops
+    ## at the first one outside)
+    for evt in prange(len(seg_offsets) - 1):
+        if n_muons[evt] == 0:
+            out[evt] = True
+            continue
+        start = traj_offsets[evt]
+        n_traj = traj_offsets[evt + 1] - start
+        high_z = 0
+        tagged = True
+        for seg in range(seg_offsets[evt], seg_offsets[evt + 1]):
+            prim = primary_id[seg]
+            if prim < 0 or prim >= n_traj or not muon_mask[start + prim]:
+                continue
+            if stop[seg, 2] > z_max:
+                high_z += 1
+                continue
+            dy = stop[seg, 1] - y_offset
+            if np.sqrt(stop[seg, 0]*stop[seg, 0] + dy*dy) > approx_rad:
+                tagged = False
+                break
+        out[evt] = tagged and high_z > 0
+    return out
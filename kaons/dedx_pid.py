@@ -0,0 +1,231 @@
+## dE/dx against residual range for every contained hadron and muon track, and template PID
+##
+## For a batch of events (event_cache.batch / event_stream.iter_batches layout, with the
+## trajectories, points and segments tables) dedx_table gives the dE/dx of each energy
+## deposit against its residual range along the track that made it (the first
+## contributor), for every pion, proton, muon and kaon track that ends inside the 2x2
+## (photons and electrons shower rather than stop, so they're left out). score_tracks
+## then compares each track with the expected dE/dx of a pion, proton, muon and kaon
+## of the same residual range (from the range tables in lar_functions.py) with a chi^2
+## per species, all as array operations over every segment of the batch at once:
+##   table = dedx_table(evts)
+##   scores = score_tracks(table)
+##   pid_matrix(table, scores)   ## fraction of each true species identified as each template
+## or from the command line, for a table of every track in a set of files:
+##   python3 dedx_pid.py -o dedx_pid.npz <input.root> [...]
+import os
+import sys
+from optparse import OptionParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, ".."))
+
+import batch_selections as bs
+import lar_functions as lar
+
+## Templates, in the order of the chi^2 columns, and the |PDG| code of each
+SPECIES = ["pion", "proton", "muon", "kaon"]
+SPECIES_PDG = {"pion": 211, "proton": 2212, "muon": 13, "kaon": 321}
+
+## |PDG| codes of the tracks dedx_table keeps by default: those with a template
+TRACK_PDGS = tuple(SPECIES_PDG.values())
+
+## Only the end of the track is used: segments within MAX_RESIDUAL_RANGE (cm) of the end,
+## and at least MIN_STEP (cm) long, and tracks with at least MIN_SEGMENTS of them
+MAX_RESIDUAL_RANGE = 30.0
+MIN_STEP = 0.05
+MIN_SEGMENTS = 3
+
+## Fractional dE/dx resolution used in the chi^2
+DEDX_RESOLUTION = 0.1
+
+## Residual-range grid of the templates (cm)
+TEMPLATE_POINTS = 2000
+_templates = {}
+
+
+def dedx_template(species, density=lar.LAR_DENSITY):
+    """(residual range (cm), dE/dx (MeV/cm)) for a stopping particle, built from the
+    range table the first time it's asked for."""
+    key = (species, density)
+    if key not in _templates:
+        table = lar.range_table(species, density)
+        rr = np.linspace(0., MAX_RESIDUAL_RANGE * 1.5, TEMPLATE_POINTS)
+        T = table.energy(rr)
+        _templates[key] = (rr, lar.calc_energy_loss_cm(T, table.mass, density))
+    return _templates[key]
+
+
+def _residual_range(mid, track_row, position, point_offsets, to_end):
+    ## Residual range (mm) at each midpoint: project it onto every step of its track's
+    ## trajectory, and take the range to the end from the closest step
+    first = point_offsets[track_row]
+    n_steps = np.maximum(point_offsets[track_row + 1] - first - 1, 0)
+    pair_offsets = np.concatenate([[0], np.cumsum(n_steps)])
+    pair_seg = np.repeat(np.arange(len(mid)), n_steps)
+    k = np.arange(pair_offsets[-1]) - np.repeat(pair_offsets[:-1] - first, n_steps)
+
+    a = position[k, :3]
+    d = position[k + 1, :3] - a
+    length2 = np.einsum("ij,ij->i", d, d)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.clip(np.einsum("ij,ij->i", mid[pair_seg] - a, d) / length2, 0., 1.)
+    t = np.where(length2 > 0, t, 0.)
+    dist2 = np.sum((a + t[:, None]*d - mid[pair_seg])**2, axis=1)
+
+    ## Closest step of each segment (the first one on ties); the pairs of each segment
+    ## are contiguous, so this is a minimum over each block
+    residual = np.full(len(mid), np.nan)
+    if len(dist2) == 0:
+        return residual
+    has_pairs = n_steps > 0
+    closest = bs.jagged_min(dist2, pair_offsets)[has_pairs]
+    at_min = np.flatnonzero(dist2 == np.repeat(closest, n_steps[has_pairs]))
+    first = np.concatenate([[True], pair_seg[at_min][1:] != pair_seg[at_min][:-1]])
+    best = at_min[first]
+    segs = pair_seg[best]
+    residual[segs] = to_end[k[best] + 1] + (1 - t[best]) * np.sqrt(length2[best])
+    return residual
+
+
+def dedx_table(evts, pdgs=TRACK_PDGS):
+    """dE/dx against residual range for every track of a batch that ends in the 2x2.
+
+    Only trajectories whose |PDG| is in pdgs are kept (by default the species with a
+    template; None keeps every particle, photons and electrons included).
+
+    Returns a dict with per-segment columns "dedx" (MeV/cm) and "residual_range" (cm),
+    grouped by track with "offsets", and per-track columns "event" (row in the batch),
+    "track_id", "pdg" and "track_length" (cm). Segments are those within
+    MAX_RESIDUAL_RANGE of the end, in the order they appear in the batch.
+    """
+    traj = evts["trajectories"]
+    points = evts["points"]
+    seg = evts["segments"]
+    traj_offsets = traj["offsets"]
+    point_offsets = np.asarray(points["trajectory_offsets"])
+    position = np.asarray(points["position"])
+
+    ## Contained tracks: trajectories of the selected species whose last point is in the 2x2
+    n_pts = np.diff(point_offsets)
+    contained = np.zeros(len(n_pts), dtype=bool)
+    has_steps = n_pts > 1
+    if pdgs is not None:
+        has_steps &= np.isin(np.abs(np.asarray(traj["pdg"])), pdgs)
+    contained[has_steps] = bs.is_2x2_contained(position[point_offsets[1:][has_steps] - 1])
+    _, _, to_end, track_length = lar.path_lengths(position, point_offsets)
+
+    ## Segments of those tracks, with their dE/dx and residual range
+    seg_evt = bs.event_index(seg["offsets"])
+    rows, valid = bs._track_rows(traj_offsets, seg_evt, np.asarray(seg["contributor"]))
+    step = np.asarray(seg["track_length"]) / 10.
+    keep = np.flatnonzero(valid & contained[rows] & (step >= MIN_STEP))
+    rows = rows[keep]
+    mid = 0.5 * (np.asarray(seg["start"])[keep] + np.asarray(seg["stop"])[keep])
+    residual = _residual_range(mid, rows, position, point_offsets, to_end) / 10.
+    dedx = np.asarray(seg["edep"])[keep] / step[keep]
+
+    near_end = residual <= MAX_RESIDUAL_RANGE
+    rows, residual, dedx = rows[near_end], residual[near_end], dedx[near_end]
+
+    ## Group by track, keeping tracks with enough segments
+    order = np.argsort(rows, kind="stable")
+    rows, residual, dedx = rows[order], residual[order], dedx[order]
+    tracks, counts = np.unique(rows, return_counts=True)
+    enough = counts >= MIN_SEGMENTS
+    seg_keep = np.repeat(enough, counts)
+    tracks, counts = tracks[enough], counts[enough]
+
+    trk_evt = bs.event_index(traj_offsets)[tracks]
+    return {"dedx": dedx[seg_keep], "residual_range": residual[seg_keep],
+            "offsets": np.concatenate([[0], np.cumsum(counts)]),
+            "event": trk_evt, "track_id": tracks - traj_offsets[trk_evt],
+            "pdg": np.asarray(traj["pdg"])[tracks], "track_length": track_length[tracks] / 10.}
+
+
+def score_tracks(table, species=SPECIES, resolution=DEDX_RESOLUTION):
+    """chi^2 per degree of freedom of every track of a dedx_table against each template.
+
+    Returns a dict with "chi2" (n_tracks, n_species), "best" (index into species of the
+    smallest chi^2, -1 for tracks without segments) and "species".
+    """
+    n_trk = len(table["offsets"]) - 1
+    seg_trk = bs.event_index(table["offsets"])
+    n_seg = np.diff(table["offsets"])
+    chi2 = np.empty((n_trk, len(species)))
+    for i, name in enumerate(species):
+        rr, template = dedx_template(name)
+        expected = np.interp(table["residual_range"], rr, template)
+        pull2 = ((table["dedx"] - expected) / (resolution * expected))**2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            chi2[:, i] = np.bincount(seg_trk, weights=pull2, minlength=n_trk) / n_seg
+    best = np.where(n_seg > 0, np.argmin(np.where(np.isnan(chi2), np.inf, chi2), axis=1), -1)
+    return {"chi2": chi2, "best": best, "species": list(species)}
+
+
+def pid_matrix(table, scores):
+    """Fraction of the tracks of each true species (by |PDG|, rows) identified as each
+    template (columns), as an (n_species, n_species) array in SPECIES order."""
+    species = scores["species"]
+    true = np.abs(table["pdg"])
+    matrix = np.zeros((len(species), len(species)))
+    for i, name in enumerate(species):
+        sel = true == SPECIES_PDG[name]
+        if sel.any():
+            matrix[i] = np.bincount(scores["best"][sel], minlength=len(species))[:len(species)] / sel.sum()
+    return matrix
+
+
+def process_files(files, batch_size=1000):
+    """dedx_table and score_tracks over all events of a list of edep-sim files, as one
+    table with the "file", "entry" and "global_entry" of each track."""
+    import event_stream
+
+    parts = []
+    for evts in event_stream.iter_batches(files, ["trajectories", "points", "segments"], batch_size):
+        table = dedx_table(evts)
+        table.update(score_tracks(table))
+        del table["species"]
+        for col in ("file", "entry", "global_entry"):
+            table[col] = evts["meta"][col][table["event"]]
+        del table["event"]
+        parts.append(table)
+    if not parts:
+        return None
+
+    out = {}
+    for col in parts[0]:
+        if col == "offsets":
+            shifts = np.cumsum([0] + [p[col][-1] for p in parts[:-1]])
+            out[col] = np.concatenate([[0]] + [p[col][1:] + s for p, s in zip(parts, shifts)])
+        else:
+            out[col] = np.concatenate([p[col] for p in parts])
+    return out
+
+
+if __name__ == '__main__':
+
+    parser = OptionParser(usage="%prog [options] <input_edepsim_file.root> [...]")
+    parser.add_option("-o", "--output", action="store", type="string", dest="output", default="dedx_pid.npz",
+                      help="Table of per-track dE/dx and chi^2 to write (default %default)")
+    parser.add_option("-b", "--batchSize", action="store", type="int", dest="batchSize", default=1000,
+                      help="Events read per batch (default %default)")
+    (options, file_list) = parser.parse_args()
+
+    if len(file_list) < 1:
+        print("At least one edep-sim processed file is required as an argument!")
+        sys.exit()
+
+    table = process_files(file_list, options.batchSize)
+    if table is None:
+        print("No events read")
+        sys.exit()
+
+    np.savez_compressed(options.output, files=np.array(file_list), species=np.array(SPECIES), **table)
+    print("Scored", len(table["pdg"]), "contained tracks, wrote", options.output)
+    print("True \\ PID " + " ".join("{:>7s}".format(s) for s in SPECIES))
+    matrix = pid_matrix(table, {"best": table["best"], "species": SPECIES})
+    for name, row in zip(SPECIES, matrix):
+        print("{:10s} ".format(name) + " ".join("{:7.3f}".format(v) for v in row))
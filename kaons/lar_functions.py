@@ -1,3 +1,4 @@
+import math
 import numpy as np
 import ROOT as RT
 
@@ -81,35 +82,144 @@ def get_nu_vec(genie_tree):
 
         return (nu_vec, nu_pdg)
 
-def calc_distance(trk):
-    dist = 0
-    n_pt = len(trk.Points)
-    for i in range(1, n_pt):
-        v0 = trk.Points[i-1].GetPosition().Vect()
-        v1 = trk.Points[i].GetPosition().Vect()
-        dist += (v1 - v0).Mag()
-
+def calc_distance(trk, points=None):
+    ## Length (mm) of a trajectory, summed over the steps between its points
+    ## points (from get_track_points) can be passed in to reuse it for several tracks of the same event
+    if points is not None:
+        return float(points.track_length[trk.GetTrackId()])
+    ## Each point is read once, and no vectors are made for the steps
+    dist = 0.0
+    prev = None
+    for pt in trk.Points:
+        pos = pt.GetPosition()
+        curr = (pos.X(), pos.Y(), pos.Z())
+        if prev is not None:
+            dist += math.sqrt((curr[0] - prev[0])**2 + (curr[1] - prev[1])**2 + (curr[2] - prev[2])**2)
+        prev = curr
     return dist
 
-def energy_by_range(range):
-    r = 0
-    T = 5
-    dr = range / 100.0;
-    while(r < range):
-        T += dr * calc_energy_loss_cm(T)
-        r += dr
-
-    return T
-
-def calc_energy_loss_cm(T):
-    T *= (105.66 / 139.75)
+## Masses (MeV) of the species with range-energy tables, and the density of LAr (g/cm^3)
+SPECIES_MASS = {"muon": 105.66, "pion": 139.57, "kaon": 493.68, "proton": 938.27}
+LAR_DENSITY = 1.4
+
+## Range-energy tables start from T_MIN (range 0, as the old integration did) and go
+## up to T_MAX in muon-equivalent kinetic energy (the end of the dE/dx fit)
+RANGE_TABLE_T_MIN = 5.0
+RANGE_TABLE_T_MAX = 1.0e5
+RANGE_TABLE_POINTS = 4000
+_range_tables = {}
+
+def energy_by_range(range, species="pion", density=LAR_DENSITY):
+    ## Kinetic energy (MeV) of a particle that stops after range (cm)
+    ## range can be a number or an array; uses the cached table from range_table
+    return range_table(species, density).energy(range)
+
+def range_by_energy(T, species="pion", density=LAR_DENSITY):
+    ## Range (cm) of a particle with kinetic energy T (MeV), the inverse of energy_by_range
+    return range_table(species, density).range(T)
+
+class RangeTable:
+    ## Kinetic energy <-> range for one species in one material, from integrating
+    ## 1 / calc_energy_loss_cm over a log-spaced grid of kinetic energies
+    def __init__(self, species="pion", density=LAR_DENSITY):
+        self.species = species
+        self.mass = SPECIES_MASS[species]
+        self.density = density
+
+        t_max = RANGE_TABLE_T_MAX * self.mass / SPECIES_MASS["muon"]
+        self.T = np.geomspace(RANGE_TABLE_T_MIN, t_max, RANGE_TABLE_POINTS)
+        inv_loss = 1.0 / calc_energy_loss_cm(self.T, self.mass, density)
+        steps = 0.5 * (inv_loss[1:] + inv_loss[:-1]) * np.diff(self.T)
+        self.R = np.concatenate([[0.0], np.cumsum(steps)])
+
+    def energy(self, range):
+        ## Ranges beyond the table are clipped to its ends
+        T = np.interp(range, self.R, self.T)
+        return float(T) if np.ndim(T) == 0 else T
+
+    def range(self, T):
+        R = np.interp(T, self.T, self.R)
+        return float(R) if np.ndim(R) == 0 else R
+
+def range_table(species="pion", density=LAR_DENSITY):
+    ## RangeTable for a species and density, built the first time it's asked for
+    key = (species, density)
+    if key not in _range_tables:
+        _range_tables[key] = RangeTable(species, density)
+    return _range_tables[key]
+
+def calc_energy_loss_cm(T, mass=SPECIES_MASS["pion"], density=LAR_DENSITY):
+    ## dE/dx (MeV/cm) from a fit to the muon stopping power, scaled to the same beta*gamma
+    ## (T / mass) for other masses; works on numbers and arrays
+    T = np.asarray(T, dtype=float) * (SPECIES_MASS["muon"] / mass)
     x = np.log10(T)
     c_lo = np.array([0.363907, -3.99702, 16.8216, -31.8385, 24.2120])
     c_hi = np.array([0.120316, -1.64161, 8.36222, -18.4671, 16.3644])
-    density = 1.4
-    c = c_lo if x < 3.0 else c_hi
-    mev_per_cm = density * (c[0]*x*x*x*x + c[1]*x*x*x + c[2]*x*x + c[3]*x + c[4])
-    return mev_per_cm
+    mev_per_cm = density * np.where(x < 3.0, np.polyval(c_lo, x), np.polyval(c_hi, x))
+    return float(mev_per_cm) if mev_per_cm.ndim == 0 else mev_per_cm
+
+def path_lengths(position, offsets):
+    ## For points grouped into tracks by offsets (track i is rows offsets[i]:offsets[i+1]),
+    ## return the length of the step ending at each point (0 for the first point of a
+    ## track), the path length from the start of the track to each point, the path length
+    ## left from each point to the end of the track, and the length of each track
+    position = np.asarray(position, dtype=float)[:, :3]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_trk = len(offsets) - 1
+    step = np.zeros(len(position))
+    if len(position) > 1:
+        step[1:] = np.sqrt(np.sum(np.diff(position, axis=0)**2, axis=1))
+    step[offsets[:-1][offsets[:-1] < len(position)]] = 0.0
+
+    total = np.cumsum(step)
+    track_of = np.repeat(np.arange(n_trk), np.diff(offsets))
+    start_total = np.concatenate([[0.0], total])[offsets[:-1]]
+    path = total - start_total[track_of]
+    track_length = np.zeros(n_trk)
+    has_points = offsets[1:] > offsets[:-1]
+    track_length[has_points] = path[offsets[1:][has_points] - 1]
+    return step, path, track_length[track_of] - path, track_length
+
+class TrackPoints:
+    ## All trajectory points of an event (or of a batch of events) as arrays:
+    ##  position (N, 4) x, y, z, t (mm, ns) and momentum (N, 3) px, py, pz (MeV)
+    ##  offsets: the points of track i are rows offsets[i]:offsets[i+1]
+    ## with the path lengths (mm) from path_lengths: step, path, to_end (one per point)
+    ## and track_length (one per track)
+    ## For an event, track i is the trajectory with track id i; for a batch made by
+    ## event_cache.py, pass its points "position", "momentum" and "trajectory_offsets"
+    def __init__(self, position, momentum, offsets):
+        self.position = np.asarray(position, dtype=float).reshape(-1, 4)
+        self.momentum = np.asarray(momentum, dtype=float).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.step, self.path, self.to_end, self.track_length = path_lengths(self.position, self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def track(self, trk_id):
+        ## Row slice of the points of one track
+        return slice(self.offsets[trk_id], self.offsets[trk_id + 1])
+
+    def range_energy(self, trk_ids=None, species="pion", density=LAR_DENSITY):
+        ## Kinetic energy (MeV) from the length of each track (all tracks by default)
+        length = self.track_length if trk_ids is None else self.track_length[np.asarray(trk_ids)]
+        return energy_by_range(length / 10.0, species, density)
+
+def get_track_points(event):
+    ## TrackPoints for every trajectory of an event, reading each point through PyROOT once
+    ## Keep the result to reuse it for all the tracks of the event (see calc_distance)
+    position = []
+    momentum = []
+    offsets = [0]
+    for trk in event.Trajectories:
+        for pt in trk.Points:
+            pos = pt.GetPosition()
+            mom = pt.GetMomentum()
+            position.extend((pos.X(), pos.Y(), pos.Z(), pos.T()))
+            momentum.extend((mom.X(), mom.Y(), mom.Z()))
+        offsets.append(len(momentum) // 3)
+    return TrackPoints(position, momentum, offsets)
 
 def energy_deposit_trk(segment_det, trk_id):
     reco_energy = 0
@@ -131,19 +241,61 @@ def energy_deposit_trk(segment_det, trk_id):
     # print(reco_energy)
     return reco_energy
 
-def edep_plus_children(event, trk_id):
-    reco_energy = 0
+def energy_deposit_by_primary(segment_det):
+    ## Sum the energy deposits by PrimaryId for every track in one sweep
+    ## energy_deposit_trk(segment_det, trk_id) == energy_deposit_by_primary(segment_det).get(trk_id, 0)
+    reco_energy = {}
+    for k,v in segment_det:
+        for edep in v:
+            prim_id = edep.GetPrimaryId()
+            reco_energy[prim_id] = reco_energy.get(prim_id, 0) + edep.GetEnergyDeposit()
+
+    return reco_energy
 
-    # list_particles = [trk_id]
-    # list_particles = []
+def get_children_map(event):
+    ## Map of parent track id -> list of children track ids (in trajectory order)
+    children = {}
     for trk in event.Trajectories:
-        if trk.GetParentId() == trk_id or trk.GetTrackId() == trk_id:
-            temp_energy = energy_deposit_trk(event.SegmentDetectors, trk.GetTrackId())
-            temp_energy = temp_energy / trk.GetInitialMomentum().Gamma()
-            reco_energy += temp_energy
-            # list_particles.append(trk.GetTrackId())
-
-    # for pid in list_particles:
-        # reco_energy += energy_deposit_trk(event.SegmentDetectors, pid)
+        children.setdefault(trk.GetParentId(), []).append(trk.GetTrackId())
+
+    return children
+
+def get_descendant_ids(children, trk_id):
+    ## All track ids below trk_id in the trajectory tree (not including trk_id)
+    descendants = []
+    to_visit = list(children.get(trk_id, []))
+    while to_visit:
+        curr_id = to_visit.pop()
+        descendants.append(curr_id)
+        to_visit.extend(children.get(curr_id, []))
+
+    return descendants
+
+def edep_plus_children(event, trk_id, all_descendants=False, edep_by_primary=None, children=None):
+    ## Energy deposited by a track and its children, each corrected by the trajectory's Gamma
+    ## edep_by_primary (from energy_deposit_by_primary) and children (from get_children_map)
+    ## can be passed in to reuse them for several tracks of the same event
+    ## With all_descendants, the whole tree below trk_id is included, not just direct children
+    if edep_by_primary is None:
+        edep_by_primary = energy_deposit_by_primary(event.SegmentDetectors)
+    if children is None:
+        children = get_children_map(event)
+
+    if all_descendants:
+        trk_ids = get_descendant_ids(children, trk_id)
+    else:
+        trk_ids = list(children.get(trk_id, []))
+    trk_ids.append(trk_id)
+
+    ## Keep the trajectory order (track id == position in event.Trajectories), so the
+    ## sum is done in the same order as looping over event.Trajectories
+    trk_ids.sort()
+    traj = event.Trajectories
+    energy = np.array([edep_by_primary.get(tid, 0) for tid in trk_ids], dtype=float)
+    gamma = np.array([traj[tid].GetInitialMomentum().Gamma() for tid in trk_ids], dtype=float)
+
+    reco_energy = 0
+    for temp_energy in energy / gamma:
+        reco_energy += temp_energy
 
     return reco_energy
@@ -0,0 +1,218 @@
+## Per-stage timing for the event loops
+##
+## A LoopTimer adds up the wall time spent in each named stage of an event loop (opening
+## the chains, GetEntry on each tree, the selection functions, histogram filling, ...),
+## prints the usual "Processed event" lines with the rate and an ETA, and at the end
+## prints a table of the stages (optionally also written as JSON) with the peak memory.
+##
+##   timer = make_timer(enabled)
+##   with timer.stage("chain_open"): ...
+##   timer.start_loop(nevts)
+##   for evt in range(nevts):
+##       timer.event(evt)                       ## progress line every 10% of the events
+##       with timer.stage("get_entry_edep"): edep_tree.GetEntry(evt)
+##   timer.report("timing.json")
+##
+## With timing disabled make_timer returns a NullTimer, which keeps the progress lines
+## but whose stages do nothing, so the instrumentation can stay in the loops for free.
+## With from_zero the NullTimer prints its lines from event 0 on, exactly as
+## kaons/kaon_analysis.py and elastic/elastic.py always have.
+## Scripts that take only file names as arguments (kaons/kaon_analysis.py,
+## elastic/elastic.py) turn it on with the TIMING_ENV environment variable: set it to
+## 1, or to the name of a JSON file to write the summary to.
+import os
+import sys
+import json
+import time
+
+TIMING_ENV = "TRUTH_TIMING"
+
+## Fraction of the events between progress lines
+PROGRESS_FRACTION = 0.1
+
+
+def progress_step(n_events):
+    """Events between progress lines (at least 1, so short chains don't divide by zero)."""
+    return max(int(n_events * PROGRESS_FRACTION), 1)
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far (MB), or None where it isn't available."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## kB on Linux, bytes on macOS
+    return peak / 1024.**2 if sys.platform == "darwin" else peak / 1024.
+
+
+class _Stage:
+    """Context manager adding the time spent inside it to one stage of a LoopTimer."""
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullTimer:
+    """Timing disabled: stages do nothing, only the progress lines are printed
+    (from event 0 if from_zero, otherwise from the first step)."""
+    enabled = False
+
+    def __init__(self, from_zero=False):
+        self.step = 1
+        self.from_zero = from_zero
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def add(self, name, seconds, calls=1):
+        pass
+
+    def start_loop(self, n_events):
+        self.step = progress_step(n_events)
+
+    def event(self, evt):
+        if evt % self.step != 0:
+            return
+        if self.from_zero:
+            ## The line those scripts have always printed
+            print("Processed event: ", evt)
+        elif evt != 0:
+            print("Processed event:", evt)
+
+    def record_memory(self):
+        pass
+
+    def merge(self, other):
+        pass
+
+    def report(self, json_file=None):
+        pass
+
+
+class LoopTimer(NullTimer):
+    """Timing enabled (see module comments).
+
+    Parameters
+    ----------
+    name : str, optional
+        Label for the summary
+    from_zero : bool, optional
+        Also print a progress line for event 0
+    """
+    enabled = True
+
+    def __init__(self, name="event loop", from_zero=False):
+        super().__init__(from_zero)
+        self.name = name
+        self.stages = {}
+        self.n_events = 0
+        self.peak_mb = None
+        self.created = time.perf_counter()
+        self.loop_start = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds, calls=1):
+        """Add seconds (over calls calls) to a stage, for times measured elsewhere."""
+        total = self.stages.get(name)
+        if total is None:
+            self.stages[name] = [seconds, calls]
+        else:
+            total[0] += seconds
+            total[1] += calls
+
+    def start_loop(self, n_events):
+        """Start of a loop over n_events events (loops over several chains add up)."""
+        super().start_loop(n_events)
+        self.loop_n = n_events
+        self.loop_first = self.n_events
+        self.loop_start = time.perf_counter()
+
+    def event(self, evt):
+        """Count an event, and print the progress every progress_step events."""
+        self.n_events += 1
+        if evt == 0 and self.from_zero:
+            print("Processed event:", evt)
+        elif evt % self.step == 0 and evt != 0:
+            elapsed = time.perf_counter() - self.loop_start
+            done = self.n_events - self.loop_first - 1
+            rate = done / elapsed if elapsed > 0 else 0.
+            eta = (self.loop_n - done) / rate if rate > 0 else 0.
+            print("Processed event: {} ({:.1f} events/s, ETA {})".format(
+                evt, rate, time.strftime("%H:%M:%S", time.gmtime(eta))))
+
+    def record_memory(self):
+        """Keep the current peak memory, e.g. before sending the timer back from a worker."""
+        self.peak_mb = max(filter(None, [self.peak_mb, peak_memory_mb()]), default=None)
+
+    def merge(self, other):
+        """Add the stages and events of another LoopTimer (e.g. from a worker process).
+        The peak memory becomes that of the largest process."""
+        for name, (seconds, calls) in other.stages.items():
+            self.add(name, seconds, calls)
+        self.n_events += other.n_events
+        self.peak_mb = max(filter(None, [self.peak_mb, other.peak_mb]), default=None)
+
+    def summary(self):
+        """The timing as a dict: wall time, events, events/s, peak memory and the
+        total/per-call time and fraction of the wall time of each stage."""
+        wall = time.perf_counter() - self.created
+        self.record_memory()
+        stages = {}
+        for name, (seconds, calls) in self.stages.items():
+            stages[name] = {"seconds": seconds, "calls": calls,
+                            "us_per_call": 1e6 * seconds / calls if calls else 0.,
+                            "fraction": seconds / wall if wall > 0 else 0.}
+        return {"name": self.name, "wall_seconds": wall, "events": self.n_events,
+                "events_per_second": self.n_events / wall if wall > 0 else 0.,
+                "peak_memory_mb": self.peak_mb, "stages": stages}
+
+    def report(self, json_file=None):
+        """Print the summary table, and write the summary to json_file if given."""
+        summ = self.summary()
+        print("Timing for {}: {} events in {:.1f} s ({:.1f} events/s), peak memory {}".format(
+            summ["name"], summ["events"], summ["wall_seconds"], summ["events_per_second"],
+            "{:.0f} MB".format(summ["peak_memory_mb"]) if summ["peak_memory_mb"] else "unknown"))
+        print("  {:24s} {:>10s} {:>10s} {:>12s} {:>7s}".format("stage", "seconds", "calls", "us/call", "wall"))
+        for name, st in sorted(summ["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            print("  {:24s} {:10.3f} {:10d} {:12.1f} {:7.1%}".format(
+                name, st["seconds"], st["calls"], st["us_per_call"], st["fraction"]))
+        if json_file:
+            with open(json_file, "w") as f:
+                json.dump(summ, f, indent=2)
+            print("Wrote the timing summary to", json_file)
+
+
+def make_timer(enabled, name="event loop", from_zero=False):
+    """A LoopTimer if enabled, otherwise a NullTimer."""
+    return LoopTimer(name, from_zero) if enabled else NullTimer(from_zero)
+
+
+def timing_from_env():
+    """(enabled, json_file) from the TIMING_ENV environment variable."""
+    value = os.environ.get(TIMING_ENV, "")
+    if value in ("", "0"):
+        return False, None
+    return True, (None if value == "1" else value)
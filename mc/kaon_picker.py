@@ -3,6 +3,37 @@ import ROOT
 import numpy as np
 from optparse import OptionParser
 
+## Branches needed to decide whether to keep an event
+SELECTION_BRANCHES = ["*Primaries*"]
+
+def is_selected(event):
+    vtx = event.Primaries[0]
+    primary_pdg = [x.GetPDGCode() for x in vtx.Particles]
+    return np.any(np.isin(np.abs(primary_pdg), [130, 310, 311, 321]))
+
+def select_entries(edep_chain):
+    """First pass of the skim: read only the primary particle branches of every entry
+    (the trajectories and energy deposits are never decompressed) and return the list
+    of entries to keep. All branches are switched back on afterwards.
+    """
+    edep_chain.SetBranchStatus("*", 0)
+    for branch in SELECTION_BRANCHES:
+        edep_chain.SetBranchStatus(branch, 1)
+
+    keep_list = []
+    nevt = edep_chain.GetEntries()
+    for evt in range(nevt):
+
+        if evt % max(int(nevt/10), 1) == 0:
+            print("Processed event: ", evt)
+
+        edep_chain.GetEntry(evt)
+        if is_selected(edep_chain.Event):
+            keep_list.append(evt)
+
+    edep_chain.SetBranchStatus("*", 1)
+    return keep_list
+
 def skim_file(input_file_name, output_file_name):
 
     ## Open the input file
@@ -24,25 +55,17 @@ def skim_file(input_file_name, output_file_name):
     ## Count the number saved
     nsaved = 0
 
-    ## Loop over events, decide if they're in the active region
+    ## Decide which events to keep, then copy only those events
     nevt = edep_chain.GetEntries()
     print("Skimming", nevt, "events from", input_file_name)
 
-    for evt in range(nevt):
+    keep_list = select_entries(edep_chain)
 
-        if evt % (int(nevt/10)) == 0:
-            print("Processed event: ", evt)
+    for evt in keep_list:
 
         edep_chain.GetEntry(evt)
         gtrk_chain.GetEntry(evt)
 
-        vtx = edep_chain.Event.Primaries[0]
-        num_vtx = len(edep_chain.Event.Primaries)
-        primary_pdg = [x.GetPDGCode() for x in vtx.Particles]
-
-        if not np.any(np.isin(np.abs(primary_pdg), [130, 310, 311, 321])):
-            continue
-
         nsaved += 1
         skim_edep.Fill()
         skim_gtrk.Fill()
@@ -53,7 +76,7 @@ def skim_file(input_file_name, output_file_name):
     skim_gtrk.Write("gRooTracker")
     skim_file.Close()
     print("Saved", nsaved, "events to", output_file_name, "(%.3f)"%(nsaved/float(nevt)))
-    return
+    return nevt, nsaved
 
 if __name__ == '__main__':
 
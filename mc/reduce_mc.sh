@@ -5,14 +5,9 @@ FILESUFFIX="EDEPSIM.root"
 # OUTDIR="kaon_mc"
 OUTDIR="all_kaons"
 
-i=0
-for IN_FILE in *.root; do
-    printf -v OUT_FILE "${FILEPREFIX}_%03d_${FILESUFFIX}" "$i"
+## Number of files to skim at once (defaults to the number of cores)
+NWORKERS=${1:-$(nproc)}
 
-    if [ ! -f "$OUTDIR/$OUT_FILE" ]; then
-        echo "Reading $IN_FILE to $OUTDIR/$OUT_FILE"
-        python3 kaon_picker.py -o $OUTDIR/$OUT_FILE -i $IN_FILE
-    fi
-    
-    i=$((i+1))
-done
+## skim_driver.py keeps a manifest in $OUTDIR, so re-running this only skims
+## files which haven't been finished yet (including any that crashed half-way)
+python3 skim_driver.py -o $OUTDIR -p $FILEPREFIX -s $FILESUFFIX -j $NWORKERS *.root
@@ -0,0 +1,145 @@
+## Parallel, resumable driver for kaon_picker.skim_file
+##
+## Keeps a JSON manifest (one entry per input file) with the output file name, the
+## number of events read/saved and the status of each shard. Each skim is written to a
+## temporary file which is only renamed to its final name once it has completed, so a
+## crashed or preempted job never leaves a half-written output that looks finished.
+## Re-running the same command only processes the shards which aren't "done".
+##
+## Usage (from the directory with the input files, as for reduce_mc.sh):
+##   python3 skim_driver.py -o all_kaons -j 8 *.root
+import os
+import sys
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from optparse import OptionParser
+
+from kaon_picker import skim_file
+
+MANIFEST_NAME = "skim_manifest.json"
+
+
+def load_manifest(manifest_name):
+    if not os.path.isfile(manifest_name):
+        return {"shards": {}}
+    with open(manifest_name) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_name):
+    ## Write-then-rename, so the manifest itself is never left half-written
+    tmp_name = manifest_name + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_name, manifest_name)
+
+
+def update_shards(manifest, input_files, out_dir, prefix, suffix):
+    """Add any new input files to the manifest and return the shards still to process.
+
+    Existing shards keep their output name. A "done" shard is redone if its output
+    has gone missing, or if the input file has changed size since it was skimmed.
+    """
+    shards = manifest["shards"]
+    next_index = max([s["index"] for s in shards.values()], default=-1) + 1
+
+    todo = []
+    for in_file in input_files:
+        in_path = os.path.abspath(in_file)
+        in_size = os.path.getsize(in_path)
+
+        if in_path not in shards:
+            out_file = os.path.join(out_dir, "{}_{:03d}_{}".format(prefix, next_index, suffix))
+            shards[in_path] = {"index": next_index, "output": out_file, "status": "pending"}
+            next_index += 1
+
+        shard = shards[in_path]
+        if shard["status"] == "done" and os.path.isfile(shard["output"]) \
+           and shard.get("input_size") == in_size:
+            continue
+
+        shard["status"] = "pending"
+        shard["input_size"] = in_size
+        todo.append(in_path)
+
+    return todo
+
+
+def run_shard(in_file, out_file):
+    """Skim one file to a temporary name, and only move it into place once it's complete."""
+    tmp_file = out_file + ".tmp"
+    st = time.time()
+    try:
+        nevt, nsaved = skim_file(in_file, tmp_file)
+        os.replace(tmp_file, out_file)
+    except Exception as err:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+        return {"status": "failed", "error": repr(err)}
+
+    return {"status": "done", "n_events": nevt, "n_saved": nsaved, "time": time.time() - st}
+
+
+def run_skims(input_files, out_dir, prefix, suffix, nworkers=1, manifest_name=None):
+    """Skim all input files which haven't already been done, nworkers at a time.
+
+    Returns the manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if manifest_name is None:
+        manifest_name = os.path.join(out_dir, MANIFEST_NAME)
+
+    manifest = load_manifest(manifest_name)
+    todo = update_shards(manifest, sorted(input_files), out_dir, prefix, suffix)
+    shards = manifest["shards"]
+    save_manifest(manifest, manifest_name)
+
+    print("{} input files, {} to skim with {} workers".format(len(shards), len(todo), nworkers))
+
+    with ProcessPoolExecutor(max_workers=max(1, nworkers)) as pool:
+        futures = {}
+        for in_file in todo:
+            shards[in_file]["status"] = "running"
+            futures[pool.submit(run_shard, in_file, shards[in_file]["output"])] = in_file
+        save_manifest(manifest, manifest_name)
+
+        for future in as_completed(futures):
+            in_file = futures[future]
+            try:
+                result = future.result()
+            except BrokenProcessPool as err:
+                ## A worker died (e.g. a ROOT crash), so the whole pool has gone
+                result = {"status": "failed", "error": repr(err)}
+            shards[in_file].update(result)
+            save_manifest(manifest, manifest_name)
+            print("{}: {} -> {}".format(result["status"], in_file, shards[in_file]["output"]))
+
+    ndone = sum(1 for s in shards.values() if s["status"] == "done")
+    nevt = sum(s.get("n_events", 0) for s in shards.values() if s["status"] == "done")
+    nsaved = sum(s.get("n_saved", 0) for s in shards.values() if s["status"] == "done")
+    print("Done {} of {} files. Saved {} of {} events".format(ndone, len(shards), nsaved, nevt))
+    return manifest
+
+
+if __name__ == '__main__':
+
+    ## Get arguments
+    parser = OptionParser(usage="%prog [options] <input_file.root> [...]")
+    parser.add_option("-o", "--outDir", action="store", type="string", dest="outDir", default="all_kaons")
+    parser.add_option("-p", "--prefix", action="store", type="string", dest="prefix", default="kaon_2x2_5E17")
+    parser.add_option("-s", "--suffix", action="store", type="string", dest="suffix", default="EDEPSIM.root")
+    parser.add_option("-j", "--workers", action="store", type="int", dest="workers", default=os.cpu_count())
+    parser.add_option("-m", "--manifest", action="store", type="string", dest="manifest", default=None,
+                      help="Manifest file (default: <outDir>/" + MANIFEST_NAME + ")")
+    (options, input_files) = parser.parse_args()
+
+    if len(input_files) < 1:
+        print("At least one input file is required as an argument!")
+        sys.exit()
+
+    manifest = run_skims(input_files, options.outDir, options.prefix, options.suffix,
+                         options.workers, options.manifest)
+    if any(s["status"] != "done" for s in manifest["shards"].values()):
+        sys.exit(1)
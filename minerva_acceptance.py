@@ -0,0 +1,188 @@
+## MINERvA acceptance models for muon tagging
+##
+## MINERvA is a hexagonal prism along z (centred 430 mm above the beam axis), and the
+## muon tagging in example_analysis.py approximates it with a 1870 mm cylinder ending at
+## z = 3500 mm. HexPrism is the real shape, with its size, orientation and downstream
+## end derived from the GDML geometry (the outer detector frame); Cylinder is the old
+## approximation, used as the fallback when the geometry can't be loaded.
+##
+## Both models work on whole arrays of points/segments at once, and can be passed as
+## acceptance= to batch_selections.is_muon_tagged_batch. muon_exit_batch reports where
+## (and through which face) the primary muon of each event leaves the acceptance:
+##   acc = load_acceptance()
+##   tagged = batch_selections.is_muon_tagged_batch(seg, traj, prim, acceptance=acc)
+##   exits = muon_exit_batch(seg, traj, prim, acceptance=acc)
+##   acc.FACES[exits["face"][i]]                 ## e.g. "side3" or "downstream"
+import numpy as np
+
+import batch_selections as bs
+
+## Volumes used to build the HexPrism: the outer detector frame gives the hexagon, and
+## the downstream end is the furthest z of any of the MINERvA volumes
+OUTER_VOLUME = "DetectorlvFrame"
+MINERVA_VOLUMES = ["DetectorlvFrame", "DetectorlvTrackerModuleXU", "DetectorlvDownEcal", "DetectorlvDownHcal"]
+
+## Radial scan used to find the hexagon's outline (mm, degrees)
+SCAN_MAX_RADIUS = 4000.
+SCAN_STEP = 2.
+SCAN_ANGLE_STEP = 1.
+
+
+class Cylinder:
+    """The cylinder approximation to MINERvA used by is_muon_tagged."""
+    FACES = ["side", "downstream", "upstream"]
+
+    def __init__(self, radius=bs.MINERVA_APPROX_RAD, z_max=bs.MINERVA_Z_MAX,
+                 center=(0., bs.DETECTOR_Y_OFFSET), z_min=-np.inf):
+        self.radius = radius
+        self.z_max = z_max
+        self.z_min = z_min
+        self.center = np.asarray(center, dtype=float)
+
+    def inside_xy(self, pos):
+        """Whether each (N, >=2) point is within the cylinder's cross-section."""
+        pos = np.asarray(pos)
+        dx = pos[:, 0] - self.center[0]
+        dy = pos[:, 1] - self.center[1]
+        return np.sqrt(dx*dx + dy*dy) <= self.radius
+
+    def _side_exit(self, start, step):
+        ## Smallest t > 0 with |start + t step| = radius in x-y (inf if never)
+        p = start[:, :2] - self.center
+        d = step[:, :2]
+        a = np.einsum("ij,ij->i", d, d)
+        b = np.einsum("ij,ij->i", p, d)
+        c = np.einsum("ij,ij->i", p, p) - self.radius*self.radius
+        disc = b*b - a*c
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (-b + np.sqrt(disc)) / a
+        t = np.where((a > 0) & (disc >= 0) & (t >= 0), t, np.inf)
+        return t, np.zeros(len(t), dtype=np.int64)
+
+    def inside(self, pos):
+        pos = np.asarray(pos)
+        return self.inside_xy(pos) & (pos[:, 2] <= self.z_max) & (pos[:, 2] >= self.z_min)
+
+    def exit(self, start, stop):
+        """Where each straight segment leaves the acceptance.
+
+        Returns the exit points (N, 3) and the index of the face crossed in FACES, for
+        segments that start inside and stop outside; other rows get NaN and -1.
+        """
+        start = np.asarray(start, dtype=float)[:, :3]
+        stop = np.asarray(stop, dtype=float)[:, :3]
+        step = stop - start
+        t_side, face_side = self._side_exit(start, step)
+
+        ## End caps
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_down = np.where(step[:, 2] > 0, (self.z_max - start[:, 2]) / step[:, 2], np.inf)
+            t_up = np.where(step[:, 2] < 0, (self.z_min - start[:, 2]) / step[:, 2], np.inf)
+        n_sides = len(self.FACES) - 2
+        t_all = np.stack([t_side, t_down, t_up], axis=1)
+        which = np.argmin(t_all, axis=1)
+        t = t_all[np.arange(len(t_all)), which]
+        face = np.where(which == 0, face_side, n_sides + which - 1)
+
+        crosses = self.inside(start) & ~self.inside(stop)
+        with np.errstate(invalid="ignore"):
+            point = np.where(crosses[:, None], start + t[:, None]*step, np.nan)
+        return point, np.where(crosses, face, -1)
+
+
+class HexPrism(Cylinder):
+    """Hexagonal prism along z: the 6 faces have outward normals at face_angle + k*60
+    degrees (k = 0..5) in x-y, each at distance apothem from the centre."""
+    FACES = ["side0", "side1", "side2", "side3", "side4", "side5", "downstream", "upstream"]
+
+    def __init__(self, apothem, face_angle, z_max, center=(0., bs.DETECTOR_Y_OFFSET), z_min=-np.inf):
+        super().__init__(apothem / np.cos(np.pi/6), z_max, center, z_min)
+        self.apothem = apothem
+        self.face_angle = face_angle
+        angles = face_angle + np.arange(6)*np.pi/3
+        self.normals = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    def inside_xy(self, pos):
+        proj = (np.asarray(pos)[:, :2] - self.center) @ self.normals.T
+        return np.all(proj <= self.apothem, axis=1)
+
+    def _side_exit(self, start, step):
+        ## For each face with the segment moving outwards, t at which it reaches the plane
+        proj = (start[:, :2] - self.center) @ self.normals.T
+        rate = step[:, :2] @ self.normals.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(rate > 0, (self.apothem - proj) / rate, np.inf)
+        face = np.argmin(t, axis=1)
+        return t[np.arange(len(t)), face], face
+
+    @classmethod
+    def from_geometry(cls, geom, outer_volume=OUTER_VOLUME, volumes=MINERVA_VOLUMES):
+        """Build the prism from a geometry.GeometryTable.
+
+        The centre is the centre of the outer volume's placements, the hexagon is found
+        by scanning outwards from the centre in every direction (through the middle of
+        the outer volume's first placement), and z_max/z_min are the furthest extent
+        of the MINERvA volumes.
+        """
+        outer = geom.instances_of(outer_volume)
+        bbox = geom.bbox[outer]
+        center = 0.5*(bbox[:, 0, :2].min(axis=0) + bbox[:, 1, :2].max(axis=0))
+        z_scan = bbox[0, :, 2].mean()
+
+        ## Outline radius in each direction: half way between the furthest scan point
+        ## inside the volume and the next one out
+        angles = np.radians(np.arange(0., 360., SCAN_ANGLE_STEP))
+        radii = np.arange(0., SCAN_MAX_RADIUS, SCAN_STEP)
+        r, a = np.meshgrid(radii, angles)
+        pts = np.stack([center[0] + r*np.cos(a), center[1] + r*np.sin(a), np.full(r.shape, z_scan)], axis=-1)
+        inside = geom.contained(pts.reshape(-1, 3), outer_volume).reshape(r.shape)
+        if not inside.any():
+            raise ValueError("No {} found at z = {} mm".format(outer_volume, z_scan))
+        outline = np.where(inside, r, 0.).max(axis=1) + 0.5*SCAN_STEP
+
+        ## The face normals are where the outline comes closest to the centre
+        face_angle = np.mod(angles[np.argmin(outline)], np.pi/3)
+        offset = np.mod(angles - face_angle + np.pi/6, np.pi/3) - np.pi/6
+        apothem = np.median(outline*np.cos(offset))
+
+        z = np.concatenate([geom.bbox[geom.instances_of(v)][:, :, 2].ravel() for v in volumes])
+        return cls(apothem, face_angle, z.max(), center, z.min())
+
+
+def load_acceptance(gdml_file=None):
+    """HexPrism from the GDML geometry, or the Cylinder approximation if that fails."""
+    try:
+        import geometry
+        geom = geometry.load_geometry(gdml_file or geometry.DEFAULT_GDML)
+        return HexPrism.from_geometry(geom)
+    except (OSError, ValueError) as err:
+        print("Using the cylinder approximation to MINERvA:", err)
+        return Cylinder()
+
+
+def muon_exit_batch(segments, trajectories, primaries, masks=None, acceptance=None):
+    """Where the primary muon of each event leaves the acceptance.
+
+    Uses the first primary-muon segment (in segment order) that starts inside and stops
+    outside. Returns a dict with "point" (n_events, 3), NaN where there's no exit, and
+    "face", the index into acceptance.FACES (-1 where there's no exit).
+    """
+    if acceptance is None:
+        acceptance = Cylinder()
+    if masks is None:
+        masks = bs.event_masks(trajectories, primaries)
+
+    seg_offsets = segments["offsets"]
+    nevt = len(seg_offsets) - 1
+    seg_evt = bs.event_index(seg_offsets)
+    is_muon = bs._lookup(masks["muon"], trajectories["offsets"], seg_evt, np.asarray(segments["primary_id"]))
+    rows = np.flatnonzero(is_muon)
+
+    point, face = acceptance.exit(np.asarray(segments["start"])[rows], np.asarray(segments["stop"])[rows])
+    crossing = np.flatnonzero(face >= 0)
+    evts, first = np.unique(seg_evt[rows[crossing]], return_index=True)
+
+    result = {"point": np.full((nevt, 3), np.nan), "face": np.full(nevt, -1, dtype=np.int64)}
+    result["point"][evts] = point[crossing[first]]
+    result["face"][evts] = face[crossing[first]]
+    return result
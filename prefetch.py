@@ -0,0 +1,145 @@
+## Opt-in background prefetching for the TChain event loops
+##
+## EventPrefetcher reads the EDepSimEvents entries of a list of files in a background
+## thread, up to read_ahead entries ahead of the event loop, so that basket reading,
+## decompression and streaming into TG4Event overlap with the Python selection code
+## instead of alternating with it. The GIL is released while ROOT reads an entry (the
+## PyROOT _threaded flag), and each entry is copied into its own TG4Event before it's
+## queued, so the loop can keep using one event while the next ones are read.
+##
+##   events = event_reader(edep_tree, files, read_ahead=16)
+##   for evt in range(nevts):
+##       event = events.get(evt)        ## instead of edep_tree.GetEntry(evt); edep_tree.Event
+##   events.close()                     ## prints how much I/O wait was hidden
+## With read_ahead=0 event_reader just calls edep_tree.GetEntry, exactly as before.
+##
+## Scripts that take only file names as arguments (kaons/kaon_analysis.py,
+## elastic/elastic.py) read the read-ahead from the PREFETCH_ENV environment variable.
+import os
+import time
+import queue
+import threading
+
+PREFETCH_ENV = "TRUTH_PREFETCH"
+
+DEFAULT_READ_AHEAD = 16
+DEFAULT_CACHE_MB = 50
+
+
+def read_ahead_from_env(default=0):
+    """Read-ahead requested through the PREFETCH_ENV environment variable (0 = off)."""
+    return int(os.environ.get(PREFETCH_ENV, default))
+
+
+class _DirectReader:
+    """No prefetching: read each entry from the chain when it's asked for."""
+    def __init__(self, chain):
+        self.chain = chain
+
+    def get(self, entry):
+        self.chain.GetEntry(entry)
+        return self.chain.Event
+
+    def close(self, report=True):
+        pass
+
+
+class EventPrefetcher:
+    """Reads TG4Events in a background thread (see module comments).
+
+    Parameters
+    ----------
+    files : list of str
+        edep-sim files, chained in this order
+    read_ahead : int, optional
+        Maximum number of entries read ahead of the loop (and held in memory)
+    cache_mb : float, optional
+        Size of the TTreeCache of the background chain (MB)
+    entries : iterable of int, optional
+        Entries to read, in the order the loop will ask for them (default: all)
+    tree_name : str, optional
+        Name of the edep-sim tree
+    """
+    def __init__(self, files, read_ahead=DEFAULT_READ_AHEAD, cache_mb=DEFAULT_CACHE_MB,
+                 entries=None, tree_name="EDepSimEvents"):
+        import ROOT
+        self.ROOT = ROOT
+
+        ## The main thread keeps using ROOT (other trees, histograms) while this one reads
+        ROOT.ROOT.EnableThreadSafety()
+        ROOT.TChain.GetEntry._threaded = True
+
+        self.chain = ROOT.TChain(tree_name)
+        for f in files:
+            self.chain.Add(f)
+        self.chain.SetCacheSize(int(cache_mb * 1024**2))
+        self.chain.AddBranchToCache("*", True)
+        self.entries = range(self.chain.GetEntries()) if entries is None else entries
+
+        self.read_ahead = read_ahead
+        self.queue = queue.Queue(maxsize=max(read_ahead, 1))
+        self.read_time = 0.
+        self.wait_time = 0.
+        self.n_events = 0
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        ## Wait for space in the queue, unless the loop has been closed
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        try:
+            for entry in self.entries:
+                start = time.perf_counter()
+                self.chain.GetEntry(entry)
+                event = self.ROOT.TG4Event(self.chain.Event)
+                self.read_time += time.perf_counter() - start
+                if not self._put((entry, event)): return
+            self._put(None)
+        except Exception as err:
+            self._put(err)
+
+    def get(self, entry):
+        """Return the TG4Event for entry. Entries must be asked for in the order given."""
+        start = time.perf_counter()
+        item = self.queue.get()
+        self.wait_time += time.perf_counter() - start
+        if item is None:
+            raise IndexError("Entry {} asked for after the last prefetched entry".format(entry))
+        if isinstance(item, Exception):
+            raise item
+        got, event = item
+        if got != entry:
+            raise ValueError("Prefetched entry {}, but entry {} was asked for".format(got, entry))
+        self.n_events += 1
+        return event
+
+    def report(self):
+        """Print the time spent reading in the background and how much of it was hidden."""
+        hidden = max(self.read_time - self.wait_time, 0.)
+        print("Prefetched {} events (read-ahead {}): {:.1f} s reading, {:.1f} s waiting, "
+              "{:.1f} s ({:.0%}) of I/O hidden".format(
+                  self.n_events, self.read_ahead, self.read_time, self.wait_time, hidden,
+                  hidden / self.read_time if self.read_time > 0 else 0.))
+
+    def close(self, report=True):
+        """Stop the background thread (and print the report)."""
+        self._stop.set()
+        self.thread.join()
+        if report:
+            self.report()
+
+
+def event_reader(chain, files, read_ahead=0, cache_mb=DEFAULT_CACHE_MB):
+    """EventPrefetcher over files with read_ahead > 0, otherwise read straight from chain."""
+    if read_ahead > 0:
+        return EventPrefetcher(files, read_ahead, cache_mb)
+    return _DirectReader(chain)
@@ -0,0 +1,142 @@
+## Incremental cache for derived per-file products (summary rows, selection masks,
+## histogram partials, ...)
+##
+## Each product is stored under a key made from
+##  - the SHA-256 of the input file's contents,
+##  - a fingerprint of the code that produced it (see code_fingerprint), and
+##  - the product name,
+## so new input files, changed input files and changed selection code are the only
+## things that get reprocessed. Products are stored as .npz files of NumPy arrays, and
+## the least recently used ones are evicted to keep the cache under a disk quota.
+##
+## Typical use:
+##   cache = ProductCache("product_cache/", quota_gb=50)
+##   fp = code_fingerprint(my_selection, my_fill_function)
+##   arrays = cache.get_or_compute(input_file, "my_product", fp, lambda: compute(input_file))
+import os
+import json
+import time
+import hashlib
+import inspect
+
+import numpy as np
+
+INDEX_NAME = "index.json"
+HASHES_NAME = "file_hashes.json"
+
+
+def _write_json(obj, file_name):
+    ## Write-then-rename, so an interrupted job can't leave a half-written index
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(obj, f, indent=1, sort_keys=True)
+    os.replace(tmp_name, file_name)
+
+
+def _read_json(file_name):
+    if not os.path.isfile(file_name):
+        return {}
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def content_hash(file_name, block_size=1 << 24):
+    """SHA-256 of a file's contents."""
+    sha = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def code_fingerprint(*objects, version=""):
+    """Fingerprint of the code that produces a product.
+
+    objects can be functions, classes or modules; their source code is hashed, so
+    editing any of them invalidates the products made with the old version. Anything
+    else that changes the output (e.g. a configuration) can be passed as version.
+    """
+    sha = hashlib.sha256(str(version).encode())
+    for obj in objects:
+        try:
+            src = inspect.getsource(obj)
+        except (TypeError, OSError):
+            src = repr(obj)
+        sha.update(src.encode())
+    return sha.hexdigest()[:16]
+
+
+class ProductCache:
+    """Directory of derived products keyed by (input content hash, code fingerprint, name)."""
+    def __init__(self, cache_dir, quota_gb=20.):
+        self.cache_dir = cache_dir
+        self.quota = int(quota_gb * 1024**3)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_name = os.path.join(cache_dir, INDEX_NAME)
+        self.hashes_name = os.path.join(cache_dir, HASHES_NAME)
+        self.index = _read_json(self.index_name)
+        self.hashes = _read_json(self.hashes_name)
+
+    def file_hash(self, file_name):
+        """Content hash of an input file. The hash is remembered against the file's
+        size and modification time, so unchanged files are only read once."""
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        known = self.hashes.get(path)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+
+        sha = content_hash(path)
+        self.hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha}
+        _write_json(self.hashes, self.hashes_name)
+        return sha
+
+    def key(self, input_file, product, fingerprint):
+        return hashlib.sha256("{}:{}:{}".format(self.file_hash(input_file), fingerprint, product)
+                              .encode()).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, input_file, product, fingerprint):
+        """Return the cached product (dict of arrays), or None if it isn't cached."""
+        key = self.key(input_file, product, fingerprint)
+        if key not in self.index or not os.path.isfile(self._path(key)):
+            return None
+
+        with np.load(self._path(key)) as data:
+            arrays = {name: data[name] for name in data.files}
+        self.index[key]["last_used"] = time.time()
+        _write_json(self.index, self.index_name)
+        return arrays
+
+    def put(self, input_file, product, fingerprint, arrays):
+        """Store a product (dict of arrays), and evict old products if over quota."""
+        key = self.key(input_file, product, fingerprint)
+        tmp_name = self._path(key) + ".tmp.npz"
+        np.savez(tmp_name, **arrays)
+        os.replace(tmp_name, self._path(key))
+
+        self.index[key] = {"input": os.path.abspath(input_file), "product": product,
+                           "fingerprint": fingerprint, "size": os.path.getsize(self._path(key)),
+                           "last_used": time.time()}
+        self.evict()
+        _write_json(self.index, self.index_name)
+
+    def get_or_compute(self, input_file, product, fingerprint, compute):
+        """Return the cached product, or call compute() to make it and cache the result."""
+        arrays = self.get(input_file, product, fingerprint)
+        if arrays is None:
+            arrays = compute()
+            self.put(input_file, product, fingerprint, arrays)
+        return arrays
+
+    def evict(self):
+        """Remove least recently used products until the cache is within its quota."""
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if total <= self.quota: break
+            total -= self.index[key]["size"]
+            if os.path.isfile(self._path(key)):
+                os.remove(self._path(key))
+            del self.index[key]
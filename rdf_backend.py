@@ -0,0 +1,236 @@
+## RDataFrame back-end for the containment analysis in example_analysis.py
+##
+## The same selection as example_analysis.process_files (CC-inclusive -> muon tagged ->
+## hadronic contained -> Q^2 and pion energy smearing), written as an RDataFrame graph
+## over the EDepSimEvents tree with the GENIE pass-through tree as a friend. The
+## predicates are C++ versions of the Python functions (TRUTH_RDF_CODE, JIT-compiled
+## once with gInterpreter.Declare) working directly on the TG4Event branch, and with
+## nthreads != 1 ROOT's implicit multithreading processes the clusters of the tree in
+## parallel. process_files returns the histogram fills in the same form as the Python
+## version (benchmarks/rdf_vs_loop.py checks that they're the same on real files):
+##   fills = rdf_backend.process_files(files, nthreads=8)
+## or from the command line, as example_analysis.py --backend rdf --threads 8.
+##
+## The fills come back in entry (rdfentry_) order. Single-threaded that is the order of
+## the Python loop; with several threads ROOT doesn't guarantee that rdfentry_ follows
+## the chain's entry numbers, so the same values can come in a different order (which
+## can only change the last bits of the histograms' mean/RMS).
+import ROOT
+
+EDEP_TREE = "EDepSimEvents"
+GENIE_TREE = "DetSimPassThru/gRooTracker"
+
+## Same numbers and logic as the Python functions in example_analysis.py
+TRUTH_RDF_CODE = r"""
+#include <cmath>
+#include <set>
+#include <vector>
+#include "TLorentzVector.h"
+#include "ROOT/RVec.hxx"
+
+namespace truth_rdf {
+
+bool is_2x2_contained(const TLorentzVector& pos) {
+    if (std::abs(pos.X()) > 670) return false;
+    if (std::abs(pos.Y() - 430) > 670) return false;
+    if (std::abs(pos.Z()) > 670) return false;
+    return true;
+}
+
+std::set<int> primary_ids_for_pdg(const TG4Event& event, int pdg) {
+    std::set<int> ids;
+    for (const auto& part : event.Primaries[0].Particles)
+        if (part.GetPDGCode() == pdg || part.GetPDGCode() == -pdg) ids.insert(part.GetTrackId());
+    return ids;
+}
+
+bool is_ccinc(const TG4Event& event) {
+    return !primary_ids_for_pdg(event, 13).empty();
+}
+
+std::set<int> neutron_and_daughter_ids(const TG4Event& event) {
+    std::set<int> ids;
+    for (const auto& traj : event.Trajectories) {
+        if (traj.GetPDGCode() == 2112 || ids.count(traj.GetParentId())) ids.insert(traj.GetTrackId());
+    }
+    return ids;
+}
+
+std::set<int> low_energy_ids(const TG4Event& event) {
+    std::set<int> ids;
+    for (const auto& traj : event.Trajectories)
+        if (traj.GetInitialMomentum().E() < 10) ids.insert(traj.GetTrackId());
+    return ids;
+}
+
+bool is_muon_tagged(const TG4Event& event) {
+    const auto muon_ids = primary_ids_for_pdg(event, 13);
+    if (muon_ids.empty()) return true;
+
+    const double z_max = 3500;
+    const double approx_rad = 1870;
+    int high_z = 0;
+    for (const auto& det : event.SegmentDetectors) {
+        for (const auto& seg : det.second) {
+            if (!muon_ids.count(seg.GetPrimaryId())) continue;
+            const auto& pos = seg.GetStop();
+            if (pos.Z() > z_max) {
+                high_z += 1;
+                continue;
+            }
+            if (std::sqrt(pos.X()*pos.X() + (pos.Y() - 430)*(pos.Y() - 430)) > approx_rad) return false;
+        }
+    }
+    return high_z > 0;
+}
+
+bool is_hadronic_contained(const TG4Event& event) {
+    const auto neutron_ids = neutron_and_daughter_ids(event);
+    const auto low_ids = low_energy_ids(event);
+    const auto muon_ids = primary_ids_for_pdg(event, 13);
+    for (const auto& det : event.SegmentDetectors) {
+        for (const auto& seg : det.second) {
+            const int key_contrib = seg.GetContributors()[0];
+            if (muon_ids.count(seg.GetPrimaryId())) continue;
+            if (neutron_ids.count(key_contrib)) continue;
+            if (low_ids.count(key_contrib)) continue;
+            if (!is_2x2_contained(seg.GetStop())) return false;
+        }
+    }
+    return true;
+}
+
+bool is_event_contained(const TG4Event& event) {
+    return is_muon_tagged(event) && is_hadronic_contained(event);
+}
+
+// Index of the incoming neutrino in the GENIE stack (-1 if there isn't one)
+template <typename S, typename P>
+int neutrino_index(int n, const S& status, const P& pdg) {
+    for (int p = 0; p < n; ++p) {
+        if (status[p] != 0) continue;
+        const int apdg = std::abs(pdg[p]);
+        if (apdg == 12 || apdg == 14 || apdg == 16) return p;
+    }
+    return -1;
+}
+
+// Q^2 (GeV^2) from the first primary muon and the neutrino (StdHepP4 flattened, in GeV)
+template <typename M>
+double q2(const TG4Event& event, int nu, const M& p4) {
+    TLorentzVector nu_4mom(p4[nu*4 + 0]*1000, p4[nu*4 + 1]*1000, p4[nu*4 + 2]*1000, p4[nu*4 + 3]*1000);
+    for (const auto& part : event.Primaries[0].Particles) {
+        if (part.GetPDGCode() == 13 || part.GetPDGCode() == -13)
+            return -1 * (part.GetMomentum() - nu_4mom).Mag2() / 1e6;
+    }
+    return std::nan("");
+}
+
+// True and deposited energy (GeV) of every primary charged pion
+ROOT::VecOps::RVec<double> pion_true_energy(const TG4Event& event) {
+    ROOT::VecOps::RVec<double> out;
+    for (const auto& part : event.Primaries[0].Particles) {
+        if (part.GetPDGCode() != 211 && part.GetPDGCode() != -211) continue;
+        const auto& mom = part.GetMomentum();
+        out.push_back((mom.E() - mom.M()) / 1000);
+    }
+    return out;
+}
+
+ROOT::VecOps::RVec<double> pion_reco_energy(const TG4Event& event) {
+    ROOT::VecOps::RVec<double> out;
+    for (const auto& part : event.Primaries[0].Particles) {
+        if (part.GetPDGCode() != 211 && part.GetPDGCode() != -211) continue;
+        double reco_energy = 0;
+        for (const auto& det : event.SegmentDetectors)
+            for (const auto& seg : det.second)
+                if (seg.GetPrimaryId() == part.GetTrackId()) reco_energy += seg.GetEnergyDeposit();
+        out.push_back(reco_energy / 1000);
+    }
+    return out;
+}
+
+}
+"""
+
+_declared = False
+
+
+def declare():
+    """JIT-compile TRUTH_RDF_CODE (once per process)."""
+    global _declared
+    if not _declared:
+        if not ROOT.gInterpreter.Declare(TRUTH_RDF_CODE):
+            raise RuntimeError("Failed to compile the RDataFrame predicates (is TG4Event loaded?)")
+        _declared = True
+
+
+def enable_threads(nthreads):
+    """Implicit multithreading on nthreads threads: 0 for all cores, 1 to turn it off."""
+    if ROOT.ROOT.IsImplicitMTEnabled():
+        if nthreads != 1 and nthreads == ROOT.ROOT.GetImplicitMTPoolSize():
+            return
+        ROOT.ROOT.DisableImplicitMT()
+    if nthreads != 1:
+        ROOT.ROOT.EnableImplicitMT(nthreads)
+
+
+def build_graph(edep_chain):
+    """The selection as an RDataFrame graph over a chain with the GENIE friend tree.
+
+    Returns the filtered nodes: all CC-inclusive events with a neutrino ("all"), and the
+    contained ones ("contained"), both with the q2, pi_true_e and pi_reco_e columns.
+    """
+    declare()
+    df = ROOT.ROOT.RDataFrame(edep_chain)
+    ccinc = (df.Filter("truth_rdf::is_ccinc(Event)", "CC-inclusive")
+               .Define("contained", "truth_rdf::is_event_contained(Event)")
+               .Define("nu", "truth_rdf::neutrino_index(groo.StdHepN, groo.StdHepStatus, groo.StdHepPdg)")
+               .Filter("nu >= 0", "Has a neutrino")
+               .Define("q2", "truth_rdf::q2(Event, nu, groo.StdHepP4)")
+               .Filter("!std::isnan(q2)", "Has a muon"))
+    contained = (ccinc.Filter("contained", "Contained")
+                      .Define("pi_true_e", "truth_rdf::pion_true_energy(Event)")
+                      .Define("pi_reco_e", "truth_rdf::pion_reco_energy(Event)"))
+    return {"all": ccinc, "contained": contained}
+
+
+def process_files(infilelist, nthreads=0):
+    """Same as example_analysis.process_files, run with RDataFrame on nthreads threads
+    (0 = all cores, 1 = no implicit multithreading)."""
+    enable_threads(nthreads)
+
+    edep_chain = ROOT.TChain(EDEP_TREE)
+    groo_chain = ROOT.TChain(GENIE_TREE)
+    for f in infilelist:
+        edep_chain.Add(f)
+        groo_chain.Add(f)
+    edep_chain.AddFriend(groo_chain, "groo")
+
+    nodes = build_graph(edep_chain)
+    print("Looping over", edep_chain.GetEntries(), "events with RDataFrame")
+
+    ## Book everything before the (single) event loop runs
+    all_entry = nodes["all"].Take["ULong64_t"]("rdfentry_")
+    all_q2 = nodes["all"].Take["double"]("q2")
+    cont_entry = nodes["contained"].Take["ULong64_t"]("rdfentry_")
+    cont_q2 = nodes["contained"].Take["double"]("q2")
+    pi_true = nodes["contained"].Take["ROOT::VecOps::RVec<double>"]("pi_true_e")
+    pi_reco = nodes["contained"].Take["ROOT::VecOps::RVec<double>"]("pi_reco_e")
+
+    ## Put the values back in entry order
+    all_entry = list(all_entry.GetValue())
+    cont_entry = list(cont_entry.GetValue())
+    all_order = sorted(range(len(all_entry)), key=all_entry.__getitem__)
+    cont_order = sorted(range(len(cont_entry)), key=cont_entry.__getitem__)
+    all_q2 = list(all_q2.GetValue())
+    cont_q2 = list(cont_q2.GetValue())
+    pi_true = pi_true.GetValue()
+    pi_reco = pi_reco.GetValue()
+
+    fills = {"q2_all": [(all_q2[i],) for i in all_order],
+             "q2_cont": [(cont_q2[i],) for i in cont_order],
+             "pi_energy_smearing": []}
+    for i in cont_order:
+        fills["pi_energy_smearing"].extend(zip(pi_true[i], pi_reco[i]))
+    return fills
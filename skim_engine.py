@@ -0,0 +1,320 @@
+## Single-pass skim engine with declarative selections
+##
+## A selection is a named predicate over a batch (cluster) of entries, built from the
+## helpers below, e.g.:
+##   Selection("kaon", primary_any_pdg([130, 310, 311, 321]))
+##   Selection("nc1p", primary_pdgs_equal([14, 2212]))
+##   Selection("active_vertex", vertex_in_box((0, 0.43, 0), 0.67, field="genie_vtx"))
+## Predicates get an EntryBatch and return a boolean mask with one value per entry. The
+## fields they need (primary PDG codes, vertex, GENIE stack, ...) are read lazily, once
+## per cluster, using only the lightweight branches they come from.
+##
+## Each input file is read once, and every selected entry is copied into each of the
+## output skims it passes, so N skims cost one read of the input instead of N.
+##
+## Usage:
+##   python3 skim_engine.py -o <out_dir> -s kaon -s nc1p <input_file.root> [...]
+## Writes <out_dir>/<selection>/<input basename> for each selection and input file.
+import os
+import re
+import sys
+from glob import glob
+from optparse import OptionParser
+
+import numpy as np
+import ROOT
+
+EDEP_TREE = "EDepSimEvents"
+## The GENIE tree is "DetSimPassThru/gRooTracker" in edep-sim output, and "gRooTracker"
+## in GENIE-only files (and in the skims written by kaon_picker.py)
+GENIE_TREES = ["DetSimPassThru/gRooTracker", "gRooTracker"]
+
+
+class Selection:
+    """A named skim: a predicate over an EntryBatch, returning a mask per entry."""
+    def __init__(self, name, predicate):
+        self.name = name
+        self.predicate = predicate
+
+    def __call__(self, batch):
+        return np.asarray(self.predicate(batch), dtype=bool)
+
+
+## Predicate helpers. Each returns a function of an EntryBatch.
+def primary_any_pdg(pdgs, absolute=True):
+    """Any primary particle (of the first vertex) with a PDG code in pdgs."""
+    def predicate(batch):
+        pdg = batch["primary_pdg"]
+        hit = np.isin(np.abs(pdg) if absolute else pdg, pdgs)
+        return np.bincount(batch.row_event("primary")[hit], minlength=len(batch)) > 0
+    return predicate
+
+
+def primary_pdgs_equal(pdgs):
+    """The list of primary PDG codes (of the first vertex) is exactly pdgs, in order."""
+    pdgs = np.asarray(pdgs)
+    def predicate(batch):
+        pdg = batch["primary_pdg"]
+        offsets = batch["primary_offsets"]
+        mask = np.diff(offsets) == len(pdgs)
+        for i, code in enumerate(pdgs):
+            mask[mask] &= pdg[offsets[:-1][mask] + i] == code
+        return mask
+    return predicate
+
+
+def vertex_in_box(center, half_width, field="vertex"):
+    """The vertex is within half_width of center in x, y and z (inclusive).
+    field is "vertex" (edep-sim, mm) or "genie_vtx" (GENIE, m)."""
+    center = np.asarray(center, dtype=float)
+    def predicate(batch):
+        pos = batch[field][:, :3]
+        return np.all(np.abs(pos - center) <= half_width, axis=1)
+    return predicate
+
+
+def genie_code_matches(pattern):
+    """The GENIE EvtCode string matches the regular expression pattern."""
+    regex = re.compile(pattern)
+    def predicate(batch):
+        return np.array([bool(regex.search(code)) for code in batch["genie_code"]], dtype=bool)
+    return predicate
+
+
+def nu_pdg_in(pdgs):
+    """The incoming neutrino (from the GENIE stack) has a PDG code in pdgs."""
+    def predicate(batch):
+        return np.isin(batch["nu_pdg"], pdgs)
+    return predicate
+
+
+def all_of(*predicates):
+    def predicate(batch):
+        mask = np.ones(len(batch), dtype=bool)
+        for pred in predicates:
+            mask &= np.asarray(pred(batch), dtype=bool)
+        return mask
+    return predicate
+
+
+def any_of(*predicates):
+    def predicate(batch):
+        mask = np.zeros(len(batch), dtype=bool)
+        for pred in predicates:
+            mask |= np.asarray(pred(batch), dtype=bool)
+        return mask
+    return predicate
+
+
+def not_(pred):
+    def predicate(batch):
+        return ~np.asarray(pred(batch), dtype=bool)
+    return predicate
+
+
+## The skims we already have, as declarative selections
+SELECTIONS = {
+    ## inputs/cherrypicker.py
+    "active_vertex": Selection("active_vertex", vertex_in_box((0, 0.43, 0), 0.67, field="genie_vtx")),
+    ## mc/kaon_picker.py
+    "kaon": Selection("kaon", primary_any_pdg([130, 310, 311, 321])),
+    ## elastic/elastic.py
+    "nc1p": Selection("nc1p", primary_pdgs_equal([14, 2212])),
+}
+
+
+def draw_columns(tree, expressions, nentries, first, nrows_estimate):
+    """Read TTree::Draw expressions for an entry range into NumPy arrays (max. 4 at once)."""
+    tree.SetEstimate(max(nrows_estimate, nentries) + 1)
+    nrows = tree.Draw(":".join(expressions), "", "goff", nentries, first)
+    columns = []
+    for i in range(len(expressions)):
+        buf = tree.GetVal(i)
+        buf.SetSize(nrows)
+        columns.append(np.array(np.frombuffer(buf, dtype=np.float64, count=nrows)))
+    return columns
+
+
+class EntryBatch:
+    """Fields for the entries [first, last) of an input file, read on first use."""
+    def __init__(self, edep_tree, genie_tree, first, last):
+        self.edep_tree = edep_tree
+        self.genie_tree = genie_tree
+        self.first = first
+        self.last = last
+        self._fields = {}
+
+    def __len__(self):
+        return self.last - self.first
+
+    def __getitem__(self, name):
+        if name not in self._fields:
+            FIELD_LOADERS[name](self)
+        return self._fields[name]
+
+    def row_event(self, table):
+        """Entry (relative to first) of each row of a jagged field."""
+        offsets = self[table + "_offsets"]
+        return np.repeat(np.arange(len(self)), np.diff(offsets))
+
+    def _load_primaries(self):
+        ## Only the primaries branches are switched on, so nothing else is decompressed
+        tree = self.edep_tree
+        tree.SetBranchStatus("*", 0)
+        tree.SetBranchStatus("*Primaries*", 1)
+
+        pdg = []
+        offsets = [0]
+        vertex = np.zeros((len(self), 4))
+        for i, evt in enumerate(range(self.first, self.last)):
+            tree.GetEntry(evt)
+            vtx = tree.Event.Primaries[0]
+            pdg.extend(x.GetPDGCode() for x in vtx.Particles)
+            offsets.append(len(pdg))
+            pos = vtx.GetPosition()
+            vertex[i] = (pos.X(), pos.Y(), pos.Z(), pos.T())
+
+        tree.SetBranchStatus("*", 1)
+        self._fields["primary_pdg"] = np.array(pdg, dtype=np.int32)
+        self._fields["primary_offsets"] = np.array(offsets, dtype=np.int64)
+        self._fields["vertex"] = vertex
+
+    def _load_genie_vtx(self):
+        cols = draw_columns(self.genie_tree, ["EvtVtx[0]", "EvtVtx[1]", "EvtVtx[2]", "EvtVtx[3]"],
+                            len(self), self.first, len(self))
+        self._fields["genie_vtx"] = np.stack(cols, axis=1)
+
+    def _load_genie_stack(self):
+        tree = self.genie_tree
+        (nparts,) = draw_columns(tree, ["StdHepN"], len(self), self.first, len(self))
+        entry, pdg, status, energy = draw_columns(tree, ["Entry$", "StdHepPdg", "StdHepStatus", "StdHepP4[][3]"],
+                                                  len(self), self.first, int(nparts.sum()))
+        counts = np.bincount((entry - self.first).astype(np.int64), minlength=len(self))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        pdg = pdg.astype(np.int32)
+        status = status.astype(np.int32)
+
+        ## The neutrino is the first initial state (status 0) neutrino of any flavour
+        is_nu = (status == 0) & np.isin(np.abs(pdg), [12, 14, 16])
+        row_evt = np.repeat(np.arange(len(self)), counts)
+        nu_pdg = np.zeros(len(self), dtype=np.int32)
+        nu_E = np.zeros(len(self))
+        nu_rows = np.flatnonzero(is_nu)
+        first_nu, idx = np.unique(row_evt[nu_rows], return_index=True)
+        nu_pdg[first_nu] = pdg[nu_rows[idx]]
+        nu_E[first_nu] = energy[nu_rows[idx]] * 1000
+
+        self._fields.update({"genie_pdg": pdg, "genie_status": status, "genie_offsets": offsets,
+                             "nu_pdg": nu_pdg, "nu_E": nu_E})
+
+    def _load_genie_code(self):
+        tree = self.genie_tree
+        tree.SetBranchStatus("*", 0)
+        tree.SetBranchStatus("EvtCode*", 1)
+        codes = []
+        for evt in range(self.first, self.last):
+            tree.GetEntry(evt)
+            codes.append(str(tree.EvtCode.GetString()))
+        tree.SetBranchStatus("*", 1)
+        self._fields["genie_code"] = codes
+
+
+FIELD_LOADERS = {
+    "primary_pdg":     EntryBatch._load_primaries,
+    "primary_offsets": EntryBatch._load_primaries,
+    "vertex":          EntryBatch._load_primaries,
+    "genie_vtx":       EntryBatch._load_genie_vtx,
+    "genie_pdg":       EntryBatch._load_genie_stack,
+    "genie_status":    EntryBatch._load_genie_stack,
+    "genie_offsets":   EntryBatch._load_genie_stack,
+    "nu_pdg":          EntryBatch._load_genie_stack,
+    "nu_E":            EntryBatch._load_genie_stack,
+    "genie_code":      EntryBatch._load_genie_code,
+}
+
+
+def cluster_ranges(tree):
+    """Yield (first, last) entry ranges of the tree's I/O clusters."""
+    nevt = tree.GetEntries()
+    it = tree.GetClusterIterator(0)
+    first = it.Next()
+    while first < nevt:
+        last = min(it.GetNextEntry(), nevt)
+        yield first, last
+        first = it.Next()
+
+
+def skim_file(input_file_name, selections, out_dir):
+    """Apply all selections to one input file in a single pass.
+
+    Returns a dict of selection name -> number of entries saved.
+    """
+    in_file = ROOT.TFile.Open(input_file_name)
+    edep_tree = in_file.Get(EDEP_TREE)
+    genie_tree = None
+    for name in GENIE_TREES:
+        genie_tree = in_file.Get(name)
+        if genie_tree: break
+    in_trees = [t for t in [edep_tree, genie_tree] if t]
+    if not in_trees:
+        print("No edep-sim or GENIE tree found in", input_file_name)
+        return {}
+    ref_tree = in_trees[0]
+
+    ## One output file per selection, with an empty clone of each input tree
+    outputs = {}
+    for sel in selections:
+        os.makedirs(os.path.join(out_dir, sel.name), exist_ok=True)
+        out_file = ROOT.TFile(os.path.join(out_dir, sel.name, os.path.basename(input_file_name)), "RECREATE")
+        outputs[sel.name] = (out_file, [t.CloneTree(0) for t in in_trees])
+
+    nevt = ref_tree.GetEntries()
+    nsaved = {sel.name: 0 for sel in selections}
+    print("Skimming", nevt, "events from", input_file_name, "into", len(selections), "skims")
+
+    for first, last in cluster_ranges(ref_tree):
+        batch = EntryBatch(edep_tree, genie_tree, first, last)
+        masks = np.stack([sel(batch) for sel in selections])
+
+        ## Read each selected entry once, and fill every skim that wants it
+        for i in np.flatnonzero(masks.any(axis=0)):
+            for tree in in_trees:
+                tree.GetEntry(first + int(i))
+            for sel, mask in zip(selections, masks):
+                if not mask[i]: continue
+                nsaved[sel.name] += 1
+                for skim_tree in outputs[sel.name][1]:
+                    skim_tree.Fill()
+
+    for sel in selections:
+        out_file, skim_trees = outputs[sel.name]
+        out_file.cd()
+        for skim_tree in skim_trees:
+            ## Write the GENIE tree at the top level, as kaon_picker.py does
+            skim_tree.Write(skim_tree.GetName())
+        out_file.Close()
+        print("Saved", nsaved[sel.name], "events to", out_file.GetName(),
+              "(%.3f)"%(nsaved[sel.name]/float(nevt) if nevt else 0))
+
+    in_file.Close()
+    return nsaved
+
+
+if __name__ == '__main__':
+
+    ## Get arguments
+    parser = OptionParser(usage="%prog -o <out_dir> -s <selection> [-s ...] <input_file.root> [...]")
+    parser.add_option("-o", "--outDir", action="store", type="string", dest="outDir", default=".")
+    parser.add_option("-s", "--selection", action="append", type="string", dest="selections", default=[],
+                      help="Selection to apply (can be repeated), one of: " + ", ".join(SELECTIONS))
+    (options, args) = parser.parse_args()
+
+    if len(args) < 1 or len(options.selections) < 1:
+        parser.print_help()
+        sys.exit()
+
+    selections = [SELECTIONS[name] for name in options.selections]
+    for file in args:
+        ## Allow for escaped wildcards in the input...
+        for f in sorted(glob(file)):
+            skim_file(f, selections, options.outDir)
@@ -0,0 +1,351 @@
+## ROOT-free synthetic edep-sim events
+##
+## Builds plain Python objects with the same interface as the TG4Event classes used by
+## the analysis code (Primaries[i].Particles, Trajectories[i].Points, SegmentDetectors,
+## GetTrackId(), GetStop(), ...), so the selection functions can be exercised and timed
+## without the container or any real files. The events aren't physics: tracks are
+## straight lines with made-up lengths and energy deposits. What they do reproduce is
+## the structure the analysis code cares about, with configurable
+##  - numbers of primaries and secondary trajectories,
+##  - energy-deposit segments per track,
+##  - neutron cascades (generations of neutron-induced secondaries), and
+##  - muons punching through (or stopping in / leaving the side of) MINERvA.
+##
+##   events = make_events(100, SIZES["medium"], seed=1)
+##   example_analysis.is_hadronic_contained(events[0])
+##
+## Everything is in edep-sim units (mm, MeV). Scripts that need the analysis modules
+## without PyROOT installed can call use_root_stand_in() before importing them.
+import sys
+import math
+import types
+import random
+
+## Event sizes used by the benchmarks; anything not given takes DEFAULT_CONFIG's value
+DEFAULT_CONFIG = {
+    "n_hadrons":          4,     ## primary hadrons per event (besides the lepton)
+    "n_secondaries":      20,    ## low-energy secondaries (deltas, gammas) per event
+    "segments_per_track": 8,     ## mean number of segments per depositing track
+    "points_per_track":   5,     ## trajectory points per track
+    "cc_fraction":        0.7,   ## fraction of events with a primary muon
+    "punch_through":      0.6,   ## fraction of muons that reach past MINERvA
+    "neutron_fraction":   0.3,   ## fraction of primary hadrons that are neutrons
+    "cascade_depth":      2,     ## generations of neutron-induced secondaries
+    "cascade_size":       2,     ## daughters per neutron in the cascade
+}
+SIZES = {
+    "small":  {"n_hadrons": 2,  "n_secondaries": 10,  "segments_per_track": 4},
+    "medium": {"n_hadrons": 5,  "n_secondaries": 60,  "segments_per_track": 10},
+    "large":  {"n_hadrons": 10, "n_secondaries": 300, "segments_per_track": 25, "cascade_depth": 3},
+}
+
+MASSES = {13: 105.66, 211: 139.57, 111: 134.98, 2212: 938.27, 2112: 939.57, 22: 0., 11: 0.511, 14: 0.}
+NAMES = {13: "mu-", -13: "mu+", 211: "pi+", -211: "pi-", 111: "pi0", 2212: "proton", 2112: "neutron",
+         22: "gamma", 11: "e-", 14: "nu_mu"}
+
+## Same numbers as example_analysis.py
+ACTIVE_HALF_WIDTH = 670.
+DETECTOR_Y_OFFSET = 430.
+MINERVA_Z_MAX = 3500.
+MINERVA_APPROX_RAD = 1870.
+
+
+class Vector3:
+    """The parts of TVector3 used by the analysis code."""
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x=0., y=0., z=0.):
+        self.x, self.y, self.z = x, y, z
+
+    def X(self): return self.x
+    def Y(self): return self.y
+    def Z(self): return self.z
+    def Mag2(self): return self.x*self.x + self.y*self.y + self.z*self.z
+    def Mag(self): return math.sqrt(self.Mag2())
+    def Dot(self, other): return self.x*other.x + self.y*other.y + self.z*other.z
+
+    def Angle(self, other):
+        norm = self.Mag() * other.Mag()
+        return math.acos(max(-1., min(1., self.Dot(other) / norm))) if norm > 0 else 0.
+
+    def __getitem__(self, i): return (self.x, self.y, self.z)[i]
+    def __add__(self, o): return Vector3(self.x + o.x, self.y + o.y, self.z + o.z)
+    def __sub__(self, o): return Vector3(self.x - o.x, self.y - o.y, self.z - o.z)
+
+
+class LorentzVector:
+    """The parts of TLorentzVector used by the analysis code."""
+    __slots__ = ("x", "y", "z", "t")
+
+    def __init__(self, x=0., y=0., z=0., t=0.):
+        self.x, self.y, self.z, self.t = x, y, z, t
+
+    def X(self): return self.x
+    def Y(self): return self.y
+    def Z(self): return self.z
+    def T(self): return self.t
+    def Px(self): return self.x
+    def Py(self): return self.y
+    def Pz(self): return self.z
+    def E(self): return self.t
+    def P(self): return math.sqrt(self.x*self.x + self.y*self.y + self.z*self.z)
+    def Vect(self): return Vector3(self.x, self.y, self.z)
+    def Mag2(self): return self.t*self.t - self.x*self.x - self.y*self.y - self.z*self.z
+
+    def M(self):
+        m2 = self.Mag2()
+        return math.sqrt(m2) if m2 > 0 else -math.sqrt(-m2)
+    Mag = M
+
+    def Gamma(self):
+        b2 = (self.x*self.x + self.y*self.y + self.z*self.z) / (self.t*self.t) if self.t else 0.
+        return 1. / math.sqrt(1. - b2) if b2 < 1 else 1e10
+
+    def __getitem__(self, i): return (self.x, self.y, self.z, self.t)[i]
+    def __add__(self, o): return LorentzVector(self.x + o.x, self.y + o.y, self.z + o.z, self.t + o.t)
+    def __sub__(self, o): return LorentzVector(self.x - o.x, self.y - o.y, self.z - o.z, self.t - o.t)
+
+
+class TrajectoryPoint:
+    def __init__(self, position, momentum):
+        self.position, self.momentum = position, momentum
+    def GetPosition(self): return self.position
+    def GetMomentum(self): return self.momentum
+
+
+class Trajectory:
+    def __init__(self, track_id, parent_id, pdg, momentum, points):
+        self.track_id, self.parent_id, self.pdg = track_id, parent_id, pdg
+        self.momentum = momentum
+        self.Points = points
+    def GetTrackId(self): return self.track_id
+    def GetParentId(self): return self.parent_id
+    def GetPDGCode(self): return self.pdg
+    def GetInitialMomentum(self): return self.momentum
+    def GetName(self): return NAMES.get(self.pdg, str(self.pdg))
+
+
+class PrimaryParticle:
+    def __init__(self, track_id, pdg, momentum):
+        self.track_id, self.pdg, self.momentum = track_id, pdg, momentum
+    def GetTrackId(self): return self.track_id
+    def GetPDGCode(self): return self.pdg
+    def GetMomentum(self): return self.momentum
+    def GetName(self): return NAMES.get(self.pdg, str(self.pdg))
+
+
+class PrimaryVertex:
+    def __init__(self, position, particles, reaction):
+        self.position, self.Particles, self.reaction = position, particles, reaction
+    def GetPosition(self): return self.position
+    def GetReaction(self): return self.reaction
+
+
+class Segment:
+    def __init__(self, start, stop, edep, primary_id, contributor, length):
+        self.start, self.stop, self.edep = start, stop, edep
+        self.primary_id, self.contributors, self.length = primary_id, [contributor], length
+    def GetStart(self): return self.start
+    def GetStop(self): return self.stop
+    def GetEnergyDeposit(self): return self.edep
+    def GetPrimaryId(self): return self.primary_id
+    def GetContributors(self): return self.contributors
+    def GetTrackLength(self): return self.length
+
+
+class Event:
+    """Stand-in for TG4Event. SegmentDetectors is a list of (name, segments) pairs in
+    name order, which iterates like the std::map in the real thing."""
+    def __init__(self, primaries, trajectories, segment_detectors):
+        self.Primaries = primaries
+        self.Trajectories = trajectories
+        self.SegmentDetectors = segment_detectors
+
+
+def _detector(pos):
+    ## Sensitive detector that a point would be in
+    if (abs(pos[0]) <= ACTIVE_HALF_WIDTH and abs(pos[1] - DETECTOR_Y_OFFSET) <= ACTIVE_HALF_WIDTH and
+            abs(pos[2]) <= ACTIVE_HALF_WIDTH):
+        return "volLArActive"
+    if pos[2] > MINERVA_Z_MAX or math.hypot(pos[0], pos[1] - DETECTOR_Y_OFFSET) > MINERVA_APPROX_RAD:
+        return "volWorld"
+    return "DetectorlvTrackerModuleXU" if pos[2] < 2100 else "DetectorlvDownHcal"
+
+
+class _Builder:
+    """Adds trajectories (with their points and segments) to one event."""
+    def __init__(self, rng, config):
+        self.rng = rng
+        self.config = config
+        self.trajectories = []
+        self.primary_of = []
+        self.segments = {}
+
+    def _direction(self, forward=0.):
+        ## Random unit vector, pushed towards +z by forward (0 to 1)
+        rng = self.rng
+        cos_t = min(1., rng.uniform(-1., 1.) * (1 - forward) + forward)
+        sin_t = math.sqrt(1 - cos_t*cos_t)
+        phi = rng.uniform(0, 2*math.pi)
+        return (sin_t*math.cos(phi), sin_t*math.sin(phi), cos_t)
+
+    def add(self, pdg, parent_id, start, kinetic, length, direction, deposits=True):
+        """Add a straight track, return its track id and end point."""
+        rng = self.rng
+        track_id = len(self.trajectories)
+        mass = MASSES.get(abs(pdg), 0.)
+        p = math.sqrt(kinetic*kinetic + 2*kinetic*mass)
+        momentum = LorentzVector(p*direction[0], p*direction[1], p*direction[2], kinetic + mass)
+        end = tuple(start[i] + length*direction[i] for i in range(3))
+
+        n_points = max(2, self.config["points_per_track"])
+        points = []
+        for k in range(n_points):
+            f = k / (n_points - 1.)
+            pk = p * (1 - f)
+            points.append(TrajectoryPoint(
+                LorentzVector(*[start[i] + f*length*direction[i] for i in range(3)], f*length/300.),
+                Vector3(pk*direction[0], pk*direction[1], pk*direction[2])))
+
+        self.trajectories.append(Trajectory(track_id, parent_id, pdg, momentum, points))
+        self.primary_of.append(track_id if parent_id < 0 else self.primary_of[parent_id])
+
+        ## Energy deposits along the track, split into roughly equal steps
+        if deposits and length > 0:
+            n_seg = max(1, int(rng.expovariate(1. / self.config["segments_per_track"]) + 0.5))
+            step = length / n_seg
+            for k in range(n_seg):
+                a = tuple(start[i] + k*step*direction[i] for i in range(3))
+                b = tuple(start[i] + (k + 1)*step*direction[i] for i in range(3))
+                seg = Segment(LorentzVector(*a), LorentzVector(*b), rng.uniform(0.1, 2.) * step / 10.,
+                              self.primary_of[track_id], track_id, step)
+                self.segments.setdefault(_detector(b), []).append(seg)
+        return track_id, end
+
+    def cascade(self, parent_id, start, generation):
+        ## Neutron-induced secondaries: neutrons, protons and gammas, some far away
+        rng = self.rng
+        if generation > self.config["cascade_depth"]: return
+        for _ in range(self.config["cascade_size"]):
+            pdg = rng.choice([2112, 2212, 22])
+            length = rng.uniform(10, 300) if pdg == 2212 else rng.uniform(100, 2000)
+            tid, end = self.add(pdg, parent_id, start, rng.uniform(1, 100), length,
+                                self._direction(), deposits=pdg != 2112)
+            if pdg == 2112:
+                self.cascade(tid, end, generation + 1)
+
+
+def make_event(rng, config=None):
+    """One synthetic event. rng is a random.Random, config overrides DEFAULT_CONFIG."""
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    builder = _Builder(rng, config)
+    vertex = (rng.uniform(-600, 600), DETECTOR_Y_OFFSET + rng.uniform(-600, 600), rng.uniform(-600, 600))
+
+    ## Primaries: the lepton first, then the hadrons (track ids 0, 1, ...)
+    is_cc = rng.random() < config["cc_fraction"]
+    if is_cc:
+        direction = builder._direction(forward=0.9)
+        if rng.random() < config["punch_through"]:
+            ## Long enough to get past the back of MINERvA
+            length = (MINERVA_Z_MAX + 500 - vertex[2]) / max(direction[2], 0.2)
+        else:
+            length = rng.uniform(200, 3000)
+        builder.add(13, -1, vertex, rng.uniform(200, 5000), length, direction)
+    else:
+        builder.add(14, -1, vertex, rng.uniform(500, 5000), 5000., builder._direction(0.95), deposits=False)
+
+    hadron_pdgs = [2212, 211, -211, 111]
+    neutrons = []
+    for _ in range(config["n_hadrons"]):
+        if rng.random() < config["neutron_fraction"]:
+            pdg = 2112
+        else:
+            pdg = rng.choice(hadron_pdgs)
+        length = rng.uniform(500, 3000) if pdg == 2112 else rng.uniform(5, 800)
+        tid, end = builder.add(pdg, -1, vertex, rng.uniform(20, 1000), length, builder._direction(0.3),
+                               deposits=pdg not in (2112, 111))
+        if pdg == 2112:
+            neutrons.append((tid, end))
+
+    n_primaries = len(builder.trajectories)
+    primaries = [PrimaryParticle(t.track_id, t.pdg, t.momentum) for t in builder.trajectories]
+
+    for tid, end in neutrons:
+        builder.cascade(tid, end, 1)
+
+    ## Low-energy secondaries (delta rays, de-excitation gammas) hanging off any track
+    for _ in range(config["n_secondaries"]):
+        parent = builder.trajectories[rng.randrange(n_primaries, len(builder.trajectories))
+                                      if len(builder.trajectories) > n_primaries and rng.random() < 0.3
+                                      else rng.randrange(n_primaries)]
+        start = parent.Points[rng.randrange(len(parent.Points))].GetPosition()
+        pdg = rng.choice([11, 22])
+        builder.add(pdg, parent.track_id, (start.X(), start.Y(), start.Z()), rng.uniform(0.05, 15),
+                    rng.uniform(1, 50), builder._direction())
+
+    reaction = "nu:14;tgt:1000180400;N:2112;proc:Weak[{}],QES;".format("CC" if is_cc else "NC")
+    vtx = PrimaryVertex(LorentzVector(*vertex, 0.), primaries, reaction)
+    segment_detectors = sorted(builder.segments.items())
+    return Event([vtx], builder.trajectories, segment_detectors)
+
+
+def make_events(n, config=None, seed=None):
+    """A list of n synthetic events, reproducible for a given seed."""
+    rng = random.Random(seed)
+    return [make_event(rng, config) for _ in range(n)]
+
+
+def to_batch(events, tables=None):
+    """The events in the EventCache.batch layout (see event_cache.py), for the
+    batch_selections functions."""
+    import event_cache
+    buffers, offsets = event_cache.new_buffers(tables or event_cache.TABLES)
+    volumes = {}
+    for event in events:
+        event_cache.fill_event(event, buffers, offsets, volumes)
+    return event_cache.buffers_to_arrays(buffers, offsets)
+
+
+def make_genie_event(event):
+    """Object with the gRooTracker StdHep fields used by the analysis code: the incoming
+    neutrino (status 0) followed by the primaries (status 1). Momenta in GeV."""
+    vtx = event.Primaries[0]
+    lepton = vtx.Particles[0].GetMomentum()
+    nu_E = lepton.E() + sum(p.GetMomentum().E() for p in vtx.Particles[1:]) * 0.5
+    stack = [(14, 0, (0., 0., nu_E, nu_E))]
+    stack += [(p.GetPDGCode(), 1, tuple(p.GetMomentum()[i] for i in range(4))) for p in vtx.Particles]
+    genie = types.SimpleNamespace()
+    genie.StdHepN = len(stack)
+    genie.StdHepPdg = [pdg for pdg, _, _ in stack]
+    genie.StdHepStatus = [status for _, status, _ in stack]
+    genie.StdHepP4 = [c / 1000. for _, _, p4 in stack for c in p4]
+    genie.EvtVtx = [vtx.GetPosition()[i] / 1000. for i in range(4)]
+    genie.EvtCode = vtx.GetReaction()
+    return genie
+
+
+class _Inert:
+    ## Absorbs the plotting/style calls made when the analysis modules are imported
+    def __call__(self, *args, **kwargs): return self
+    def __getattr__(self, name): return self
+
+
+def use_root_stand_in():
+    """Make "import ROOT" work without PyROOT, for running the analysis functions on
+    synthetic events only: TLorentzVector/TVector3 are the classes above and anything
+    else is inert (there's no I/O). Does nothing if PyROOT is available.
+
+    Returns True if the stand-in was installed.
+    """
+    try:
+        import ROOT
+        return False
+    except ImportError:
+        pass
+    module = types.ModuleType("ROOT")
+    module.TLorentzVector = LorentzVector
+    module.TVector3 = Vector3
+    inert = _Inert()
+    module.__getattr__ = lambda name: inert
+    sys.modules["ROOT"] = module
+    return True
@@ -0,0 +1,170 @@
+## Per-event truth summary ntuple
+##
+## Writes one flat row per event (neutrino, lepton, Q^2/q0/q3, vertex, reaction code,
+## primary multiplicities and the containment/tagging flags from example_analysis.py)
+## to a compressed .npz file per input, so studies can be re-histogrammed without
+## re-reading the edep-sim files.
+##
+## Works from the columnar cache written by event_cache.py (.root inputs are cached first):
+##   python3 truth_summary.py -o <summary_dir> [-c <cache_dir>] <input.root or input.cache> [...]
+## and the summaries are read back with load_summaries(glob("<summary_dir>/*.summary.npz")).
+import os
+import sys
+from glob import glob
+from optparse import OptionParser
+
+import numpy as np
+
+import batch_selections as bs
+import minerva_acceptance as ma
+from event_cache import EventCache, get_cache
+
+## Primary particle species counted for each event (by absolute PDG code)
+SPECIES = {
+    "mu":     [13],
+    "e":      [11],
+    "nu":     [12, 14, 16],
+    "p":      [2212],
+    "n":      [2112],
+    "pipm":   [211],
+    "pi0":    [111],
+    "kaon":   [130, 310, 311, 321],
+    "gamma":  [22],
+}
+LEPTON_PDGS = [11, 12, 13, 14, 15, 16]
+
+## Number of events summarised at a time
+BATCH_SIZE = 10000
+
+
+def summarise_batch(evts, acceptance=None):
+    """Return a dict of per-event columns for one batch from EventCache.batch.
+    acceptance is the MINERvA model used for muon tagging (see minerva_acceptance.py)."""
+    seg, traj, prim = evts["segments"], evts["trajectories"], evts["primaries"]
+    vtx = evts["vertices"]
+    nevt = len(prim["offsets"]) - 1
+    row = {}
+
+    ## Neutrino from the GENIE pass-through tree
+    if "genie" in evts:
+        row["nu_pdg"] = np.asarray(evts["genie"]["nu_pdg"])
+        nu_p4 = np.asarray(evts["genie"]["nu_p4"])
+    else:
+        row["nu_pdg"] = np.zeros(nevt, dtype=np.int32)
+        nu_p4 = np.zeros((nevt, 4))
+    row["nu_E"] = nu_p4[:, 3]
+
+    ## Only the first vertex is used, as in the rest of the analysis code
+    prim_evt = bs.event_index(prim["offsets"])
+    first_vtx = np.asarray(prim["vertex"]) == 0
+    abs_pdg = np.abs(np.asarray(prim["pdg"]))
+
+    ## The lepton is the last lepton in the primary list (see Inspector.list_event_kinematics)
+    lep_pdg = np.zeros(nevt, dtype=np.int32)
+    lep_p4 = np.zeros((nevt, 4))
+    lep_rows = np.flatnonzero(first_vtx & np.isin(abs_pdg, LEPTON_PDGS))[::-1]
+    lep_rows = lep_rows[np.unique(prim_evt[lep_rows], return_index=True)[1]]
+    lep_pdg[prim_evt[lep_rows]] = np.asarray(prim["pdg"])[lep_rows]
+    lep_p4[prim_evt[lep_rows]] = np.asarray(prim["p4"])[lep_rows]
+    row["lep_pdg"] = lep_pdg
+    row["lep_p4"] = lep_p4
+
+    ## Energy and momentum transfer (GeV)
+    q0 = (nu_p4[:, 3] - lep_p4[:, 3]) / 1000.0
+    q3 = np.linalg.norm(nu_p4[:, :3] - lep_p4[:, :3], axis=1) / 1000.0
+    row["q0"] = q0
+    row["q3"] = q3
+    row["Q2"] = q3**2 - q0**2
+
+    ## First vertex position and reaction code
+    vtx_offsets = vtx["offsets"]
+    n_vtx = np.diff(vtx_offsets)
+    has_vtx = n_vtx > 0
+    row["n_vertices"] = n_vtx
+    row["vertex"] = np.zeros((nevt, 4))
+    row["vertex"][has_vtx] = np.asarray(vtx["position"])[vtx_offsets[:-1][has_vtx]]
+    row["reaction"] = np.full(nevt, "", dtype=np.asarray(vtx["reaction"]).dtype)
+    row["reaction"][has_vtx] = np.asarray(vtx["reaction"])[vtx_offsets[:-1][has_vtx]]
+
+    ## Primary multiplicities
+    for name, pdgs in SPECIES.items():
+        sel = first_vtx & np.isin(abs_pdg, pdgs)
+        row["n_" + name] = np.bincount(prim_evt[sel], minlength=nevt)
+
+    ## Selection flags
+    masks = bs.event_masks(traj, prim)
+    row["is_ccinc"] = masks["n_muons"] > 0
+    row["muon_tagged"] = bs.is_muon_tagged_batch(seg, traj, prim, masks, acceptance)
+    row["hadronic_contained"] = bs.is_hadronic_contained_batch(seg, traj, prim, masks)
+    row["contained"] = row["muon_tagged"] & row["hadronic_contained"]
+
+    ## Where the muon leaves MINERvA (face -1 if it doesn't)
+    exits = ma.muon_exit_batch(seg, traj, prim, masks, acceptance)
+    row["muon_exit"] = exits["point"]
+    row["muon_exit_face"] = exits["face"]
+    return row
+
+
+def summarise_cache(cache_path, output_dir, acceptance=None):
+    """Write <output_dir>/<name>.summary.npz for one cache directory, return its path."""
+    cache = EventCache(cache_path)
+    nevt = len(cache)
+    print("Summarising", nevt, "events from", cache_path)
+
+    rows = []
+    for first in range(0, nevt, BATCH_SIZE):
+        rows.append(summarise_batch(cache.batch(first, min(first + BATCH_SIZE, nevt)), acceptance))
+
+    columns = {key: np.concatenate([r[key] for r in rows]) for key in rows[0]} if rows else {}
+    columns["entry"] = np.arange(nevt)
+
+    name = os.path.basename(os.path.normpath(cache_path))
+    if name.endswith(".cache"):
+        name = name[:-len(".cache")]
+    out_path = os.path.join(output_dir, name + ".summary.npz")
+    np.savez_compressed(out_path, source=np.array(cache.meta["source"]), **columns)
+    print("Wrote", nevt, "rows to", out_path)
+    return out_path
+
+
+def load_summaries(paths):
+    """Concatenate summary files into one dict of columns. Adds a "file" column with
+    the index into paths, which together with "entry" maps rows back to their event."""
+    columns = {}
+    for ifile, path in enumerate(paths):
+        with np.load(path) as summary:
+            for key in summary.files:
+                if key == "source": continue
+                columns.setdefault(key, []).append(summary[key])
+            columns.setdefault("file", []).append(np.full(len(summary["entry"]), ifile))
+    return {key: np.concatenate(values) for key, values in columns.items()}
+
+
+if __name__ == '__main__':
+
+    ## Get arguments
+    parser = OptionParser(usage="%prog -o <summary_dir> [-c <cache_dir>] <input.root or input.cache> [...]")
+    parser.add_option("-o", "--outDir", action="store", type="string", dest="outDir", default=".")
+    parser.add_option("-c", "--cacheDir", action="store", type="string", dest="cacheDir", default=None,
+                      help="Where to cache .root inputs (default: the output directory)")
+    parser.add_option("-m", "--minervaHex", action="store_true", dest="minervaHex", default=False,
+                      help="Tag muons with the hexagonal MINERvA from the geometry, not the cylinder")
+    (options, args) = parser.parse_args()
+
+    if len(args) < 1:
+        print("At least one edep-sim file or cache directory is required as an argument!")
+        sys.exit()
+
+    cache_dir = options.cacheDir or options.outDir
+    acceptance = ma.load_acceptance() if options.minervaHex else None
+    os.makedirs(options.outDir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for file in args:
+        ## Allow for escaped wildcards in the input...
+        for f in sorted(glob(file)):
+            if f.endswith(".root"):
+                cache_path = get_cache(f, cache_dir).path
+            else:
+                cache_path = f
+            summarise_cache(cache_path, options.outDir, acceptance)